@@ -6,12 +6,15 @@ which all airlines provide the service
 with dep time and arrival time for any date in future
 """
 import requests
+import httpx
 import os
 from dotenv import load_dotenv
 from pprint import pprint
 from pydantic import TypeAdapter
 
 from backend.business_logic.pydantic_models import AirportModel
+from backend.api_requests.http_client import get_provider_client
+from backend.api_requests.single_flight import coalesce, coalesce_async
 from backend.utilities.time_travel import (get_current_date, is_valid_date_string,
                                            get_current_datetime, add_minutes_to_datetime,
                                            is_dates_in_order, parse_time)
@@ -29,10 +32,7 @@ BASE_URL = "https://aerodatabox.p.rapidapi.com/"
 def call_api(url,params=None):
 
     try:
-        if params:
-            response = requests.get(url, headers=RAPID_API_HEADERS, params=params)
-        else:
-            response = requests.get(url, headers=RAPID_API_HEADERS)
+        response = get_provider_client("aerodatabox").get(url, headers=RAPID_API_HEADERS, params=params)
         if response.status_code != requests.codes.ok:
             raise Exception(f"API Error: {response.json().get('message')}")
         return response.json()
@@ -41,6 +41,18 @@ def call_api(url,params=None):
         raise Exception(f"Request failed: {error}") from error
 
 
+async def async_call_api(url, params=None):
+    """Same as call_api, but awaits the response instead of blocking the event loop"""
+    try:
+        response = await get_provider_client("aerodatabox").get_async(
+            url, headers=RAPID_API_HEADERS, params=params)
+        if response.status_code != requests.codes.ok:
+            raise Exception(f"API Error: {response.json().get('message')}")
+        return response.json()
+    except httpx.HTTPError as error:
+        raise Exception(f"Request failed: {error}") from error
+
+
 def get_airport_by_code(code):
     """Airport API: airport by code"""
     url = BASE_URL + "airports/iata/{code}"
@@ -49,6 +61,7 @@ def get_airport_by_code(code):
     print(airport_json)
 
 
+@coalesce
 def search_airports_by_location(latitude,longitude,radius=100):
     """Airport API: To get the nearby airports"""
     url = BASE_URL + "airports/search/location"
@@ -57,30 +70,52 @@ def search_airports_by_location(latitude,longitude,radius=100):
                    "withFlightInfoOnly": "true"}
 
     response_json = call_api(url, querystring)
+    return parse_airport_keys(response_json)
 
-    if response_json:
-        airports_json = response_json.get("items")
-        if airports_json:
-            # Take the key from json and use DB to fetch the additional airport details
-            airports_list = [airport.get("iata") for airport in airports_json]
-            # Below TypeAdapter No more needed as the logic is changed
-            #airports = TypeAdapter(list[AirportModel]).validate_python(airports_json)
-            return airports_list #(List of airports iata codes )
-    return None
 
+@coalesce_async
+async def search_airports_by_location_async(latitude, longitude, radius=100):
+    """Async variant of search_airports_by_location"""
+    url = BASE_URL + "airports/search/location"
+
+    querystring = {"lat": str(latitude), "lon": str(longitude), "radiusKm": str(radius), "limit": "10",
+                   "withFlightInfoOnly": "true"}
+
+    response_json = await async_call_api(url, querystring)
+    return parse_airport_keys(response_json)
 
+
+@coalesce
 def search_airport_by_ip(ip_address, radius=100):
     url = BASE_URL + "airports/search/ip"
 
     querystring = {"q": str(ip_address), "radiusKm": str(radius), "limit": "10", "withFlightInfoOnly": "true"}
 
     response_json = call_api(url, querystring)
+    return parse_airport_keys(response_json)
+
 
+@coalesce_async
+async def search_airport_by_ip_async(ip_address, radius=100):
+    """Async variant of search_airport_by_ip"""
+    url = BASE_URL + "airports/search/ip"
+
+    querystring = {"q": str(ip_address), "radiusKm": str(radius), "limit": "10", "withFlightInfoOnly": "true"}
+
+    response_json = await async_call_api(url, querystring)
+    return parse_airport_keys(response_json)
+
+
+def parse_airport_keys(response_json):
+    """Airport search APIs (location/ip) respond with a list of airports under items"""
     if response_json:
         airports_json = response_json.get("items")
         if airports_json:
-            airports_list = [ airport["iata"] for airport in airports_json if airport.get("iata")]
-            return airports_list
+            # Take the key from json and use DB to fetch the additional airport details
+            airports_list = [airport["iata"] for airport in airports_json if airport.get("iata")]
+            # Below TypeAdapter No more needed as the logic is changed
+            #airports = TypeAdapter(list[AirportModel]).validate_python(airports_json)
+            return airports_list #(List of airports iata codes )
     return None
 
 
@@ -134,6 +169,7 @@ def routes_from_airport(airport_code, date_str=None):
     return routes_list
 
 #####################################API needed for later requirements
+@coalesce
 def get_airport_schedules(
         airport_id,
         direction="Departure",
@@ -148,6 +184,25 @@ def get_airport_schedules(
     :param time_period: time duration in minutes
     :return:
     """
+    url, querystring = build_schedules_request(airport_id, direction, from_time, time_period)
+    response_json = call_api(url, querystring)
+    return parse_schedules(response_json, airport_id, direction)
+
+
+@coalesce_async
+async def get_airport_schedules_async(
+        airport_id,
+        direction="Departure",
+        from_time = None,
+        time_period = 720
+    ):
+    """Async variant of get_airport_schedules"""
+    url, querystring = build_schedules_request(airport_id, direction, from_time, time_period)
+    response_json = await async_call_api(url, querystring)
+    return parse_schedules(response_json, airport_id, direction)
+
+
+def build_schedules_request(airport_id, direction, from_time, time_period):
     if from_time is None:
         from_time = get_current_datetime()
     else:
@@ -166,7 +221,10 @@ def get_airport_schedules(
         "withPrivate": "false",
         "withLocation": "false"
     }
-    response_json = call_api(url, querystring)
+    return url, querystring
+
+
+def parse_schedules(response_json, airport_id, direction):
     if direction == "Departure":
         schedules_json = response_json.get("departures")
     else:
@@ -256,8 +314,8 @@ def get_flight_info(flight_id: str, date_str: str = get_current_date()):
     This API provides more technical details about the flights travel. Not relevant for now"""
     url = BASE_URL + f"flights/number/{flight_id}/{date_str}"
     querystring = {"withAircraftImage": "false", "withLocation": "false", "dateLocalRole": "Departure"}
-    response = requests.get(url,headers=RAPID_API_HEADERS, params= querystring)
-    print(response.json())
+    response_json = call_api(url, querystring)
+    print(response_json)
 
 if __name__ == "__main__":
     #get_airport_by_code("BLR")
@@ -10,6 +10,7 @@ NameSuggestion and nearby airports can be used
 import requests
 import os
 from dotenv import load_dotenv
+from backend.api_requests.http_client import get_provider_client
 from backend.utilities.string_theory import weekdays_to_number
 from backend.utilities.time_travel import parse_time
 
@@ -159,7 +160,7 @@ def get_airports():
     print(airports_json)
 
 def call_api(url):
-    response = requests.get(url)
+    response = get_provider_client("airlabs").get(url)
     if response.status_code != requests.codes.ok:
         return None
     return response.json().get("response")
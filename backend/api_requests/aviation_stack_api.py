@@ -11,7 +11,11 @@ this API is complicated
 """
 import requests
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from dotenv import load_dotenv
+from backend.api_requests.http_client import get_provider_client
 from backend.utilities.time_travel import convert_time
 
 #For API KEY
@@ -19,6 +23,7 @@ load_dotenv()
 API_KEY = "access_key=" + os.getenv("AVIATION_STACK_APIKEY")
 BASE_URL = "https://api.aviationstack.com/v1/"
 LIMIT = 1000
+PAGE_WORKERS = int(os.getenv("AVIATION_STACK_PAGE_WORKERS", "4"))
 
 
 def get_countries():
@@ -32,57 +37,59 @@ def get_countries():
 
 
 def get_cities():
-    url = f"{BASE_URL}cities?{API_KEY}&limit={LIMIT}"
-    total_available_cities = 9374
-    offset = 0
-    cities = []
-
-    while len(cities) < total_available_cities:
-        url_with_offset = url + f"&offset={offset}"
-        cities_json = call_api(url_with_offset)[0]
-        offset += len(cities_json)
-        print(cities_json)
-        city_list = [
-            {
-                "city_key": city["iata_code"],
-                "name": city["city_name"],
-                "country_key": city["country_iso2"],
-                "timezone": city.get("timezone"),
-                "latitude": city["latitude"],
-                "longitude": city["longitude"]
-            }
-            for city in cities_json
-        ]
-        cities.extend(city_list)
-        print(len(cities))
-    return cities
+    """Generator over all the cities, page after page as the API reports them"""
+    for cities, _next_offset, _total in get_city_pages():
+        yield from cities
 
 
 def get_airports():
-    url = f"{BASE_URL}airports?{API_KEY}&limit={LIMIT}"
-    total_available_airports = 6702
-    offset = 6699
-    airports = []
-
-    while len(airports) < total_available_airports:
-        url_with_offset = url + f"&offset={offset}"
-        airports_json = call_api(url_with_offset)[0]
-        offset += len(airports_json)
-        print(airports_json)
-
-        airports_list = [
-            {
-                "airport_key": airport["iata_code"],
-                "name": airport["airport_name"],
-                "city_key": airport["city_iata_code"],
-                "latitude": airport["latitude"],
-                "longitude": airport["longitude"]
-            }
-            for airport in airports_json
-        ]
-        airports.extend(airports_list)
-        print(len(airports))
-    return airports
+    """Generator over all the airports"""
+    for airports, _next_offset, _total in get_airport_pages():
+        yield from airports
+
+
+def parse_city(city: dict):
+    return {
+        "city_key": city["iata_code"],
+        "name": city["city_name"],
+        "country_key": city["country_iso2"],
+        "timezone": city.get("timezone"),
+        "latitude": city["latitude"],
+        "longitude": city["longitude"]
+    }
+
+
+def parse_airport(airport: dict):
+    return {
+        "airport_key": airport["iata_code"],
+        "name": airport["airport_name"],
+        "city_key": airport["city_iata_code"],
+        "latitude": airport["latitude"],
+        "longitude": airport["longitude"]
+    }
+
+
+def parse_airline(airline: dict):
+    return {
+        "airline_id": airline["icao_code"],
+        "name": airline["airline_name"],
+        "hub_airport": airline["hub_code"],
+        "airline_code": airline["iata_code"],
+        "id": airline["airline_id"]
+    }
+
+
+def parse_route(route: dict):
+    return {
+        "flight_id" : get_flight_id(route),
+        "orig_airport": route["departure"]["iata"],
+        "dest_airport": route["arrival"]["iata"],
+        "status": "active",
+        "dep_time": route["departure"]["time"],
+        "arr_time": route["arrival"]["time"],
+        "airline": route["airline"]["iata"]
+    }
+
 
 def is_airline_valid(airline: dict):
 
@@ -101,32 +108,10 @@ def is_airline_valid(airline: dict):
     return True
 
 
-def get_airlines(offset=0, package=1000):
-    limit = package
-    url = f"{BASE_URL}airlines?{API_KEY}&limit={limit}"
-    #total_available_airlines = 13164
-    airlines = []
-
-    while len(airlines) < package:
-        url_with_offset = url + f"&offset={offset}"
-        airlines_json = call_api(url_with_offset)[0]
-        offset += len(airlines_json)
-        print(airlines_json)
-
-        airlines_list = [
-            {
-                "airline_id": airline["icao_code"],
-                "name": airline["airline_name"],
-                "hub_airport": airline["hub_code"],
-                "airline_code": airline["iata_code"],
-                "id": airline["airline_id"]
-            }
-            for airline in airlines_json
-            if is_airline_valid(airline)
-        ]
-        airlines.extend(airlines_list)
-        print(len(airlines))
-    return airlines
+def get_airlines(offset=0):
+    """Generator over the valid airlines from offset on"""
+    for airlines, _next_offset, _total in get_airline_pages(offset):
+        yield from airlines
 
 
 def get_flight_id(route: dict):
@@ -160,19 +145,7 @@ def get_routes(
 
     routes_json, offset = call_api(url)
     print(routes_json)
-    routes_list = [
-        {
-            "flight_id" : get_flight_id(route),
-            "orig_airport": route["departure"]["iata"],
-            "dest_airport": route["arrival"]["iata"],
-            "status": "active",
-            "dep_time": route["departure"]["time"],
-            "arr_time": route["arrival"]["time"],
-            "airline": route["airline"]["iata"]
-        }
-        for route in routes_json
-        if is_route_valid(route)
-    ]
+    routes_list = [parse_route(route) for route in routes_json if is_route_valid(route)]
     return routes_list
 
 
@@ -194,13 +167,110 @@ def get_airport_schedules(
     schedules_json = call_api(url)
     print(schedules_json[0])
 
-def call_api(url):
-    response = requests.get(url)
+def get_pages(endpoint: str, parse, is_valid=None, offset: int = 0, query: str = "",
+              max_workers: int = PAGE_WORKERS):
+    """Generator over the pages of a list endpoint from offset on: (parsed records, offset of
+    the next page, total). The offset of the next page is None after the last page.
+    The first page tells the total and the page size, the remaining pages are fetched in
+    parallel by a bounded pool (max_workers pages in flight, on top of the rate limit of the
+    provider client) and yielded in page order, so the offsets can be used to resume a load"""
+    url = f"{BASE_URL}{endpoint}?{API_KEY}&limit={LIMIT}{query}"
+
+    def fetch(page_offset):
+        page = call_api_page(url + f"&offset={page_offset}")
+        if page is None:
+            raise Exception(f"API Error: {endpoint} at offset {page_offset}")
+        return page
+
+    def parse_page(records_json):
+        return [parse(record) for record in records_json if is_valid is None or is_valid(record)]
+
+    def check_page(page_offset, records_json, page_size):
+        """A page short of records before the total would skip them silently. The load stops
+        instead, its checkpoint stays before the page so it can be resumed"""
+        expected = min(page_size, total - page_offset)
+        if len(records_json) < expected:
+            raise Exception(f"API Error: {endpoint} at offset {page_offset} returned "
+                            f"{len(records_json)} of {expected} records")
+
+    records_json, pagination = fetch(offset)
+    total = pagination["total"]
+    # The API can cap the limit of a plan, the pages are as large as the first one is
+    page_size = len(records_json)
+    if not page_size and offset < total:
+        raise Exception(f"API Error: {endpoint} at offset {offset} returned no records of {total}")
+    next_offset = get_next_offset(pagination) if records_json else None
+    yield parse_page(records_json), next_offset, total
+    if next_offset is None:
+        return
+
+    page_offsets = iter(range(next_offset, total, page_size))
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="aviationstack-page")
+    try:
+        pending = deque(
+            (page_offset, executor.submit(fetch, page_offset))
+            for page_offset in islice(page_offsets, max_workers)
+        )
+        while pending:
+            page_offset, future = pending.popleft()
+            records_json, pagination = future.result()
+            # Keep the pool busy while the caller works on this page
+            following = next(page_offsets, None)
+            if following is not None:
+                pending.append((following, executor.submit(fetch, following)))
+            check_page(page_offset, records_json, page_size)
+            next_offset = page_offset + page_size
+            if next_offset >= total:
+                next_offset = None
+            yield parse_page(records_json), next_offset, total
+            if next_offset is None:
+                break
+    finally:
+        # Pages not yet started are not needed when the caller stops early or a page failed
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def get_city_pages(offset: int = 0):
+    return get_pages("cities", parse_city, offset=offset)
+
+
+def get_airport_pages(offset: int = 0):
+    return get_pages("airports", parse_airport, offset=offset)
+
+
+def get_airline_pages(offset: int = 0):
+    return get_pages("airlines", parse_airline, is_airline_valid, offset=offset)
+
+
+def get_route_pages(from_airport: str, offset: int = 0):
+    """Paid plan required"""
+    return get_pages("routes", parse_route, is_route_valid, offset=offset,
+                     query=f"&dep_iata={from_airport}")
+
+
+def get_next_offset(pagination: dict):
+    next_offset = pagination["offset"] + pagination["count"]
+    if pagination["total"] > next_offset:
+        return next_offset
+    return None
+
+
+def call_api_page(url):
+    """Records and pagination of one page, None if the API responds with an error"""
+    response = get_provider_client("aviationstack").get(url)
     if response.status_code != requests.codes.ok:
         return None
-    pagination = response.json()["pagination"]
+    response_json = response.json()
+    return response_json["data"], response_json["pagination"]
+
+
+def call_api(url):
+    page = call_api_page(url)
+    if page is None:
+        return None
+    data, pagination = page
     offset = 0
     if pagination["total"] > pagination["limit"] + pagination["offset"]:
         offset = pagination["limit"] + pagination["offset"]
-    return response.json()["data"], offset
+    return data, offset
 
@@ -0,0 +1,197 @@
+"""Shared HTTP client layer for the provider APIs (AeroDataBox, AviationStack, Airlabs, abstractapi)
+Every provider has one ProviderClient per process with
+- a requests.Session, so the connections (and TLS handshakes) to the host are pooled and reused
+- connect/read timeouts, so a hung upstream cannot block a worker indefinitely
+- retries with exponential, jittered backoff for connection errors, 429 and 5xx responses,
+  a Retry-After of the provider is followed up to BACKOFF_MAX
+- a token bucket rate limiter tuned to the quota of the provider, every attempt (retries
+  included) takes a token
+The async execution mode uses the same settings through one shared httpx.AsyncClient.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+CONNECT_TIMEOUT = float(os.getenv("PROVIDER_CONNECT_TIMEOUT", "3.05"))
+READ_TIMEOUT = float(os.getenv("PROVIDER_READ_TIMEOUT", "10"))
+RETRIES = int(os.getenv("PROVIDER_RETRIES", "2"))
+BACKOFF_FACTOR = 0.5     # 0.5s, 1s, 2s ... plus jitter
+BACKOFF_JITTER = 0.5
+BACKOFF_MAX = 8
+POOL_SIZE = int(os.getenv("PROVIDER_POOL_SIZE", "10"))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+@dataclass(frozen=True)
+class ProviderSettings:
+    rate_per_second: float  # Sustained request rate allowed by the provider plan
+    burst: int              # Requests that may be sent at once before the rate applies
+
+
+# Defaults follow the plans in use, they can be changed with <NAME>_RATE_PER_SECOND / <NAME>_BURST
+PROVIDER_SETTINGS = {
+    "aerodatabox": ProviderSettings(rate_per_second=5, burst=6),   # RapidAPI, per second quota
+    "aviationstack": ProviderSettings(rate_per_second=2, burst=4),
+    "airlabs": ProviderSettings(rate_per_second=5, burst=5),
+    "abstractapi": ProviderSettings(rate_per_second=1, burst=1),   # Free tier: 1 request/second
+}
+
+
+class TokenBucket:
+    """Thread-safe token bucket. reserve() books the next free slot and returns how long the
+    caller has to wait for it, so the same bucket works for threads and coroutines"""
+    def __init__(self, rate_per_second: float, burst: int):
+        self.rate = rate_per_second
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        wait = self.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+
+def backoff_delay(attempt: int) -> float:
+    delay = min(BACKOFF_FACTOR * (2 ** attempt), BACKOFF_MAX)
+    return delay + random.uniform(0, BACKOFF_JITTER)
+
+
+def retry_delay(attempt: int, retry_after: str | None = None) -> float:
+    """Wait before the next attempt. A Retry-After (seconds or HTTP date) is followed, but never
+    longer than BACKOFF_MAX, a throttling provider must not pin a worker"""
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                delay = None
+        if delay is not None:
+            return min(max(delay, 0.0), BACKOFF_MAX)
+    return backoff_delay(attempt)
+
+
+class ProviderClient:
+    def __init__(self, name: str, settings: ProviderSettings):
+        self.name = name
+        prefix = name.upper()
+        self.rate_limiter = TokenBucket(
+            float(os.getenv(f"{prefix}_RATE_PER_SECOND", settings.rate_per_second)),
+            int(os.getenv(f"{prefix}_BURST", settings.burst)),
+        )
+        self.timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+        self.session = requests.Session()
+        # No urllib3 retries: they would bypass the rate limiter, get retries itself
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, url, **kwargs) -> requests.Response:
+        """GET with the provider's rate limit, timeouts and retries. After the last retry the
+        response is returned whatever its status, call_api reports the error.
+        Raises requests.exceptions.RequestException (Timeout, ConnectionError...)"""
+        kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            retry_after = None
+            try:
+                response = self.session.get(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= RETRIES:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= RETRIES:
+                    return response
+                retry_after = response.headers.get("Retry-After")
+                response.close()
+            time.sleep(retry_delay(attempt, retry_after))
+            attempt += 1
+
+    async def get_async(self, url, headers=None, params=None) -> httpx.Response:
+        """Async variant of get. Raises httpx.HTTPError"""
+        client = get_async_client()
+        # httpx does not silently drop unset headers like requests does
+        if headers:
+            headers = {key: value for key, value in headers.items() if value is not None}
+        attempt = 0
+        while True:
+            await self.rate_limiter.acquire_async()
+            retry_after = None
+            try:
+                response = await client.get(url, headers=headers, params=params)
+            except httpx.TransportError:
+                if attempt >= RETRIES:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= RETRIES:
+                    return response
+                retry_after = response.headers.get("Retry-After")
+            await asyncio.sleep(retry_delay(attempt, retry_after))
+            attempt += 1
+
+
+_providers: dict[str, ProviderClient] = {}
+_providers_lock = threading.Lock()
+
+
+def get_provider_client(name: str) -> ProviderClient:
+    """One client (connection pool, rate limiter) per provider and process"""
+    client = _providers.get(name)
+    if client is None:
+        with _providers_lock:
+            client = _providers.get(name)
+            if client is None:
+                client = _providers[name] = ProviderClient(name, PROVIDER_SETTINGS[name])
+    return client
+
+
+_async_client: httpx.AsyncClient | None = None
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """One AsyncClient per process, it keeps the connections to the providers alive"""
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=POOL_SIZE * len(PROVIDER_SETTINGS),
+                                max_keepalive_connections=POOL_SIZE),
+        )
+    return _async_client
+
+
+async def close_async_client():
+    """To be called when the application shuts down"""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
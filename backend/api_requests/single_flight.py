@@ -0,0 +1,83 @@
+"""Request coalescing (single flight) for the provider APIs.
+When several requests need the same upstream call at the same time (e.g. the schedules of a
+popular airport that is not in the DB yet), only the first one calls the provider, the others
+wait for it and get the same result (or exception). Nothing is cached, as soon as the call is
+finished the next identical call goes to the provider again.
+The result object is shared by all the waiting callers, so it has to be treated as read-only.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """Coalesces calls from different threads"""
+    def __init__(self):
+        self._calls: dict[tuple, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = Future()
+        if not is_leader:
+            return call.result()
+        try:
+            result = function(*args, **kwargs)
+            call.set_result(result)
+            return result
+        except BaseException as error:
+            call.set_exception(error)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class AsyncSingleFlight:
+    """Coalesces coroutine calls within one event loop"""
+    def __init__(self):
+        self._calls: dict[tuple, asyncio.Future] = {}
+
+    async def do(self, key, function, *args, **kwargs):
+        call = self._calls.get(key)
+        if call is not None:
+            # shield: a cancelled follower must not cancel the call of the others
+            return await asyncio.shield(call)
+        call = self._calls[key] = asyncio.ensure_future(function(*args, **kwargs))
+        try:
+            return await asyncio.shield(call)
+        finally:
+            if call.done():
+                self._calls.pop(key, None)
+            else:
+                # The leader was cancelled, the followers still wait for the call
+                call.add_done_callback(lambda _call: self._calls.pop(key, None))
+
+
+_single_flight = SingleFlight()
+_async_single_flight = AsyncSingleFlight()
+
+
+def call_key(function, args, kwargs):
+    return function.__module__, function.__qualname__, args, tuple(sorted(kwargs.items()))
+
+
+def coalesce(function):
+    """Decorator: concurrent calls with the same arguments share one upstream call"""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        return _single_flight.do(call_key(function, args, kwargs), function, *args, **kwargs)
+    return wrapper
+
+
+def coalesce_async(function):
+    """Decorator: coalesce for coroutine functions"""
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        return await _async_single_flight.do(
+            call_key(function, args, kwargs), function, *args, **kwargs)
+    return wrapper
@@ -1,10 +1,34 @@
+import os
 import requests
 import uvicorn
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from backend.routes.user_endpoints import router
+from backend.routes.async_endpoints import async_router
+from backend.api_requests.http_client import close_async_client
+from backend.business_logic.reference_data import load_snapshot
+from backend.utilities.compression import CompressionMiddleware
+from backend.database.orm_models import SessionLocal
+from sqlalchemy.exc import SQLAlchemyError
 
-app = FastAPI()
+# Async execution mode: location and flight endpoints use the async engine and provider clients
+ASYNC_MODE = os.getenv("WANDERLUST_ASYNC_MODE", "false").lower() in ("1", "true", "yes")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm the reference data snapshot, if it fails here it is loaded by the first request
+    try:
+        with SessionLocal() as db:
+            load_snapshot(db)
+    except SQLAlchemyError as error:
+        print("Reference data could not be loaded at startup:", error)
+    yield
+    await close_async_client()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # 1. Define the origins that are allowed to talk to your API
 origins = [
@@ -20,8 +44,15 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],             # Allows all HTTP methods (GET, POST, etc.)
     allow_headers=["*"],             # Allows all headers
+    expose_headers=["X-Next-Cursor"],  # Lets the frontend read the pagination cursor
 )
 
+# 3. Compress the (large, repetitive JSON) responses, see compression.py
+app.add_middleware(CompressionMiddleware)
+
+if ASYNC_MODE:
+    # Registered first, so these routes take precedence over the same paths in router
+    app.include_router(async_router)
 app.include_router(router)
 
 def checking_aviation_stack():
@@ -0,0 +1,115 @@
+"""Airport autocomplete over the reference data snapshot.
+The airport code and name, the city code and name and the country code and name of every airport
+are folded (accents removed, lower case) and split into words. Three sorted lists answer a query
+word with a bisect each: the whole texts, the words (prefix match) and the inner suffixes of the
+words (n-grams inside a word, as the old client side substring search found them). Each list
+keeps the airports of its entries as one numpy array in list order, so the airports of a prefix
+range are one slice and the query is a few vectorized mask operations. Every word of the query
+has to match.
+
+Ranking: exact code match first, then tier, then how the query matches (start of a code/name,
+start of a word, inside a word), then the airport name.
+"""
+import re
+import unicodedata
+from bisect import bisect_left
+from functools import lru_cache
+
+import numpy as np
+
+from .spatial_index import DEFAULT_TIER
+
+SEARCH_LIMIT = 10
+WORD_SPLIT = re.compile(r"[^\w]+")
+MIN_SUFFIX = 2  # Shorter inner suffixes match too much to be useful
+
+
+@lru_cache(maxsize=65536)  # City and country names repeat for every airport
+def fold(text: str | None) -> str:
+    """Lower case without accents: "São Paulo" -> "sao paulo" """
+    if not text:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+
+def words(text: str) -> list[str]:
+    return [word for word in WORD_SPLIT.split(text) if word]
+
+
+class PrefixIndex:
+    """Sorted keys with the airport positions of every key in one array"""
+    def __init__(self, entries: dict[str, set[int]]):
+        self.keys = sorted(entries)
+        self.starts = np.zeros(len(self.keys) + 1, dtype=np.int64)
+        self.starts[1:] = np.cumsum([len(entries[key]) for key in self.keys])
+        self.positions = np.fromiter(
+            (position for key in self.keys for position in sorted(entries[key])),
+            dtype=np.int32, count=int(self.starts[-1]))
+
+    def mask(self, prefix: str, size: int) -> np.ndarray:
+        """Airports with a key starting with prefix"""
+        low = bisect_left(self.keys, prefix)
+        high = bisect_left(self.keys, prefix + "\U0010ffff", low)
+        mask = np.zeros(size, dtype=bool)
+        mask[self.positions[self.starts[low]:self.starts[high]]] = True
+        return mask
+
+
+class AirportSearchIndex:
+    def __init__(self, snapshot):
+        # Positions are in ranking order without a query: tier and name
+        self.airports = sorted(
+            snapshot.airports,
+            key=lambda airport: (airport.get("tier") or DEFAULT_TIER, fold(airport["name"])))
+        self.tiers = np.array(
+            [airport.get("tier") or DEFAULT_TIER for airport in self.airports], dtype=np.int64)
+        codes, texts, prefixes, suffixes = {}, {}, {}, {}
+        for position, airport in enumerate(self.airports):
+            city = snapshot.cities.get(airport["city_key"]) or {}
+            country = snapshot.countries.get(city.get("country_key")) or {}
+            # Only the airport and city codes count as an exact code match
+            for code in (airport["airport_key"], airport["city_key"]):
+                if code:
+                    codes.setdefault(fold(code), set()).add(position)
+            for text in (airport["airport_key"], airport["city_key"], city.get("country_key"),
+                         airport["name"], city.get("name"), country.get("name")):
+                text = " ".join(words(fold(text)))
+                if not text:
+                    continue
+                texts.setdefault(text, set()).add(position)
+                for word in words(text):
+                    prefixes.setdefault(word, set()).add(position)
+                    for start in range(1, len(word) - MIN_SUFFIX + 1):
+                        suffixes.setdefault(word[start:], set()).add(position)
+        self.codes = {code: np.array(sorted(positions)) for code, positions in codes.items()}
+        self.texts = PrefixIndex(texts)
+        self.prefixes = PrefixIndex(prefixes)
+        self.suffixes = PrefixIndex(suffixes)
+
+    def __len__(self):
+        return len(self.airports)
+
+    def search(self, query: str, limit: int = SEARCH_LIMIT) -> list[dict]:
+        query_words = words(fold(query))
+        if not query_words:
+            return []
+        query = " ".join(query_words)
+        size = len(self.airports)
+        word_start = np.ones(size, dtype=bool)     # Every query word starts a word
+        matched = np.ones(size, dtype=bool)        # Every query word is in a word
+        for query_word in query_words:
+            prefix = self.prefixes.mask(query_word, size)
+            word_start &= prefix
+            matched &= prefix | self.suffixes.mask(query_word, size)
+        candidates = np.flatnonzero(matched)
+        if not len(candidates):
+            return []
+
+        # 0 starts a code/name, 1 starts words, 2 inside a word
+        quality = np.where(word_start[candidates], 1, 2)
+        quality[self.texts.mask(query, size)[candidates]] = 0
+        exact = np.zeros(size, dtype=bool)
+        exact[self.codes.get(query, [])] = True
+        order = np.lexsort((candidates, quality, self.tiers[candidates], ~exact[candidates]))
+        return [self.airports[position] for position in candidates[order[:limit]]]
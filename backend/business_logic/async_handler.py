@@ -0,0 +1,195 @@
+"""Async execution mode of the handler functions used by the location and flight endpoints.
+The logic is the same as in handler.py, but the database is accessed through an AsyncSession
+and the provider APIs through the async clients, so a slow provider never blocks the event loop.
+"""
+
+from datetime import datetime
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from .pydantic_models import AirportModel, CityModel
+from .handler import (
+    get_airports_from_index, ip_airports_cache, nearby_airports_cache, nearby_cache_key,
+    cache_airports, expand_airports, get_fetch_windows)
+from . import reference_data
+
+from backend.database.async_datamanager import AsyncAirportRepo, AsyncUserRepository
+from backend.database.orm_models import SessionLocal
+from backend.utilities.where_is_waldo import get_location_from_ip_async
+from backend.utilities import geo_ip, passwords
+from .schedule_freshness import (
+    find_stale_windows, fetch_schedules_async, refresh_in_background_async)
+
+import backend.api_requests.aerodata_api as aerodata
+
+
+def check_reference_data():
+    with SessionLocal() as db_session:
+        return reference_data.get_snapshot(db_session)
+
+
+async def get_reference_data():
+    """Async variant of handler.get_reference_data. The version check is a sync query and a
+    rebuild serializes every airport (behind a lock a thread pool request may hold), so both
+    run in the thread pool, never on the event loop"""
+    snapshot = reference_data.fresh_snapshot()
+    if snapshot is None:
+        snapshot = await run_in_threadpool(check_reference_data)
+    return snapshot
+
+
+async def get_airports_by_location(db_object, latitude, longitude, radius=100, snapshot=None):
+
+    if isinstance(db_object, AsyncSession):
+        airport_db = AsyncAirportRepo(db_object)
+    elif isinstance(db_object, AsyncAirportRepo):
+        airport_db = db_object
+    else:
+        raise ValueError("Cannot do a DB select to fetch the airports by location")
+    if snapshot is None:
+        snapshot = await get_reference_data()
+    cache_key, (latitude, longitude) = nearby_cache_key(snapshot, latitude, longitude, radius)
+    airports_list = nearby_airports_cache.get(cache_key)
+    if airports_list is None:
+        airports_list = cache_airports(
+            nearby_airports_cache, cache_key,
+            await find_airports_by_location(airport_db, snapshot, latitude, longitude, radius))
+    return airports_list
+
+
+async def find_airports_by_location(airport_db, snapshot, latitude, longitude, radius=100):
+    # Using the spatial index
+    airports_list = get_airports_from_index(snapshot, latitude, longitude, radius)
+    if airports_list:
+        return airports_list
+    # Using Aerodata API
+    airport_keys = await aerodata.search_airports_by_location_async(
+        latitude, longitude, radius)
+    if airport_keys:
+        airports_list = await airport_db.get_airports(airport_keys)
+        return airports_list
+    # Using Database
+    airports_list = await airport_db.get_airports_within_radius(latitude, longitude, radius)
+    if airports_list:
+        return airports_list
+    return None
+
+
+async def find_nearby_airports(db_session, client_meta, radius=100):
+    """Async variant of handler.find_nearby_airports"""
+    airport_db = AsyncAirportRepo(db_session)
+    # One snapshot for the cache keys and the spatial index of the whole lookup
+    snapshot = await get_reference_data()
+    if client_meta.get("location"):
+        latitude = client_meta["location"][0]
+        longitude = client_meta["location"][1]
+        airports_list = await get_airports_by_location(
+            airport_db, latitude, longitude, radius, snapshot)
+        return airports_list
+
+    if client_meta.get("ip"):
+        client_ip = client_meta["ip"]
+        cache_key = (client_ip, radius, snapshot.version)
+        airports_list = ip_airports_cache.get(cache_key)
+        if airports_list is not None:
+            return airports_list
+        airports_list = None
+        location = geo_ip.lookup(client_ip)
+        if location:
+            airports_list = await get_airports_by_location(
+                airport_db, location.latitude, location.longitude, radius, snapshot)
+        if not airports_list:
+            airport_keys = await aerodata.search_airport_by_ip_async(client_ip)
+            if airport_keys:
+                airports_list = await airport_db.get_airports(airport_keys)
+        if not airports_list:
+            location = await get_location_from_ip_async(client_ip)
+            if location:
+                airports_list = await get_airports_by_location(
+                    airport_db, location[0], location[1], radius, snapshot)
+        return cache_airports(ip_airports_cache, cache_key, airports_list)
+    return None
+
+
+async def get_user_by_cred(db_session, password: str, username: str | None = None,
+                           email: str | None = None):
+    """Async variant of handler.User.get_user_by_cred, the password is verified (and re-hashed)
+    in the hashing pool while the event loop serves other requests"""
+    if username is None and email is None:
+        raise Exception("User Details cannot be retrieved!")
+    user_db = AsyncUserRepository(db_session)
+    user = await user_db.select_user_by_cred(username, email)
+    if not user:
+        raise Exception("Unknown Account")
+    # No connection is held while waiting for a hashing worker
+    stored_password = user.password
+    await user_db.release_connection()
+    if not await passwords.verify_async(password, stored_password):
+        raise Exception("User name and password do not match")
+    if passwords.needs_rehash(stored_password):
+        await user_db.set_password(user, await passwords.hash_async(password))
+    # Loaded again, with what UserOut serializes
+    return await user_db.select_user_by_cred(username, email, with_details=True)
+
+
+async def get_iata_code(db_session, iata_code, iata_type):
+    """Check whether IATA code is a city/airport"""
+    airport_db = AsyncAirportRepo(db_session)
+    if iata_type == "airport":
+        airport = await airport_db.get_airport(iata_code)
+        if airport:
+            return AirportModel.model_validate(airport)
+    if iata_type == "city":
+        city = await airport_db.get_city(iata_code)
+        if city:
+            return CityModel.model_validate(city)
+    return None
+
+
+async def get_flights(
+        db_session,
+        direction: str,
+        from_airport: AirportModel | None = None,
+        from_city: CityModel | None = None,
+        to_airport: AirportModel | None = None,
+        to_city: CityModel | None = None,
+        timestamp: datetime | None = None,
+    ):
+    """Async variant of handler.get_flights"""
+    if not from_airport and not from_city and not to_airport and not to_city:
+        raise Exception("Either origin or destination is required!")
+
+    if direction == "Departure":
+        dep_time = timestamp.time() if timestamp is not None else None
+        arr_time = None
+    else:    # (Arrival)
+        arr_time = timestamp.time() if timestamp is not None else None
+        dep_time = None
+
+    airport_db = AsyncAirportRepo(db_session)
+    from_airports = expand_airports(from_airport, from_city)
+    to_airports = expand_airports(to_airport, to_city)
+
+    routes = await airport_db.get_airport_schedules(
+        from_airports, to_airports, dep_time, arr_time
+        )
+    airport_keys = from_airports + to_airports
+    windows = get_fetch_windows(await get_reference_data(), airport_keys, timestamp)
+    fetch_log = await airport_db.get_fetch_log(airport_keys, direction, sorted(set(windows.values())))
+    stale = find_stale_windows(fetch_log, windows)
+    if routes:
+        if stale:
+            refresh_in_background_async(stale, direction)
+        return routes
+    if not stale:
+        return None
+
+    # Using Aerodata API, one call per airport and window, all of them in parallel
+    routes = await fetch_schedules_async(airport_db, stale, direction)
+    if routes:
+        if from_airports and to_airports:
+            routes = await airport_db.get_airport_schedules(
+                from_airports, to_airports, dep_time, arr_time
+            )
+        return routes
+    return None
@@ -0,0 +1,155 @@
+"""Compact airports payload of the reference data snapshot (GET /airports/compact).
+GET /airports repeats the city and the country of every airport. Here the countries and cities
+are sent once as lookup tables and the airports as columns (one array per field), the city of
+an airport is an index into the city table and the country of a city an index into the country
+table. Only the cities and countries of the selected airports are included.
+
+    {"version": 7, "count": 2,
+     "countries": {"country_key": ["DE"], "name": ["Germany"]},
+     "cities": {"city_key": ["FRA", "MUC"], "name": ["Frankfurt", "Munich"], "country": [0, 0]},
+     "airports": {"airport_key": ["FRA", "MUC"], "name": [...], "city": [0, 1],
+                  "latitude": [50.03333, 48.35378], "longitude": [...], "tier": [1, 1]}}
+
+Airports can be filtered by tier, country and bounding box on the server, the airport columns
+can be selected with fields. The body is JSON or, with the optional msgpack package, MessagePack.
+"""
+import hashlib
+import json
+
+try:
+    import msgpack
+except ImportError:  # MessagePack output is optional
+    msgpack = None
+
+AIRPORT_FIELDS = ("name", "city", "latitude", "longitude", "tier")
+COORDINATE_DIGITS = 5   # About 1 m
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+MEDIA_TYPES = {"json": JSON, "msgpack": MSGPACK}
+
+
+def parse_fields(fields: str | None) -> tuple[str, ...]:
+    """Comma separated airport columns, airport_key is always sent"""
+    if not fields:
+        return AIRPORT_FIELDS
+    selected = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = set(selected) - set(AIRPORT_FIELDS) - {"airport_key"}
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return tuple(field for field in AIRPORT_FIELDS if field in selected)
+
+
+def parse_bbox(bbox: str | None) -> tuple[float, float, float, float] | None:
+    """min_lon,min_lat,max_lon,max_lat; min_lon > max_lon crosses the antimeridian"""
+    if not bbox:
+        return None
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(value) for value in bbox.split(","))
+    except ValueError:
+        raise ValueError("bbox must be min_lon,min_lat,max_lon,max_lat") from None
+    if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lon <= 180 and -180 <= max_lon <= 180):
+        raise ValueError("bbox is out of range")
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def in_bbox(airport: dict, bbox) -> bool:
+    min_lon, min_lat, max_lon, max_lat = bbox
+    if not min_lat <= airport["latitude"] <= max_lat:
+        return False
+    if min_lon <= max_lon:
+        return min_lon <= airport["longitude"] <= max_lon
+    return airport["longitude"] >= min_lon or airport["longitude"] <= max_lon
+
+
+def build_compact(snapshot, tiers=None, countries=None, bbox=None,
+                  fields: tuple[str, ...] = AIRPORT_FIELDS) -> dict:
+    tiers = set(tiers) if tiers else None
+    countries = {country.upper() for country in countries} if countries else None
+    airports = []
+    for airport in snapshot.airports:
+        if tiers is not None and airport["tier"] not in tiers:
+            continue
+        if countries is not None:
+            city = snapshot.cities.get(airport["city_key"]) or {}
+            if city.get("country_key") not in countries:
+                continue
+        if bbox is not None and not in_bbox(airport, bbox):
+            continue
+        airports.append(airport)
+
+    city_index, country_index = {}, {}
+    city_columns = {"city_key": [], "name": [], "country": []}
+    country_columns = {"country_key": [], "name": []}
+    airport_columns = {"airport_key": [], **{field: [] for field in fields}}
+    for airport in airports:
+        airport_columns["airport_key"].append(airport["airport_key"])
+        for field in fields:
+            if field == "city":
+                airport_columns["city"].append(
+                    _lookup(snapshot, airport["city_key"], city_index, city_columns,
+                            country_index, country_columns))
+            elif field in ("latitude", "longitude"):
+                airport_columns[field].append(round(airport[field], COORDINATE_DIGITS))
+            else:
+                airport_columns[field].append(airport[field])
+    return {
+        "version": snapshot.version,
+        "count": len(airports),
+        "countries": country_columns,
+        "cities": city_columns,
+        "airports": airport_columns,
+    }
+
+
+def _lookup(snapshot, city_key, city_index, city_columns, country_index, country_columns):
+    """Index of the city in the city table, added (with its country) on first use"""
+    if city_key is None:
+        return None
+    if city_key not in city_index:
+        city = snapshot.cities.get(city_key) or {"city_key": city_key}
+        country_key = city.get("country_key")
+        if country_key is not None and country_key not in country_index:
+            country_index[country_key] = len(country_columns["country_key"])
+            country_columns["country_key"].append(country_key)
+            country_columns["name"].append((snapshot.countries.get(country_key) or {}).get("name"))
+        city_index[city_key] = len(city_columns["city_key"])
+        city_columns["city_key"].append(city_key)
+        city_columns["name"].append(city.get("name"))
+        city_columns["country"].append(country_index.get(country_key))
+    return city_index[city_key]
+
+
+def encode(payload: dict, media_type: str) -> bytes:
+    if media_type == MSGPACK:
+        return msgpack.packb(payload, use_bin_type=True)
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def choose_media_type(output_format: str | None, accept: str | None) -> str:
+    """Explicit format first, else MessagePack if the client accepts it and it is available"""
+    if output_format:
+        if output_format not in MEDIA_TYPES:
+            raise ValueError(f"Unknown format: {output_format}")
+        if MEDIA_TYPES[output_format] == MSGPACK and msgpack is None:
+            raise LookupError("MessagePack is not available")
+        return MEDIA_TYPES[output_format]
+    if msgpack is not None and accept and any(
+            media_type.split(";")[0].strip() in (MSGPACK, "application/x-msgpack")
+            for media_type in accept.split(",")):
+        return MSGPACK
+    return JSON
+
+
+def get_compact(snapshot, media_type: str, tiers=None, countries=None, bbox=None,
+                fields: tuple[str, ...] = AIRPORT_FIELDS) -> tuple[bytes, str]:
+    """(body, ETag). Without country and bbox filters the body is kept with the snapshot,
+    the map asks for the same few tier/field combinations on every first load"""
+    def build(snapshot):
+        body = encode(build_compact(snapshot, tiers, countries, bbox, fields), media_type)
+        digest = hashlib.sha1(body).hexdigest()[:16]
+        return body, f'"{snapshot.version}-{digest}"'
+
+    if countries or bbox:
+        return build(snapshot)
+    tiers = tuple(sorted(set(tiers))) if tiers else None
+    return snapshot.derived(f"compact:{media_type}:{tiers}:{','.join(fields)}", build)
@@ -0,0 +1,319 @@
+"""Connection search (direct, 1 and 2 stop itineraries) over an in-memory timetable.
+The schedules are a daily timetable in the local time of each airport. For a travel date they are
+unrolled into absolute (UTC) minutes with the time zone of the airport's city, which makes times
+of different airports comparable and handles arrivals after midnight, and sorted by departure.
+A Connection Scan then walks the departures once in time order and keeps the earliest arrival
+at every airport per number of flights taken, with a minimum connection time between flights.
+
+The timetable is built from the Schedules table on first use and rebuilt every
+TIMETABLE_TTL_SECONDS (changes made by other processes), changes made by this process are
+applied straight away through the schedules listener of the repositories.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from datetime import date, datetime, time as day_time, timedelta, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from backend.database.datamanager import AirportRepo, on_schedules_changed
+from . import reference_data
+
+MIN_CONNECTION_MINUTES = int(os.getenv("MIN_CONNECTION_MINUTES", "45"))
+MAX_STOPS = 2
+SEARCH_HORIZON_MINUTES = 24 * 60  # Itineraries depart within a day of the requested time
+TIMETABLE_TTL = float(os.getenv("TIMETABLE_TTL_SECONDS", "600"))
+CACHED_DATES = 4
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+@lru_cache(maxsize=1024)
+def get_zone(zone_name: str | None):
+    if not zone_name:
+        return timezone.utc
+    try:
+        return ZoneInfo(zone_name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return timezone.utc
+
+
+@lru_cache(maxsize=16384)
+def utc_offset_minutes(zone_name: str | None, day: date) -> int:
+    """UTC offset of a time zone on a day (taken at noon, DST changes happen at night)"""
+    local_noon = datetime.combine(day, day_time(12), tzinfo=get_zone(zone_name))
+    return int(local_noon.utcoffset().total_seconds() // 60)
+
+
+def to_minutes(moment: datetime) -> int:
+    """Aware datetime -> minutes since the epoch (UTC)"""
+    return int((moment - EPOCH).total_seconds() // 60)
+
+
+def from_minutes(minutes: int, zone_name: str | None) -> datetime:
+    """Minutes since the epoch -> local (naive) datetime in the time zone"""
+    moment = EPOCH + timedelta(minutes=minutes)
+    return moment.astimezone(get_zone(zone_name)).replace(tzinfo=None)
+
+
+def minutes_of_day(value: day_time) -> int:
+    return value.hour * 60 + value.minute
+
+
+class Timetable:
+    def __init__(self, rows, zones: dict[str, str | None]):
+        self.zones = zones              # airport_key -> time zone name
+        self.flights = {}               # flight_id -> (orig, dest, dep minute, arr minute, airline)
+        self.routes = {}                # orig -> {dest: number of flights}
+        for row in rows:
+            self._set_flight(row)
+        # travel date -> connections sorted by departure:
+        # (dep minutes, arr minutes, orig airport, dest airport, flight_id)
+        self._dates = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _destinations(self, orig: str, copies: dict | None) -> dict:
+        """Destinations of an airport to change. In update they are copies (copies: orig -> copy),
+        put in place once all the changes are applied"""
+        if copies is None:
+            return self.routes.setdefault(orig, {})
+        if orig not in copies:
+            copies[orig] = dict(self.routes.get(orig, {}))
+        return copies[orig]
+
+    def _set_flight(self, row, copies: dict | None = None):
+        self._remove_flight(row["flight_id"], copies)
+        if row.get("dep_time") is None or row.get("arr_time") is None:
+            return
+        self.flights[row["flight_id"]] = (
+            row["orig_airport"], row["dest_airport"],
+            minutes_of_day(row["dep_time"]), minutes_of_day(row["arr_time"]), row.get("airline"))
+        destinations = self._destinations(row["orig_airport"], copies)
+        destinations[row["dest_airport"]] = destinations.get(row["dest_airport"], 0) + 1
+
+    def _remove_flight(self, flight_id: str, copies: dict | None = None):
+        flight = self.flights.pop(flight_id, None)
+        if flight is None:
+            return
+        destinations = self._destinations(flight[0], copies)
+        destinations[flight[1]] -= 1
+        if not destinations[flight[1]]:
+            del destinations[flight[1]]
+
+    def _connection(self, flight_id: str, flight: tuple, day: date):
+        orig, dest, dep, arr, _airline = flight
+        orig_offset = utc_offset_minutes(self.zones.get(orig), day)
+        dest_offset = utc_offset_minutes(self.zones.get(dest), day)
+        departure = (day - EPOCH.date()).days * 1440 + dep - orig_offset
+        # Local times only, a flight arriving "earlier" than it departs lands on the next day
+        duration = ((arr - dest_offset) - (dep - orig_offset)) % 1440
+        if duration == 0:
+            return None
+        return departure, departure + duration, orig, dest, flight_id
+
+    @staticmethod
+    def _days(travel_date: date):
+        # The day before is needed for airports west of the origin, the day after for the
+        # rest of the search horizon
+        return [travel_date + timedelta(days=offset) for offset in (-1, 0, 1)]
+
+    def connections(self, travel_date: date) -> list[tuple]:
+        with self._lock:
+            connections = self._dates.get(travel_date)
+            if connections is None:
+                connections = sorted(
+                    connection
+                    for day in self._days(travel_date)
+                    for flight_id, flight in self.flights.items()
+                    if (connection := self._connection(flight_id, flight, day)) is not None
+                )
+                self._dates[travel_date] = connections
+                if len(self._dates) > CACHED_DATES:
+                    self._dates.popitem(last=False)
+            else:
+                self._dates.move_to_end(travel_date)
+            return connections
+
+    def update(self, upserted: list[dict], deleted: list[str]):
+        """Applies changed flights to the timetable and to the unrolled dates. The lists of the
+        dates and the destinations of an airport are replaced, not changed, as searches may be
+        scanning them at the same time. Flights that are no longer active are removed"""
+        changed = dict.fromkeys(deleted)
+        for row in upserted:
+            # Upserted rows only hold the columns delivered by the provider
+            active = row.get("status", "active") == "active"
+            changed[row["flight_id"]] = {**self._row(row["flight_id"]), **row} if active else None
+        with self._lock:
+            dates = {travel_date: list(connections) for travel_date, connections in self._dates.items()}
+            copies = {}
+            for flight_id, row in changed.items():
+                self._place(flight_id, dates, insert=False)
+                self._remove_flight(flight_id, copies)
+                if row is not None:
+                    self._set_flight(row, copies)
+                    self._place(flight_id, dates, insert=True)
+            self.routes.update(copies)
+            self._dates.update(dates)
+
+    def _row(self, flight_id: str) -> dict:
+        flight = self.flights.get(flight_id)
+        if flight is None:
+            return {}
+        orig, dest, dep, arr, airline = flight
+        return {"flight_id": flight_id, "orig_airport": orig, "dest_airport": dest,
+                "dep_time": day_time(dep // 60, dep % 60), "arr_time": day_time(arr // 60, arr % 60),
+                "airline": airline}
+
+    def _place(self, flight_id: str, dates: dict, insert: bool):
+        """Inserts the connections of a flight into the unrolled dates or removes them"""
+        flight = self.flights.get(flight_id)
+        if flight is None:
+            return
+        for travel_date, connections in dates.items():
+            for day in self._days(travel_date):
+                connection = self._connection(flight_id, flight, day)
+                if connection is None:
+                    continue
+                if insert:
+                    insort(connections, connection)
+                    continue
+                position = bisect_left(connections, connection)
+                if position < len(connections) and connections[position] == connection:
+                    del connections[position]
+
+    def scan(self, connections: list[tuple], origins: set, destinations: set, departure: int,
+             max_legs: int, min_connection: int):
+        """Connection Scan from departure on: the earliest itinerary (tuple of connections) per
+        number of flights, an itinerary with more flights only if it arrives earlier"""
+        horizon = departure + SEARCH_HORIZON_MINUTES
+        best = {}               # (flights taken, airport) -> (arrival, itinerary)
+        found = {}              # flights taken -> (arrival, itinerary) at a destination
+        # A connection departing after the arrival of the best itinerary with the fewest flights
+        # possible cannot lead to a better one
+        direct = any(dest in destinations for orig in origins for dest in self.routes.get(orig, ()))
+        fewest = 1 if direct else 2
+        target = float("inf")
+        for index in range(bisect_left(connections, (departure,)), len(connections)):
+            connection = connections[index]
+            dep, arr, orig, dest = connection[0], connection[1], connection[2], connection[3]
+            if dep > horizon or dep > target:
+                break
+            if dest in origins:
+                continue
+            for legs in range(1, max_legs + 1):
+                if legs == 1:
+                    if orig not in origins:
+                        continue
+                    itinerary = (connection,)
+                else:
+                    previous = best.get((legs - 1, orig))
+                    if previous is None or previous[0] + min_connection > dep or orig in destinations:
+                        continue
+                    if any(leg[2] == dest for leg in previous[1]):
+                        continue  # No loops
+                    itinerary = previous[1] + (connection,)
+                current = best.get((legs, dest))
+                if current is None or arr < current[0]:
+                    best[(legs, dest)] = (arr, itinerary)
+                    if dest in destinations:
+                        if legs not in found or arr < found[legs][0]:
+                            found[legs] = (arr, itinerary)
+                        if legs <= fewest:
+                            target = min(target, arr)
+
+        itineraries = []
+        earliest = float("inf")
+        for legs in sorted(found):
+            arrival, itinerary = found[legs]
+            if arrival < earliest:
+                itineraries.append(itinerary)
+                earliest = arrival
+        return itineraries
+
+    def search(self, origins: set, destinations: set, departure: datetime,
+               max_stops: int = MAX_STOPS, limit: int = 5,
+               min_connection: int = MIN_CONNECTION_MINUTES):
+        """Itineraries departing from departure (local time of the first origin) on, ordered by
+        departure. Every scan gives the best itineraries of a departure time, the next scan
+        starts after their first flight"""
+        origin_zone = self.zones.get(sorted(origins)[0])
+        if departure.tzinfo is None:
+            departure = departure.replace(tzinfo=get_zone(origin_zone))
+        connections = self.connections(departure.astimezone(get_zone(origin_zone)).date())
+        start = to_minutes(departure)
+        itineraries = {}
+        while len(itineraries) < limit:
+            scanned = self.scan(connections, origins, destinations, start, max_stops + 1,
+                                min_connection)
+            if not scanned:
+                break
+            for itinerary in scanned:
+                itineraries.setdefault(tuple(leg[4] for leg in itinerary), itinerary)
+            start = min(itinerary[0][0] for itinerary in scanned) + 1
+        ordered = sorted(itineraries.values(), key=lambda itinerary: (itinerary[0][0], itinerary[-1][1]))
+        return [self.describe(itinerary) for itinerary in ordered[:limit]]
+
+    def describe(self, itinerary: tuple) -> dict:
+        """Itinerary as in ItineraryModel, times in the local time of the airports"""
+        legs = [
+            {
+                "flight_id": flight_id,
+                "airline": self.flights[flight_id][4] if flight_id in self.flights else None,
+                "orig_airport": orig,
+                "dest_airport": dest,
+                "departure": from_minutes(dep, self.zones.get(orig)),
+                "arrival": from_minutes(arr, self.zones.get(dest)),
+            }
+            for dep, arr, orig, dest, flight_id in itinerary
+        ]
+        return {
+            "stops": len(legs) - 1,
+            "departure": legs[0]["departure"],
+            "arrival": legs[-1]["arrival"],
+            "duration_minutes": itinerary[-1][1] - itinerary[0][0],
+            "legs": legs,
+        }
+
+
+_timetable: Timetable | None = None
+_built_at = 0.0
+_lock = threading.Lock()
+
+
+def build_timetable(db_session) -> Timetable:
+    zones = reference_data.get_snapshot(db_session).airport_zones
+    return Timetable(AirportRepo(db_session).get_timetable_rows(), zones)
+
+
+def get_timetable(db_session) -> Timetable:
+    global _timetable, _built_at
+    if _timetable is not None and time.monotonic() - _built_at < TIMETABLE_TTL:
+        return _timetable
+    with _lock:
+        if _timetable is None or time.monotonic() - _built_at >= TIMETABLE_TTL:
+            _timetable = build_timetable(db_session)
+            _built_at = time.monotonic()
+    return _timetable
+
+
+@on_schedules_changed
+def apply_schedule_changes(upserted: list[dict], deleted: list[str]):
+    timetable = _timetable
+    if timetable is not None:
+        timetable.update(upserted, deleted)
+
+
+def find_connections(db_session, from_airports: list[str], to_airports: list[str],
+                     departure: datetime | None = None, max_stops: int = MAX_STOPS,
+                     limit: int = 5, min_connection: int = MIN_CONNECTION_MINUTES):
+    if not from_airports or not to_airports:
+        raise ValueError("Origin and destination are required!")
+    if set(from_airports) & set(to_airports):
+        raise ValueError("Origin and destination must be different!")
+    timetable = get_timetable(db_session)
+    if departure is None:
+        origin_zone = timetable.zones.get(sorted(from_airports)[0])
+        departure = datetime.now(get_zone(origin_zone))
+    return timetable.search(set(from_airports), set(to_airports), departure,
+                            min(max_stops, MAX_STOPS), limit, min_connection)
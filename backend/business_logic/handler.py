@@ -1,18 +1,41 @@
 """This program uses Pydantic models and works as the Command/Control Centre for the application"""
 
+import os
 from datetime import datetime
 from sqlalchemy.orm import Session
 
 from backend.database.orm_models import TripSchema, UserSchema
-from .pydantic_models import UserIn, UserOut, UserUpdate, TripIn, TripOut, TripUpdate, AirportModel, CityModel, \
-    TripHeader
+from .pydantic_models import UserIn, UserOut, UserProfile, UserUpdate, TripIn, TripOut, TripUpdate, AirportModel, CityModel, \
+    TripHeader, TripPatchOut, TripImportOut, TripImportResult
 
 from backend.database.datamanager import UserRepository, TripRepository, AirportRepo
 from backend.utilities.where_is_waldo import get_location_from_ip
-from backend.utilities.string_theory import is_email_valid
+from backend.utilities import geo_ip, passwords
+from backend.utilities.lru import LRUCache
+from backend.utilities.string_theory import is_email_valid, encode_cursor, decode_cursor
+from backend.utilities.time_travel import get_schedule_window
+from .schedule_freshness import (
+    find_stale_windows, fetch_schedules, refresh_in_background)
 
 import backend.api_requests.aerodata_api as aerodata
 import backend.api_requests.airlabs_api as airlabs
+from .spatial_index import geohash, geohash_centre
+from . import reference_data, connection_search, route_graph, compact_airports
+from .trip_patch import TripPatch
+from . import trip_import
+
+NEARBY_LIMIT = 10  # Same limit as used for the Aerodata airport search
+# Nearby airports per client IP (anonymous visitors come back with the same address)
+ip_airports_cache = LRUCache(int(os.getenv("IP_AIRPORTS_CACHE_SIZE", "10000")))
+# Nearby airports per geohash cell and radius, shared by the location header and the IP paths
+NEARBY_CACHE_PRECISION = int(os.getenv("NEARBY_CACHE_PRECISION", "5"))  # Cells of ~4.9 km
+nearby_airports_cache = LRUCache(int(os.getenv("NEARBY_CACHE_SIZE", "10000")),
+                                 ttl=float(os.getenv("NEARBY_CACHE_TTL_SECONDS", "3600")))
+# User profiles (UserProfile) per user id, dropped on update and delete. Other worker processes
+# keep theirs until the ttl, which bounds how long a change can take to show everywhere
+profile_cache = LRUCache(int(os.getenv("PROFILE_CACHE_SIZE", "10000")),
+                         ttl=float(os.getenv("PROFILE_CACHE_TTL_SECONDS", "300")))
+profile_invalidations = 0
 
 class User:
     def __init__(self, user_obj: UserIn | UserUpdate, db_session):
@@ -30,6 +53,7 @@ class User:
             raise
             # raise ValueError(f"Error while creating user: {error}") from error
 
+        self.user.password = passwords.hash_in_pool(self.user.password)
         created_user = self.user_db.create_user(self.user)
         return created_user
 
@@ -42,8 +66,11 @@ class User:
 
         if user_update.password is None:
             user_update.password = user_db.password
+        else:
+            user_update.password = passwords.hash_in_pool(user_update.password)
 
         updated_user = self.user_db.update_user(user_db, user_update)
+        invalidate_user_profile(updated_user.id)
         return updated_user
 
     def get_user(self):
@@ -70,13 +97,18 @@ class User:
             raise Exception("User Details cannot be retrieved!")
 
         user = self.user_db.select_user_by_cred(username, email)
+        if not user:
+            raise Exception("Unknown Account")
 
-        if user and password != user.password:
+        # No connection is held while waiting for a hashing worker
+        stored_password = user.password
+        self.user_db.release_connection()
+        if not passwords.verify_in_pool(password, stored_password):
             raise Exception("User name and password do not match")
-        if user:
-            return user
-        else:
-            raise Exception("Unknown Account")
+        if passwords.needs_rehash(stored_password):
+            # Plaintext row or an older cost: saved again with the current parameters
+            self.user_db.set_password(user, passwords.hash_in_pool(password))
+        return user
 
     def get_user_from_data(self, field_name: str, user_obj: UserIn | UserUpdate):
         if field_name in user_obj:
@@ -113,59 +145,32 @@ class Trip:
             raise Exception(f"Database Operation Failed!: "
                             f"{error_type}{error}") from error
 
-    def change_trip(self, trip_update: TripUpdate, existing_trip_db: TripSchema):
-        # First check if there is a header change
-        existing_trip = TripOut.model_validate(existing_trip_db)
-
-        if trip_update.trip_leg:
-            for trip_leg in trip_update.trip_leg:
-                key = (existing_trip.trip_id, trip_leg.leg_no)
-                if trip_leg.update_mode == "I":
-                    self.trip_db.add_trip_leg(existing_trip_db,trip_leg)
-                else:
-                    trip_leg_db = next(
-                        (trip_leg for trip_leg in existing_trip_db.trip_details
-                         if (trip_leg.trip_id, trip_leg.leg_no) == key), None
-                    )
-                    match trip_leg.update_mode:
-                        case "U":
-                            self.trip_db.modify_trip_leg(trip_leg_db,trip_leg)
-                        case "D":
-                            self.trip_db.delete_trip_leg(trip_leg_db)
-
-        if trip_update.trip_flight:
-            for flight in trip_update.trip_flight:
-                key = (existing_trip.trip_id, flight.leg_no)
-                if flight.update_mode == "I":
-                    trip_leg_db = next(
-                        (trip_leg for trip_leg in existing_trip_db.trip_details
-                         if(trip_leg.trip_id, trip_leg.leg_no) == key), None
-                    )
-                    self.trip_db.add_flight_to_trip(trip_leg_db, flight)
-                else:
-                    flight_db = next(
-                        (trip_leg.flight_details for trip_leg in existing_trip_db.trip_details
-                        if (trip_leg.trip_id,trip_leg.leg_no) == key), None
-                    )
-                    match flight.update_mode:
-                        case "U":
-                            self.trip_db.change_flight_in_trip(flight_db, flight )
-                        case "D":
-                            self.trip_db.delete_flight_from_trip(flight_db)
-        trip_header = TripHeader(
-            user_id=trip_update.user_id,
-            trip_id=trip_update.trip_id,
-            name=trip_update.name
+    def change_trip(self, trip_update: TripUpdate):
+        """Applies the leg and flight changes (and the new name) of trip_update, see TripPatch.
+        Returns only the changed parts"""
+        if trip_update.trip_id is None:
+            raise ValueError("trip_id is needed to change a trip")
+        trip_index = self.trip_db.get_trip_index(trip_update.trip_id)
+        if trip_index is None:
+            raise ValueError("Trip Not found!")
+        user_id, legs = trip_index
+        if trip_update.user_id is not None and trip_update.user_id != user_id:
+            raise ValueError("Trip does not belong to the user")
+
+        patch = TripPatch.from_update(trip_update, legs)
+        if not patch.is_empty():
+            try:
+                self.trip_db.apply_trip_patch(patch)
+            except RuntimeError as error:
+                raise Exception(f"Database Operation Failed!: {error}") from error
+        return TripPatchOut(
+            trip_id=patch.trip_id,
+            name=patch.name,
+            renamed=patch.rename,
+            changed_legs=self.trip_db.get_trip_legs(patch.trip_id, patch.changed_legs),
+            deleted_legs=sorted(patch.leg_deletes - set(patch.legs)),
+            removed_flights=sorted(patch.removed_flights),
         )
-        if trip_header:
-            self.trip_db.change_trip(existing_trip_db, trip_header)
-
-        try:
-            changed_trip = self.trip_db.commit_db(existing_trip_db)
-            return changed_trip
-        except:
-            raise Exception("Database Operation Failed!")
-
 
     def get_trip_by_id(self, trip_id):
         trip = self.trip_db.get_trip(trip_id)
@@ -176,18 +181,30 @@ class Trip:
     def delete_trip(self):
 
         self.trip_db.delete_trip(self.trip.trip_id, commit=True)
+        return {"trips": 1}
 
     def get_trips_by_user(self, user_id: int | None = None):
 
         if user_id is None:
             if isinstance(self.trip, TripUpdate):
-                user_id = self.trip.trip_header.user_id
+                user_id = self.trip.user_id
             if isinstance(self.trip, TripIn):
                 user_id = self.trip.user_id
 
         trips = self.trip_db.get_trips_by_user(user_id)
         return trips
 
+    def get_trips_page(self, user_id: int, limit: int, cursor: str | None = None):
+        """One page of the trips of a user (newest first) and the cursor of the next page,
+        None when it is the last page"""
+        after = decode_cursor(cursor) if cursor else None
+        # One extra row tells whether there is a next page
+        trips = self.trip_db.get_trips_by_user(user_id, limit + 1, after)
+        if len(trips) <= limit:
+            return trips, None
+        trips = trips[:limit]
+        return trips, encode_cursor(trips[-1].created_at, trips[-1].trip_id)
+
 
 def check_before_save_user(role, email: str | None = None):
 
@@ -231,6 +248,11 @@ def get_all_airports(
     return all_airports
 
 
+def get_reference_data(db_session):
+    """In-memory snapshot of countries, cities and airports"""
+    return reference_data.get_snapshot(db_session)
+
+
 # def get_trip_data(
 #         db_session,
 #         trip_id: int,
@@ -243,24 +265,128 @@ def get_all_airports(
 
 
 def delete_trips_by_id(db_session, trips: list):
+    """All the trips in one go, returns the number of trips deleted (unknown ids are skipped)"""
     trip_db = TripRepository(db_session)
-    for trip in trips:
+    return trip_db.delete_trips(trips, commit=True)
+
+
+def import_trips(db_session, payloads: list, atomic: bool = False) -> TripImportOut:
+    """Validates all the trips (see trip_import), then saves the valid ones in one go.
+    With atomic, nothing is saved if any trip is invalid"""
+    trip_db = TripRepository(db_session)
+    user_ids, flight_ids = trip_import.referenced_ids(payloads)
+    users, flights = trip_db.get_existing_references(user_ids, flight_ids)
+    validated = trip_import.validate_trips(
+        payloads, users, get_reference_data(db_session).cities, flights)
+
+    failed = sum(1 for trip, _errors in validated if trip is None)
+    valid_trips = [trip for trip, _errors in validated if trip is not None]
+    trip_ids = iter([])
+    if valid_trips and not (atomic and failed):
         try:
-            trip_db.delete_trip(trip)
-        except ValueError:
-            raise
-    try:
-        trip_db.commit_db()
-    except Exception:
-        raise
+            trip_ids = iter(trip_db.bulk_create_trips(valid_trips))
+        except RuntimeError as error:
+            raise Exception(f"Database Operation Failed!: {error}") from error
+        saved = True
+    else:
+        saved = False
+
+    results = []
+    for index, (trip, errors) in enumerate(validated):
+        if trip is None:
+            results.append(TripImportResult(index=index, status="invalid", errors=errors))
+        elif saved:
+            results.append(TripImportResult(index=index, status="created", trip_id=next(trip_ids)))
+        else:
+            results.append(TripImportResult(index=index, status="skipped"))
+    return TripImportOut(created=len(valid_trips) if saved else 0, failed=failed, results=results)
 
 
 def delete_user_by_id(db_session, user_id: int):
     user_db = UserRepository(db_session)
     try:
-        user_db.delete_user(user_id)
+        deleted = user_db.delete_user(user_id)
     except ValueError:
         raise
+    invalidate_user_profile(user_id)
+    return deleted
+
+
+def get_user_profile(db_session, user_id: int) -> UserProfile | None:
+    """Cached profile of a user, None if the user does not exist"""
+    profile = profile_cache.get(user_id)
+    if profile is not None:
+        return profile
+    invalidations = profile_invalidations
+    row = UserRepository(db_session).get_user_profile(user_id)
+    if row is None:
+        return None
+    profile = UserProfile.model_validate(row)
+    # Not cached if the user was changed while it was read, the row may be the old one
+    if invalidations == profile_invalidations:
+        profile_cache.put(user_id, profile)
+    return profile
+
+
+def invalidate_user_profile(user_id: int):
+    global profile_invalidations
+    profile_invalidations += 1
+    profile_cache.pop(user_id)
+
+
+def get_home_airports(db_session, profile: UserProfile, radius=100):
+    """Airports near the home city of the user, from the spatial index (no provider call).
+    None if the user has no home city"""
+    if profile.latitude is None or profile.longitude is None:
+        return None
+    snapshot = get_reference_data(db_session)
+    cache_key, (latitude, longitude) = nearby_cache_key(
+        snapshot, profile.latitude, profile.longitude, radius)
+    airports_list = nearby_airports_cache.get(cache_key)
+    if airports_list is None:
+        airports_list = cache_airports(
+            nearby_airports_cache, cache_key,
+            get_airports_from_index(snapshot, latitude, longitude, radius))
+    return airports_list or []
+
+
+def get_compact_airports(db_session, output_format: str | None = None, accept: str | None = None,
+                         tiers: list[int] | None = None, countries: list[str] | None = None,
+                         bbox: str | None = None, fields: str | None = None):
+    """Compact (dictionary encoded, columnar) airports payload: (body, ETag, media type).
+    ValueError for invalid parameters, LookupError if MessagePack is asked for but not available"""
+    media_type = compact_airports.choose_media_type(output_format, accept)
+    body, etag = compact_airports.get_compact(
+        get_reference_data(db_session), media_type, tiers, countries,
+        compact_airports.parse_bbox(bbox), compact_airports.parse_fields(fields))
+    return body, etag, media_type
+
+
+def search_airports(db_session, query: str, limit: int = 10):
+    """Airports matching the typed text (codes and names of the airport, city and country),
+    in the AllAirportModel shape"""
+    snapshot = get_reference_data(db_session)
+    return [
+        {**airport, "city": snapshot.city_details(airport["city_key"])}
+        for airport in snapshot.search_index.search(query, limit)
+    ]
+
+
+def get_airports_from_index(snapshot, latitude, longitude, radius=100, limit=NEARBY_LIMIT):
+    """Nearby airports from the in-memory spatial index of the reference data snapshot"""
+    if snapshot is None:
+        return None
+    nearby = snapshot.spatial_index.within_radius(latitude, longitude, radius, limit)
+    if nearby:
+        return [airport for airport, _distance in nearby]
+    return None
+
+
+def nearby_cache_key(snapshot, latitude, longitude, radius):
+    """(cache key, centre of the geohash cell): the airports are searched from the centre, so a
+    cached result does not depend on where in the cell the first request came from"""
+    cell = geohash(latitude, longitude, NEARBY_CACHE_PRECISION)
+    return (cell, radius, snapshot.version), geohash_centre(cell)
 
 
 def get_airports_by_location(db_object, latitude, longitude, radius=100):
@@ -271,6 +397,21 @@ def get_airports_by_location(db_object, latitude, longitude, radius=100):
         airport_db = db_object
     else:
         raise ValueError("Cannot do a DB select to fetch the airports by location")
+    snapshot = get_reference_data(airport_db.db)
+    cache_key, (latitude, longitude) = nearby_cache_key(snapshot, latitude, longitude, radius)
+    airports_list = nearby_airports_cache.get(cache_key)
+    if airports_list is None:
+        airports_list = cache_airports(
+            nearby_airports_cache, cache_key,
+            find_airports_by_location(airport_db, snapshot, latitude, longitude, radius))
+    return airports_list
+
+
+def find_airports_by_location(airport_db, snapshot, latitude, longitude, radius=100):
+    # Using the spatial index (no network or database round trip)
+    airports_list = get_airports_from_index(snapshot, latitude, longitude, radius)
+    if airports_list:
+        return airports_list
     # Using Aerodata API
     airport_keys = aerodata.search_airports_by_location(
         latitude, longitude, radius)
@@ -299,27 +440,42 @@ def find_nearby_airports(db_session, client_meta, radius=100):
         return airports_list
 
     if client_meta.get("ip"):
-        # Find airports based on ip using API directly , if not use function to get location based on IP and the DB to
-        # to find airports
         client_ip = client_meta["ip"]
-        # Use aerodata first if not use get_location_from_ip function and if not DB
-        # Using Aerodata API
-        airport_keys = aerodata.search_airport_by_ip(client_ip)
-        if airport_keys:
-            airports_list = airport_db.get_airports(airport_keys)
+        cache_key = (client_ip, radius, get_reference_data(db_session).version)
+        airports_list = ip_airports_cache.get(cache_key)
+        if airports_list is not None:
             return airports_list
-        try:
-            location = get_location_from_ip(client_ip)
-        except KeyError:
-            return None
+        # Local geo-IP database first, the APIs only if the address is not in it:
+        # Aerodata finds airports by ip directly, if not get_location_from_ip and the DB
+        airports_list = None
+        location = geo_ip.lookup(client_ip)
         if location:
-            latitude = location[0]
-            longitude = location[1]
-            airports_list = get_airports_by_location(airport_db, latitude, longitude, radius)
-            return airports_list
+            airports_list = get_airports_by_location(
+                airport_db, location.latitude, location.longitude, radius)
+        if not airports_list:
+            airport_keys = aerodata.search_airport_by_ip(client_ip)
+            if airport_keys:
+                airports_list = airport_db.get_airports(airport_keys)
+        if not airports_list:
+            try:
+                location = get_location_from_ip(client_ip)
+            except KeyError:
+                location = None
+            if location:
+                airports_list = get_airports_by_location(airport_db, location[0], location[1], radius)
+        return cache_airports(ip_airports_cache, cache_key, airports_list)
     return None
 
 
+def cache_airports(cache, cache_key, airports_list):
+    """Keeps the airports as AirportModel, ORM rows cannot outlive their session"""
+    if not airports_list:
+        return None
+    airports_list = [AirportModel.model_validate(airport) for airport in airports_list]
+    cache.put(cache_key, airports_list)
+    return airports_list
+
+
 def check_airport(db_session, airport):
     pass
 
@@ -338,6 +494,71 @@ def get_iata_code(db_session, iata_code, iata_type):
     return None
 
 
+def split_airports_and_cities(from_object, to_object):
+    """get_iata_code returns either an airport or a city, get_flights needs them separately"""
+    from_airport = to_airport = from_city = to_city = None
+    if isinstance(from_object, AirportModel):
+        from_airport = from_object
+    elif isinstance(from_object, CityModel):
+        from_city = from_object
+    if isinstance(to_object, AirportModel):
+        to_airport = to_object
+    elif isinstance(to_object, CityModel):
+        to_city = to_object
+    return from_airport, from_city, to_airport, to_city
+
+
+def expand_airports(airport: AirportModel | None = None, city: CityModel | None = None):
+    """Airport codes of an airport or of all the airports of a (metro area) city"""
+    airport_keys = []
+    if city:
+        airport_keys = [airport.airport_key for airport in city.airports]
+    if airport:
+        airport_keys.append(airport.airport_key)
+    return airport_keys
+
+
+def get_fetch_windows(snapshot, airport_keys: list[str], timestamp: datetime | None = None):
+    """Fetch log window of every airport: the window containing the requested local time, or
+    the current time of the airport (time zone of its city), the windows are in local time"""
+    windows = {}
+    for airport_key in airport_keys:
+        local_time = timestamp
+        if local_time is None:
+            zone = connection_search.get_zone(snapshot.airport_zones.get(airport_key))
+            local_time = datetime.now(zone).replace(tzinfo=None)
+        windows[airport_key] = get_schedule_window(local_time)
+    return windows
+
+
+def get_connections(
+        db_session,
+        from_object: AirportModel | CityModel,
+        to_object: AirportModel | CityModel,
+        local_time: datetime | None = None,
+        max_stops: int = connection_search.MAX_STOPS,
+        limit: int = 5,
+    ):
+    """Direct and connecting itineraries (up to max_stops stops) from the stored schedules"""
+    from_airport, from_city, to_airport, to_city = split_airports_and_cities(from_object, to_object)
+    return connection_search.find_connections(
+        db_session,
+        expand_airports(from_airport, from_city),
+        expand_airports(to_airport, to_city),
+        local_time, max_stops, limit,
+    )
+
+
+def get_destinations(db_session, airport_key: str):
+    """Destinations of an airport with the number of flights and the airlines, from the
+    in-memory route graph. None if the airport does not exist"""
+    airport_key = airport_key.upper()
+    destinations = route_graph.get_route_graph(db_session).get_destinations(airport_key)
+    if not destinations and airport_key not in get_reference_data(db_session).airport_keys:
+        return None
+    return destinations
+
+
 def get_flights(
         db_session,
         direction: str,
@@ -359,57 +580,29 @@ def get_flights(
         dep_time = None
 
     airport_db = AirportRepo(db_session)
-    from_airports = []
-    to_airports = []
-
-    if from_city:
-        from_airports = [airport.airport_key for airport in from_city.airports]
-    if from_airport:
-        from_airports.append(from_airport.airport_key)
-    if to_city:
-        to_airports = [airport.airport_key for airport in to_city.airports]
-    if to_airport:
-        to_airports.append(to_airport.airport_key)
+    from_airports = expand_airports(from_airport, from_city)
+    to_airports = expand_airports(to_airport, to_city)
 
     routes = airport_db.get_airport_schedules(
         from_airports, to_airports, dep_time, arr_time
         )
+    airport_keys = from_airports + to_airports
+    windows = get_fetch_windows(get_reference_data(db_session), airport_keys, timestamp)
+    fetch_log = airport_db.get_fetch_log(airport_keys, direction, sorted(set(windows.values())))
+    stale = find_stale_windows(fetch_log, windows)
     if routes:
+        # Answer from the DB right away, outdated windows are refreshed for the next requests
+        if stale:
+            refresh_in_background(stale, direction)
         return routes
+    if not stale:
+        # The provider was asked recently and had no flights either
+        return None
 
-    if timestamp:
-        timestamp = timestamp.strftime("%Y-%m-%dT%H:%M")
-
-    # Using Aerodata API
-    routes_list = []
-    if from_airports is None:
-        from_airports = [None]
-    else:
-        for from_airport in from_airports:
-            schedules = aerodata.get_airport_schedules(
-                from_airport,
-                direction,
-                timestamp
-                )
-            if schedules:
-                routes_list.extend(schedules)
-
-    if to_airports is None:
-        to_airports = [None]
-    else:
-        for to_airport in to_airports:
-            schedules = aerodata.get_airport_schedules(
-                to_airport,
-                direction,
-                timestamp
-                )
-            if schedules:
-                routes_list.extend(schedules)
-
-    if routes_list:
-        #Insert data to DB
-        routes = airport_db.add_routes(routes_list)
-        if from_airport and to_airport:
+    # Using Aerodata API, one call per airport and window, all of them in parallel
+    routes = fetch_schedules(airport_db, stale, direction)
+    if routes:
+        if from_airports and to_airports:
             routes = airport_db.get_airport_schedules(
                 from_airports, to_airports, dep_time, arr_time
             )
@@ -113,6 +113,29 @@ class RouteModel(BaseModel):
     }
 
 
+class DestinationModel(BaseModel):
+    dest_airport: str
+    flights: int
+    airlines: list[str]     # Most flights first
+
+
+class ConnectionLegModel(BaseModel):
+    flight_id: str
+    airline: str | None
+    orig_airport: str
+    dest_airport: str
+    departure: datetime     # Local time of the origin airport
+    arrival: datetime       # Local time of the destination airport
+
+
+class ItineraryModel(BaseModel):
+    stops: int
+    departure: datetime
+    arrival: datetime
+    duration_minutes: int
+    legs: list[ConnectionLegModel]
+
+
 class AirportRoutes(BaseModel):
     airport_key: str
     name: str
@@ -232,6 +255,30 @@ class TripUpdate(BaseModel):
         return self
 
 
+class TripImportResult(BaseModel):
+    index: int                      # Position of the trip in the import
+    status: str                     # created, invalid or skipped (atomic import with errors)
+    trip_id: int | None = None
+    errors: list[str] = []
+
+
+class TripImportOut(BaseModel):
+    created: int
+    failed: int
+    results: list[TripImportResult]
+
+
+class TripPatchOut(BaseModel):
+    """Only what a TripUpdate changed: the inserted/updated legs (with their flight), the
+    deleted legs and the legs whose flight was removed"""
+    trip_id: int
+    name: str | None = None
+    renamed: bool = False
+    changed_legs: list[TripLegOut] = []
+    deleted_legs: list[int] = []
+    removed_flights: list[int] = []
+
+
 class UserOut(BaseModel):
     id: int
     username: str | None = None
@@ -250,6 +297,22 @@ class UserOut(BaseModel):
     }
 
 
+class UserProfile(BaseModel):
+    """What a page needs to know about the user, without the trips (see UserOut)"""
+    id: int
+    role: str = "standard"
+    city: str | None = None
+    country: str | None = None
+    latitude: float | None = None     # Of the home city
+    longitude: float | None = None
+    dark_mode: bool = False
+    map_mode: bool = False
+    date_tolerance: int | None = None
+    model_config = {
+        "from_attributes": True
+    }
+
+
 class UserIn(BaseModel):
     username: str | None = None
     email: str
@@ -0,0 +1,155 @@
+"""In-memory snapshot of the reference data (countries, cities and airports).
+The master data only changes when it is reloaded, so instead of selecting ~6,700 airports with
+their cities and countries on every request, the snapshot is loaded once (at startup) and the
+GET /airports response is kept as ready-made JSON bytes with an ETag.
+The snapshot is rebuilt when the master data version (data_version table) changes, the version
+is checked at most once every REFERENCE_DATA_CHECK_SECONDS.
+"""
+import hashlib
+import os
+import threading
+import time
+
+from pydantic import TypeAdapter
+
+from .pydantic_models import AllAirportModel
+from .spatial_index import AirportSpatialIndex
+from .airport_search import AirportSearchIndex
+from backend.database.datamanager import ReferenceDataRepo
+
+CHECK_INTERVAL = float(os.getenv("REFERENCE_DATA_CHECK_SECONDS", "60"))
+AIRPORTS_ADAPTER = TypeAdapter(list[AllAirportModel])
+
+
+class ReferenceSnapshot:
+    def __init__(self, version: int, countries: dict, cities: dict, airports: list[dict]):
+        self.version = version
+        self.countries = countries      # country_key -> {country_key, name}
+        self.cities = cities            # city_key -> {city_key, name, country_key, ...}
+        self.airports = airports        # [{airport_key, name, tier, city_key, latitude, longitude}]
+
+        self.airports_json = self.serialize_airports()
+        digest = hashlib.sha1(self.airports_json).hexdigest()[:16]
+        self.etag = f'"{version}-{digest}"'
+        self._derived = {}
+        self._derived_lock = threading.Lock()
+
+    def derived(self, name: str, builder):
+        """Structures built from the snapshot (indexes...) are built once per snapshot and
+        are dropped together with it when the master data changes"""
+        value = self._derived.get(name)
+        if value is None:
+            with self._derived_lock:
+                value = self._derived.get(name)
+                if value is None:
+                    value = self._derived[name] = builder(self)
+        return value
+
+    @property
+    def spatial_index(self) -> AirportSpatialIndex:
+        return self.derived("spatial_index", lambda snapshot: AirportSpatialIndex(snapshot.airports))
+
+    @property
+    def search_index(self) -> AirportSearchIndex:
+        return self.derived("search_index", AirportSearchIndex)
+
+    @property
+    def airport_keys(self) -> frozenset:
+        return self.derived("airport_keys",
+                            lambda snapshot: frozenset(airport["airport_key"] for airport in snapshot.airports))
+
+    @property
+    def airport_zones(self) -> dict:
+        """airport_key -> time zone name of the airport's city"""
+        return self.derived("airport_zones", lambda snapshot: {
+            airport["airport_key"]: (snapshot.cities.get(airport["city_key"]) or {}).get("timezone")
+            for airport in snapshot.airports
+        })
+
+    def city_details(self, city_key):
+        """City with its country, as in AllCityModel"""
+        city = self.cities.get(city_key)
+        if city is None:
+            return None
+        return {**city, "country": self.countries.get(city["country_key"])}
+
+    def serialize_airports(self) -> bytes:
+        """Response body of GET /airports (list[AllAirportModel])"""
+        airports = [
+            {**airport, "city": self.city_details(airport["city_key"])}
+            for airport in self.airports
+        ]
+        return AIRPORTS_ADAPTER.dump_json(AIRPORTS_ADAPTER.validate_python(airports))
+
+
+_snapshot: ReferenceSnapshot | None = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def build_snapshot(reference_db: ReferenceDataRepo, version: int) -> ReferenceSnapshot:
+    countries = {row["country_key"]: dict(row) for row in reference_db.get_countries()}
+    cities = {
+        row["city_key"]: {
+            **row,
+            "latitude": float(row["latitude"]) if row["latitude"] is not None else None,
+            "longitude": float(row["longitude"]) if row["longitude"] is not None else None,
+        }
+        for row in reference_db.get_cities()
+    }
+    airports = [
+        {**row, "latitude": float(row["latitude"]), "longitude": float(row["longitude"])}
+        for row in reference_db.get_airports()
+        if row["latitude"] is not None and row["longitude"] is not None
+    ]
+    return ReferenceSnapshot(version, countries, cities, airports)
+
+
+def load_snapshot(db_session) -> ReferenceSnapshot:
+    """Build the snapshot unconditionally (application startup)"""
+    global _snapshot, _checked_at
+    with _lock:
+        reference_db = ReferenceDataRepo(db_session)
+        _snapshot = build_snapshot(reference_db, reference_db.get_version())
+        _checked_at = time.monotonic()
+    return _snapshot
+
+
+def fresh_snapshot() -> ReferenceSnapshot | None:
+    """The snapshot if its version was checked less than CHECK_INTERVAL ago, without a query"""
+    if _snapshot is not None and time.monotonic() - _checked_at < CHECK_INTERVAL:
+        return _snapshot
+    return None
+
+
+def get_snapshot(db_session) -> ReferenceSnapshot:
+    """Current snapshot, rebuilt only if the master data version has changed"""
+    global _snapshot, _checked_at
+    snapshot = fresh_snapshot()
+    if snapshot is not None:
+        return snapshot
+    with _lock:
+        # Another thread may have refreshed it while this one was waiting for the lock
+        if _snapshot is None or time.monotonic() - _checked_at >= CHECK_INTERVAL:
+            reference_db = ReferenceDataRepo(db_session)
+            version = reference_db.get_version()
+            if _snapshot is None or _snapshot.version != version:
+                _snapshot = build_snapshot(reference_db, version)
+            _checked_at = time.monotonic()
+    return _snapshot
+
+
+def invalidate_snapshot():
+    """Check the master data version again on the next request"""
+    global _checked_at
+    _checked_at = 0.0
+
+
+def is_etag_match(if_none_match: str | None, etag: str) -> bool:
+    """If-None-Match can hold a list of (weak) ETags or *"""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or any(
+        candidate.removeprefix("W/") == etag for candidate in candidates
+    )
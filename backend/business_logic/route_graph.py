@@ -0,0 +1,106 @@
+"""Route graph of the stored schedules: airport -> destinations with the number of flights and
+the airlines flying there. The map only needs this to draw the arcs from an airport, so it is
+kept in memory instead of selecting the schedule rows with both airports, their cities and
+countries on every click.
+
+The graph is built from the Schedules table on first use and rebuilt every
+ROUTE_GRAPH_TTL_SECONDS (changes made by other processes), changes made by this process are
+applied straight away through the schedules listener of the repositories.
+"""
+import os
+import threading
+import time
+
+from backend.database.datamanager import AirportRepo, on_schedules_changed
+
+ROUTE_GRAPH_TTL = float(os.getenv("ROUTE_GRAPH_TTL_SECONDS", "600"))
+
+
+class RouteGraph:
+    def __init__(self, rows):
+        self.flights = {}       # flight_id -> (orig, dest, airline)
+        # orig -> {dest: {"flights": number of flights, "airlines": {airline: number of flights}}}
+        self.destinations = {}
+        self._lock = threading.Lock()
+        for row in rows:
+            self.flights[row["flight_id"]] = (row["orig_airport"], row["dest_airport"], row["airline"])
+        for orig, dest, airline in self.flights.values():
+            self._count(self.destinations.setdefault(orig, {}), dest, airline, 1)
+
+    @staticmethod
+    def _count(destinations: dict, dest: str, airline: str | None, step: int):
+        route = destinations.setdefault(dest, {"flights": 0, "airlines": {}})
+        route["flights"] += step
+        if airline:
+            airlines = route["airlines"]
+            airlines[airline] = airlines.get(airline, 0) + step
+            if not airlines[airline]:
+                del airlines[airline]
+        if not route["flights"]:
+            del destinations[dest]
+
+    def update(self, upserted: list[dict], deleted: list[str]):
+        """Applies changed flights. The destinations of an airport are replaced, not changed,
+        as requests may be reading them at the same time"""
+        changed = {flight_id: None for flight_id in deleted}
+        for row in upserted:
+            flight = self.flights.get(row["flight_id"], (None, None, None))
+            flight = (row.get("orig_airport", flight[0]), row.get("dest_airport", flight[1]),
+                      row.get("airline", flight[2]))
+            active = row.get("status", "active") == "active" and None not in flight[:2]
+            changed[row["flight_id"]] = flight if active else None
+        with self._lock:
+            copies = {}
+            for flight_id, flight in changed.items():
+                previous = self.flights.pop(flight_id, None)
+                for entry, step in ((previous, -1), (flight, 1)):
+                    if entry is None:
+                        continue
+                    orig, dest, airline = entry
+                    if orig not in copies:
+                        copies[orig] = {
+                            dest: {"flights": route["flights"], "airlines": dict(route["airlines"])}
+                            for dest, route in self.destinations.get(orig, {}).items()
+                        }
+                    self._count(copies[orig], dest, airline, step)
+                if flight is not None:
+                    self.flights[flight_id] = flight
+            self.destinations.update(copies)
+
+    def get_destinations(self, airport_key: str) -> list[dict]:
+        """Destinations of an airport as in DestinationModel, most flights first"""
+        destinations = self.destinations.get(airport_key, {})
+        return sorted(
+            (
+                {
+                    "dest_airport": dest,
+                    "flights": route["flights"],
+                    "airlines": sorted(route["airlines"], key=route["airlines"].get, reverse=True),
+                }
+                for dest, route in destinations.items()
+            ),
+            key=lambda destination: (-destination["flights"], destination["dest_airport"]),
+        )
+
+
+_route_graph: RouteGraph | None = None
+_built_at = 0.0
+_lock = threading.Lock()
+
+
+def get_route_graph(db_session) -> RouteGraph:
+    global _route_graph, _built_at
+    if _route_graph is not None and time.monotonic() - _built_at < ROUTE_GRAPH_TTL:
+        return _route_graph
+    with _lock:
+        if _route_graph is None or time.monotonic() - _built_at >= ROUTE_GRAPH_TTL:
+            _route_graph = RouteGraph(AirportRepo(db_session).get_route_rows())
+            _built_at = time.monotonic()
+    return _route_graph
+
+
+@on_schedules_changed
+def apply_schedule_changes(upserted: list[dict], deleted: list[str]):
+    route_graph = _route_graph
+    if route_graph is not None:
+        route_graph.update(upserted, deleted)
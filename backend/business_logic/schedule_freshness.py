@@ -0,0 +1,139 @@
+"""Freshness of the stored flight schedules (stale-while-revalidate).
+Every pull of the provider schedules of an airport is recorded in the fetch log per direction
+and time window. Requests are answered from the database straight away, windows older than
+SCHEDULE_TTL_SECONDS are refreshed in the background. The user only waits for the provider when
+the database has nothing and the provider has not been asked recently, which also bounds the
+number of (paid) provider calls to one per airport, direction and window per TTL.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from backend.database.async_datamanager import AsyncAirportRepo
+from backend.database.datamanager import AirportRepo
+from backend.database.orm_models import SessionLocal, AsyncSessionLocal
+from backend.utilities.fan_out import fan_out, fan_out_async
+
+import backend.api_requests.aerodata_api as aerodata
+
+SCHEDULE_TTL = timedelta(seconds=int(os.getenv("SCHEDULE_TTL_SECONDS", str(6 * 3600))))
+REFRESH_WORKERS = int(os.getenv("SCHEDULE_REFRESH_WORKERS", "2"))
+WINDOW_FORMAT = "%Y-%m-%dT%H:%M"
+
+_refresh_executor = ThreadPoolExecutor(max_workers=REFRESH_WORKERS,
+                                       thread_name_prefix="schedule-refresh")
+_in_flight = set()          # (airport, direction, window) refreshes queued or running
+_in_flight_lock = threading.Lock()
+_background_tasks = set()   # Keeps the async refresh tasks referenced until they finish
+
+
+def find_stale_windows(fetch_log: dict, windows: dict[str, datetime],
+                       now: datetime | None = None):
+    """(airport, window) pairs never fetched or fetched longer than SCHEDULE_TTL ago,
+    windows holds the window of every airport (see handler.get_fetch_windows)"""
+    now = now or datetime.now(timezone.utc)
+    stale = []
+    for airport_key, window_start in windows.items():
+        fetched_at = fetch_log.get((airport_key, window_start))
+        if fetched_at is not None and fetched_at.tzinfo is None:
+            # SQLite does not keep the time zone
+            fetched_at = fetched_at.replace(tzinfo=timezone.utc)
+        if fetched_at is None or now - fetched_at > SCHEDULE_TTL:
+            stale.append((airport_key, window_start))
+    return stale
+
+
+def merge_schedules(results):
+    """Merge the schedules of several airports as they arrive, a flight can show up in the
+    schedules of both its origin and destination airport"""
+    routes = {}
+    for _arguments, schedules in results:
+        if schedules:
+            routes.update((route["flight_id"], route) for route in schedules)
+    return list(routes.values())
+
+
+def provider_calls(stale: list[tuple[str, datetime]], direction: str):
+    return [(airport_key, direction, window_start.strftime(WINDOW_FORMAT))
+            for airport_key, window_start in stale]
+
+
+def fetched_windows(results):
+    """(airport, window) of the calls that succeeded (also the ones without flights)"""
+    return [(arguments[0], datetime.strptime(arguments[2], WINDOW_FORMAT))
+            for arguments, _schedules in results]
+
+
+def fetch_schedules(airport_db: AirportRepo, stale: list[tuple[str, datetime]], direction: str):
+    """Pull the stale windows from the provider, store the routes and log the fetches"""
+    fetched_at = datetime.now(timezone.utc)
+    results = list(fan_out(aerodata.get_airport_schedules, provider_calls(stale, direction)))
+    routes_list = merge_schedules(results)
+    routes = airport_db.add_routes(routes_list) if routes_list else []
+    airport_db.record_fetches(fetched_windows(results), direction, fetched_at)
+    return routes
+
+
+def claim(stale: list[tuple[str, datetime]], direction: str):
+    """Windows not already being refreshed by another request"""
+    with _in_flight_lock:
+        claimed = [(airport_key, window_start) for airport_key, window_start in stale
+                   if (airport_key, direction, window_start) not in _in_flight]
+        _in_flight.update((airport_key, direction, window_start)
+                          for airport_key, window_start in claimed)
+    return claimed
+
+
+def release(claimed: list[tuple[str, datetime]], direction: str):
+    with _in_flight_lock:
+        _in_flight.difference_update((airport_key, direction, window_start)
+                                     for airport_key, window_start in claimed)
+
+
+def refresh_in_background(stale: list[tuple[str, datetime]], direction: str):
+    claimed = claim(stale, direction)
+    if claimed:
+        _refresh_executor.submit(_refresh, claimed, direction)
+
+
+def _refresh(claimed: list[tuple[str, datetime]], direction: str):
+    try:
+        with SessionLocal() as db:
+            fetch_schedules(AirportRepo(db), claimed, direction)
+    except Exception as error:
+        print("Background refresh of the schedules failed:", error)
+    finally:
+        release(claimed, direction)
+
+
+async def fetch_schedules_async(airport_db: AsyncAirportRepo, stale: list[tuple[str, datetime]],
+                                direction: str):
+    """Async variant of fetch_schedules"""
+    fetched_at = datetime.now(timezone.utc)
+    results = [result async for result in fan_out_async(
+        aerodata.get_airport_schedules_async, provider_calls(stale, direction))]
+    routes_list = merge_schedules(results)
+    routes = await airport_db.add_routes(routes_list) if routes_list else []
+    await airport_db.record_fetches(fetched_windows(results), direction, fetched_at)
+    return routes
+
+
+def refresh_in_background_async(stale: list[tuple[str, datetime]], direction: str):
+    """Async variant of refresh_in_background, must be called from the event loop"""
+    claimed = claim(stale, direction)
+    if claimed:
+        task = asyncio.create_task(_refresh_async(claimed, direction))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+
+async def _refresh_async(claimed: list[tuple[str, datetime]], direction: str):
+    try:
+        async with AsyncSessionLocal() as db:
+            await fetch_schedules_async(AsyncAirportRepo(db), claimed, direction)
+    except Exception as error:
+        print("Background refresh of the schedules failed:", error)
+    finally:
+        release(claimed, direction)
@@ -0,0 +1,178 @@
+"""In-memory spatial index over the airport coordinates of the reference data snapshot.
+Airports are bucketed in a grid of CELL_SIZE degree cells. A radius query only computes the
+(vectorized) haversine distance for the airports in the cells overlapping the search circle.
+Longitudes wrap around at the antimeridian and a circle containing a pole covers every column.
+"""
+import math
+
+import numpy as np
+
+EARTH_RADIUS = 6371.0  # km
+KM_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+HALF_CIRCUMFERENCE = math.pi * EARTH_RADIUS
+CELL_SIZE = 1.0  # degrees
+DEFAULT_TIER = 3  # Airports without tier rank as the least important ones
+
+
+GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash(latitude: float, longitude: float, precision: int = 5) -> str:
+    """Geohash cell of a location, precision 5 is a cell of about 4.9 x 4.9 km"""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    characters, value, bits, even = [], 0, 0, True
+    while len(characters) < precision:
+        # Bits alternate between longitude and latitude, 5 bits per character
+        interval, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            characters.append(GEOHASH_BASE32[value])
+            value, bits = 0, 0
+    return "".join(characters)
+
+
+def geohash_centre(cell: str) -> tuple[float, float]:
+    """(latitude, longitude) of the centre of a geohash cell"""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for character in cell:
+        value = GEOHASH_BASE32.index(character)
+        for shift in range(4, -1, -1):
+            interval = lon_range if even else lat_range
+            middle = (interval[0] + interval[1]) / 2
+            if value >> shift & 1:
+                interval[0] = middle
+            else:
+                interval[1] = middle
+            even = not even
+    return (lat_range[0] + lat_range[1]) / 2, (lon_range[0] + lon_range[1]) / 2
+
+
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    """Great-circle distance from one point to arrays of points, all in radians"""
+    sin_dlat = np.sin((latitudes - latitude) / 2)
+    sin_dlon = np.sin((longitudes - longitude) / 2)
+    a = sin_dlat ** 2 + math.cos(latitude) * np.cos(latitudes) * sin_dlon ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class AirportSpatialIndex:
+    def __init__(self, airports: list[dict], cell_size: float = CELL_SIZE):
+        self.airports = airports
+        self.cell_size = cell_size
+        self.rows = math.ceil(180 / cell_size)
+        self.columns = math.ceil(360 / cell_size)
+
+        latitudes = np.array([airport["latitude"] for airport in airports], dtype=float)
+        longitudes = np.array([airport["longitude"] for airport in airports], dtype=float)
+        self.latitudes = np.radians(latitudes)
+        self.longitudes = np.radians(longitudes)
+        self.tiers = np.array(
+            [airport.get("tier") or DEFAULT_TIER for airport in airports], dtype=int)
+
+        row_of = self._row(latitudes)
+        column_of = self._column(longitudes)
+        cell_ids = row_of * self.columns + column_of
+        # One sorted pass instead of appending to a list per airport
+        order = np.argsort(cell_ids, kind="stable")
+        unique_ids, starts = np.unique(cell_ids[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        self.cells = {
+            int(cell_id): order[start:end]
+            for cell_id, start, end in zip(unique_ids, starts, ends)
+        }
+
+    def __len__(self):
+        return len(self.airports)
+
+    def _row(self, latitudes):
+        rows = np.floor((np.asarray(latitudes) + 90) / self.cell_size).astype(int)
+        return np.clip(rows, 0, self.rows - 1)
+
+    def _column(self, longitudes):
+        columns = np.floor((np.asarray(longitudes) + 180) / self.cell_size).astype(int)
+        return np.mod(columns, self.columns)
+
+    def _candidates(self, latitude, longitude, radius):
+        """Indices of the airports in all the cells that the search circle can touch"""
+        if radius >= HALF_CIRCUMFERENCE:
+            return np.arange(len(self.airports))
+        lat_delta = radius / KM_PER_DEGREE
+        first_row = int(self._row(latitude - lat_delta))
+        last_row = int(self._row(latitude + lat_delta))
+
+        if latitude + lat_delta >= 90 or latitude - lat_delta <= -90:
+            columns = range(self.columns)   # The circle contains a pole
+        else:
+            # Widest longitude extent of a spherical cap
+            ratio = math.sin(radius / EARTH_RADIUS) / math.cos(math.radians(latitude))
+            if ratio >= 1:
+                columns = range(self.columns)
+            else:
+                lon_delta = math.degrees(math.asin(ratio))
+                first_column = math.floor((longitude - lon_delta + 180) / self.cell_size)
+                last_column = math.floor((longitude + lon_delta + 180) / self.cell_size)
+                if last_column - first_column + 1 >= self.columns:
+                    columns = range(self.columns)
+                else:
+                    # Modulo wraps the columns around the antimeridian
+                    columns = [column % self.columns
+                               for column in range(first_column, last_column + 1)]
+
+        found = [
+            self.cells[cell_id]
+            for row in range(first_row, last_row + 1)
+            for column in columns
+            if (cell_id := row * self.columns + column) in self.cells
+        ]
+        if not found:
+            return np.empty(0, dtype=int)
+        return np.concatenate(found)
+
+    def _distances(self, latitude, longitude, candidates):
+        return haversine_km(math.radians(latitude), math.radians(longitude),
+                            self.latitudes[candidates], self.longitudes[candidates])
+
+    def within_radius(self, latitude: float, longitude: float, radius: float = 100,
+                      limit: int | None = None):
+        """Airports within radius km, the most important ones (tier) first and then by distance
+        :return: list of (airport, distance in km)
+        """
+        candidates = self._candidates(latitude, longitude, radius)
+        if len(candidates) == 0:
+            return []
+        distances = self._distances(latitude, longitude, candidates)
+        inside = distances <= radius
+        candidates, distances = candidates[inside], distances[inside]
+        # lexsort uses the last key as the primary one
+        order = np.lexsort((distances, self.tiers[candidates]))[:limit]
+        return [(self.airports[candidates[i]], float(distances[i])) for i in order]
+
+    def nearest(self, latitude: float, longitude: float, k: int = 10):
+        """k nearest airports by distance (tier breaks ties)
+        :return: list of (airport, distance in km)
+        """
+        if k <= 0 or len(self.airports) == 0:
+            return []
+        k = min(k, len(self.airports))
+        radius = 100.0
+        # The search circle is doubled until it holds k airports, every airport within the
+        # circle is a candidate, so the k nearest of them are the k nearest overall
+        while True:
+            candidates = self._candidates(latitude, longitude, radius)
+            distances = self._distances(latitude, longitude, candidates)
+            inside = distances <= radius
+            if np.count_nonzero(inside) >= k or radius >= HALF_CIRCUMFERENCE:
+                break
+            radius *= 2
+        candidates, distances = candidates[inside], distances[inside]
+        order = np.lexsort((self.tiers[candidates], distances))[:k]
+        return [(self.airports[candidates[i]], float(distances[i])) for i in order]
@@ -0,0 +1,169 @@
+"""Bulk import of trips (POST /trips/import), for users bringing their trips from another planner.
+The body is one of:
+  application/json       a list of TripIn
+  application/x-ndjson   one TripIn per line
+  text/csv               one leg per row, with a header:
+                         trip,user_id,name,leg_no,mode,origin_city,destination_city,leg_start,leg_stop,flight_id
+                         consecutive rows with the same trip (or user_id and name without a trip
+                         column) are the legs of one trip
+
+NDJSON and CSV are parsed line by line while the body is received. Every trip is validated
+before anything is written: the model, unique leg numbers, and that the user, the cities and
+the flights exist (one query per kind, the cities from the reference data snapshot). The valid
+trips are then written with one bulk INSERT per table (trips with RETURNING for the ids,
+trip_legs, leg_flight) and one commit. The result lists every trip with its id or its errors.
+"""
+import csv
+import json
+import os
+
+from pydantic import ValidationError
+
+from .pydantic_models import TripIn
+
+MAX_TRIPS = int(os.getenv("TRIP_IMPORT_MAX_TRIPS", "1000"))
+CSV_COLUMNS = ("trip", "user_id", "name", "leg_no", "mode", "origin_city", "destination_city",
+               "leg_start", "leg_stop", "flight_id")
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+
+class TooManyTrips(ValueError):
+    pass
+
+
+async def iter_lines(chunks):
+    """Text lines of a byte stream, as they arrive"""
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8-sig").rstrip("\r")
+    if pending:
+        yield pending.decode("utf-8-sig").rstrip("\r")
+
+
+def _count(items: list, max_trips: int):
+    if len(items) > max_trips:
+        raise TooManyTrips(f"At most {max_trips} trips can be imported at once")
+
+
+async def read_json(chunks, max_trips: int = MAX_TRIPS) -> list:
+    body = b"".join([chunk async for chunk in chunks])
+    try:
+        payloads = json.loads(body)
+    except ValueError as error:
+        raise ValueError(f"Invalid JSON: {error}") from None
+    if not isinstance(payloads, list):
+        raise ValueError("A list of trips is expected")
+    _count(payloads, max_trips)
+    return payloads
+
+
+async def read_ndjson(chunks, max_trips: int = MAX_TRIPS) -> list:
+    """Payload dicts, a line that is not JSON is kept as an error for its trip"""
+    payloads = []
+    async for line in iter_lines(chunks):
+        if not line.strip():
+            continue
+        try:
+            payloads.append(json.loads(line))
+        except ValueError as error:
+            payloads.append(ValueError(f"Invalid JSON: {error}"))
+        _count(payloads, max_trips)
+    return payloads
+
+
+async def read_csv(chunks, max_trips: int = MAX_TRIPS) -> list:
+    """Rows grouped into TripIn shaped dicts, empty cells are left out (model defaults)"""
+    payloads = []
+    lines = iter_lines(chunks)
+    header = None
+    previous_key = None
+    async for line in lines:
+        if not line.strip():
+            continue
+        row = next(csv.reader([line]))
+        if header is None:
+            header = [column.strip() for column in row]
+            unknown = set(header) - set(CSV_COLUMNS)
+            if unknown:
+                raise ValueError(f"Unknown CSV columns: {', '.join(sorted(unknown))}")
+            continue
+        values = {column: value.strip() for column, value in zip(header, row) if value.strip()}
+        key = values.get("trip") or (values.get("user_id"), values.get("name"))
+        if key != previous_key:
+            payloads.append({"user_id": values.get("user_id"), "name": values.get("name"),
+                             "trip_legs": []})
+            previous_key = key
+            _count(payloads, max_trips)
+        leg = {column: values[column] for column in
+               ("leg_no", "mode", "origin_city", "destination_city", "leg_start", "leg_stop")
+               if column in values}
+        if "flight_id" in values:
+            leg["flight"] = {"flight_id": values["flight_id"]}
+        payloads[-1]["trip_legs"].append(leg)
+    return payloads
+
+
+async def read_trips(content_type: str | None, chunks, max_trips: int = MAX_TRIPS) -> list:
+    media_type = (content_type or "application/json").split(";")[0].strip().lower()
+    if media_type in NDJSON_TYPES:
+        return await read_ndjson(chunks, max_trips)
+    if media_type in ("text/csv", "application/csv"):
+        return await read_csv(chunks, max_trips)
+    if media_type == "application/json":
+        return await read_json(chunks, max_trips)
+    raise LookupError(f"Unsupported content type: {media_type}")
+
+
+def _errors(error: ValidationError) -> list[str]:
+    return [f"{'.'.join(str(part) for part in item['loc'])}: {item['msg']}"
+            for item in error.errors()]
+
+
+def validate_trips(payloads: list, user_ids: set, city_keys, flight_ids: set) -> list:
+    """(TripIn or None, errors) per payload"""
+    validated = []
+    for payload in payloads:
+        if isinstance(payload, Exception):
+            validated.append((None, [str(payload)]))
+            continue
+        try:
+            trip = TripIn.model_validate(payload)
+        except ValidationError as error:
+            validated.append((None, _errors(error)))
+            continue
+        errors = []
+        if trip.user_id not in user_ids:
+            errors.append(f"Unknown user {trip.user_id}")
+        if not trip.trip_legs:
+            errors.append("A trip needs at least one leg")
+        leg_numbers = [leg.leg_no for leg in trip.trip_legs]
+        if len(set(leg_numbers)) != len(leg_numbers):
+            errors.append("Leg numbers must be unique within a trip")
+        for leg in trip.trip_legs:
+            for city in (leg.origin_city, leg.destination_city):
+                if city not in city_keys:
+                    errors.append(f"Leg {leg.leg_no}: unknown city {city}")
+            if leg.flight.flight_id not in flight_ids:
+                errors.append(f"Leg {leg.leg_no}: unknown flight {leg.flight.flight_id}")
+        validated.append((None, errors) if errors else (trip, []))
+    return validated
+
+
+def referenced_ids(payloads: list) -> tuple[set, set]:
+    """User ids and flight ids mentioned by the payloads, to check them with one query each"""
+    user_ids, flight_ids = set(), set()
+    for payload in payloads:
+        if not isinstance(payload, dict):
+            continue
+        try:
+            user_ids.add(int(payload.get("user_id")))
+        except (TypeError, ValueError):
+            pass
+        for leg in payload.get("trip_legs") or ():
+            flight = leg.get("flight") if isinstance(leg, dict) else None
+            if isinstance(flight, dict) and isinstance(flight.get("flight_id"), str):
+                flight_ids.add(flight["flight_id"])
+    return user_ids, flight_ids
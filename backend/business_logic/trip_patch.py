@@ -0,0 +1,108 @@
+"""Applies a TripUpdate (insert/update/delete of legs and flights) to a stored trip.
+The existing legs are indexed once (leg_no -> has a flight, one query without the trip graph),
+the changes are checked and merged against that index in the order they are given, and the
+result is written with one statement per kind of change (TripRepository.apply_trip_patch):
+the number of statements does not depend on the number of legs or changes.
+
+Changes to the same leg are merged: insert + update is one insert, insert + delete is nothing,
+delete + insert replaces the leg (the delete is written first).
+"""
+from .pydantic_models import LegFlightUpdate, TripLegUpdate, TripUpdate
+
+
+class TripPatch:
+    def __init__(self, trip_id: int, legs: dict[int, bool]):
+        self.trip_id = trip_id
+        self.legs = dict(legs)          # leg_no -> has a flight, as after the changes so far
+        self.name = None
+        self.rename = False
+        self.leg_inserts = {}           # leg_no -> columns
+        self.leg_updates = {}           # leg_no -> changed columns
+        self.leg_deletes = set()        # Stored legs, with their flight
+        self.flight_inserts = {}        # leg_no -> flight_id
+        self.flight_updates = {}
+        self.flight_deletes = set()     # Stored flights of kept legs
+
+    @classmethod
+    def from_update(cls, trip_update: TripUpdate, legs: dict[int, bool]):
+        patch = cls(trip_update.trip_id, legs)
+        if "name" in trip_update.model_fields_set:
+            patch.rename = True
+            patch.name = trip_update.name
+        for leg in trip_update.trip_leg or ():
+            patch.apply_leg(leg)
+        for flight in trip_update.trip_flight or ():
+            patch.apply_flight(flight)
+        return patch
+
+    def _check_leg(self, leg_no: int):
+        if leg_no not in self.legs:
+            raise ValueError(f"Leg {leg_no} not found in trip {self.trip_id}")
+
+    def _check_flight(self, leg_no: int):
+        self._check_leg(leg_no)
+        if not self.legs[leg_no]:
+            raise ValueError(f"Leg {leg_no} of trip {self.trip_id} has no flight")
+
+    def apply_leg(self, leg: TripLegUpdate):
+        leg_no = leg.leg_no
+        columns = leg.model_dump(exclude_unset=True, exclude={"leg_no", "update_mode"})
+        match leg.update_mode:
+            case "I":
+                if leg_no in self.legs:
+                    raise ValueError(f"Leg {leg_no} already exists in trip {self.trip_id}")
+                self.legs[leg_no] = False
+                self.leg_inserts[leg_no] = leg.model_dump(exclude={"update_mode"})
+            case "U":
+                self._check_leg(leg_no)
+                if leg_no in self.leg_inserts:
+                    self.leg_inserts[leg_no].update(columns)
+                else:
+                    self.leg_updates.setdefault(leg_no, {}).update(columns)
+            case "D":
+                self._check_leg(leg_no)
+                del self.legs[leg_no]
+                self.flight_inserts.pop(leg_no, None)
+                self.flight_updates.pop(leg_no, None)
+                if self.leg_inserts.pop(leg_no, None) is None:
+                    # A stored leg, its flight goes with it
+                    self.leg_updates.pop(leg_no, None)
+                    self.flight_deletes.discard(leg_no)
+                    self.leg_deletes.add(leg_no)
+
+    def apply_flight(self, flight: LegFlightUpdate):
+        leg_no = flight.leg_no
+        match flight.update_mode:
+            case "I":
+                self._check_leg(leg_no)
+                if self.legs[leg_no]:
+                    raise ValueError(f"Leg {leg_no} of trip {self.trip_id} already has a flight")
+                self.legs[leg_no] = True
+                self.flight_inserts[leg_no] = flight.flight_id
+            case "U":
+                self._check_flight(leg_no)
+                if leg_no in self.flight_inserts:
+                    self.flight_inserts[leg_no] = flight.flight_id
+                else:
+                    self.flight_updates[leg_no] = flight.flight_id
+            case "D":
+                self._check_flight(leg_no)
+                self.legs[leg_no] = False
+                self.flight_updates.pop(leg_no, None)
+                if self.flight_inserts.pop(leg_no, None) is None:
+                    self.flight_deletes.add(leg_no)
+
+    @property
+    def changed_legs(self) -> set[int]:
+        """Legs to send back: inserted, updated or with a new or changed flight"""
+        return (set(self.leg_inserts) | set(self.leg_updates) | set(self.flight_inserts)
+                | set(self.flight_updates))
+
+    @property
+    def removed_flights(self) -> set[int]:
+        """Kept legs that no longer have a flight"""
+        return {leg_no for leg_no in self.flight_deletes
+                if leg_no in self.legs and leg_no not in self.flight_inserts}
+
+    def is_empty(self) -> bool:
+        return not (self.rename or self.changed_legs or self.leg_deletes or self.flight_deletes)
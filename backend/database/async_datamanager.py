@@ -0,0 +1,225 @@
+"""Async counterparts of the repositories in datamanager.py, used by the async execution mode.
+Lazy loading is not possible with an AsyncSession, so every query that is serialized into a
+pydantic model with nested objects loads the needed relationships up front.
+"""
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from backend.database.orm_models import (
+    UserSchema, Airport, City, Schedules)
+from backend.business_logic.pydantic_models import UserIn
+from backend.database.datamanager import (
+    routes_upsert, fetch_log_query, fetch_log_upsert,
+    notify_schedules_changed, trips_delete_statements, ROUTE_LOAD_OPTIONS, AIRPORT_LOAD_OPTIONS,
+    USER_LOAD_OPTIONS)
+
+import math
+
+
+class AsyncSessionManager:
+    def __init__(self, session: AsyncSession):
+        self._session = session
+
+    @property
+    def session(self):
+        """Read-only access for all subclasses."""
+        return self._session
+
+    async def release(self):
+        """See UnitOfWork.release, the objects have to be loaded again"""
+        await self.session.rollback()
+
+    async def commit(self):
+        """To save the Database Updates to underlying database"""
+        try:
+            await self.session.commit()
+        except Exception as error:
+            await self.session.rollback()
+            msg = "Database operation Failed:"
+            raise RuntimeError(f"{msg}{str(error)}") from error
+
+
+class AsyncUserRepository:
+    def __init__(self, session: AsyncSession):
+        self._db = AsyncSessionManager(session)
+
+    @property
+    def db(self):
+        """Read-only access for all subclasses."""
+        return self._db.session
+
+    async def select_user_by_cred(
+            self,
+            user_name: str | None = None,
+            email: str | None = None,
+            with_details: bool = False
+    ):
+        """with_details loads what UserOut serializes (no lazy loading on an AsyncSession)"""
+        stmt = select(UserSchema)
+        if with_details:
+            stmt = stmt.options(*USER_LOAD_OPTIONS)
+        if email:
+            stmt = stmt.where(UserSchema.email == email)
+        if user_name:
+            stmt = stmt.where(UserSchema.username == user_name)
+        result = await self.db.execute(stmt.limit(1))
+        return result.scalars().first()
+
+    async def create_user(self, user_in: UserIn):
+
+        user = await self.select_user_by_cred(user_in.username, user_in.email)
+        if user:
+            raise ValueError("User already exists.")
+        if not user_in.username and user_in.email:
+            user_in.username = user_in.email
+        user = UserSchema(**user_in.model_dump())
+        self.db.add(user)
+        await self._db.commit()
+        await self.db.refresh(user)
+        return user
+
+    async def release_connection(self):
+        await self._db.release()
+
+    async def set_password(self, user: UserSchema, password_hash: str):
+        user.password = password_hash
+        await self._db.commit()
+
+    async def get_user(self, user_id: int):
+
+        user = await self.db.get(UserSchema, user_id)
+        return user
+
+    async def delete_user(self, user_id: int):
+        """Same as UserRepository.delete_user"""
+        dialect_name = self.db.bind.dialect.name
+        trips = 0
+        for statement in trips_delete_statements(dialect_name, user_id=user_id):
+            trips = (await self.db.execute(statement)).rowcount
+        users = (await self.db.execute(
+            delete(UserSchema).where(UserSchema.id == user_id)
+            .execution_options(synchronize_session=False))).rowcount
+        if not users:
+            await self.db.rollback()
+            raise ValueError("User Not found!")
+        await self._db.commit()
+        return {"users": users, "trips": trips}
+
+
+class AsyncAirportRepo:
+    def __init__(self, session: AsyncSession):
+        self._db = AsyncSessionManager(session)
+
+    @property
+    def db(self):
+        """Read-only access for all subclasses."""
+        return self._db.session
+
+    async def get_airports_within_radius(self, centre_lat: float, centre_long: float, radius: int = 100):
+        # Same query as AirportRepo.get_airports_within_radius
+        earth_radius = 6371
+
+        lat_delta = radius / 111
+        long_delta = radius / (111 * math.cos(math.radians(centre_lat)))
+
+        lat_rad = math.radians(centre_lat)
+        lon_rad = math.radians(centre_long)
+
+        distance = (
+                earth_radius * func.acos(
+            func.cos(lat_rad)
+            * func.cos(func.radians(Airport.latitude))
+            * func.cos(func.radians(Airport.longitude) - lon_rad)
+            + func.sin(lat_rad)
+            * func.sin(func.radians(Airport.latitude))
+        )
+        )
+
+        stmt = (
+            select(Airport)
+            .where(Airport.latitude.between(centre_lat - lat_delta, centre_lat + lat_delta))
+            .where(Airport.longitude.between(centre_long - long_delta, centre_long + long_delta))
+            .where(distance <= radius)
+            .options(*AIRPORT_LOAD_OPTIONS)
+        )
+        result = await self.db.execute(stmt)
+        return result.scalars().all()
+
+    async def get_airport(self, code):
+        airport = await self.db.get(Airport, code)
+        if airport:
+            return airport
+        return False
+
+    async def get_airports(self, code_list):
+        stmt = (select(Airport)
+                .where(Airport.airport_key.in_(code_list))
+                .options(*AIRPORT_LOAD_OPTIONS))
+        result = await self.db.execute(stmt)
+        airports = result.scalars().all()
+        if airports:
+            return airports
+        return None
+
+    async def get_city(self, code):
+        # CityModel also serializes the airports of the city
+        stmt = (select(City)
+                .where(City.city_key == code)
+                .options(selectinload(City.airports)))
+        result = await self.db.execute(stmt)
+        return result.scalars().first()
+
+    async def get_airport_schedules(self,
+                                    from_airports: list[str] | None = None,
+                                    to_airports: list[str] | None = None,
+                                    dep_time=None,
+                                    arr_time=None
+                                    ):
+        if not from_airports and not to_airports:
+            raise Exception("Airports needed to find airport routes!")
+
+        stmt = select(Schedules).options(*ROUTE_LOAD_OPTIONS)
+        if from_airports:
+            stmt = stmt.where(Schedules.orig_airport.in_(from_airports))
+        if to_airports:
+            stmt = stmt.where(Schedules.dest_airport.in_(to_airports))
+        if dep_time:
+            stmt = stmt.where(Schedules.dep_time >= dep_time)
+        if arr_time:
+            stmt = stmt.where(Schedules.arr_time <= arr_time)
+        result = await self.db.execute(stmt)
+        return result.scalars().all()
+
+    async def get_fetch_log(self, airport_keys: list[str], direction: str, windows: list):
+        result = await self.db.execute(fetch_log_query(airport_keys, direction, windows))
+        return {(row.airport_key, row.window_start): row.fetched_at for row in result}
+
+    async def record_fetches(self, fetches: list, direction: str, fetched_at):
+        if not fetches:
+            return
+        stmt, rows = fetch_log_upsert(self.db.bind.dialect.name, fetches, direction, fetched_at)
+        await self.db.execute(stmt, rows)
+        await self._db.commit()
+
+    async def add_routes(self, routes_list):
+        """Same upsert as AirportRepo.add_routes, the airport details are loaded along with
+        the RETURNING rows"""
+        statements = routes_upsert(self.db.bind.dialect.name, routes_list)
+        if not statements:
+            return []
+        schedules = []
+        for stmt, rows in statements:
+            result = await self.db.scalars(
+                stmt.options(*ROUTE_LOAD_OPTIONS), rows, execution_options={"populate_existing": True})
+            schedules.extend(result.all())
+        # The returned rows are complete, expiring them on commit would mean a SELECT per flight
+        sync_session = self.db.sync_session
+        expire_on_commit = sync_session.expire_on_commit
+        sync_session.expire_on_commit = False
+        try:
+            await self._db.commit()
+        finally:
+            sync_session.expire_on_commit = expire_on_commit
+        notify_schedules_changed([row for _stmt, rows in statements for row in rows])
+        return schedules
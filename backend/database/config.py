@@ -1,5 +1,16 @@
 from configparser import ConfigParser
 from pathlib import Path
+import os
+
+# Connection pool of the engine, overridden by a [pool] section in database.ini and by the
+# DB_POOL_* environment variables (in that order)
+POOL_DEFAULTS = {
+    "pool_size": 10,            # Connections kept open
+    "max_overflow": 20,         # Extra connections under load, closed when returned
+    "pool_timeout": 30,         # Seconds to wait for a connection before failing the request
+    "pool_recycle": 1800,       # Seconds, older connections are replaced (server/proxy timeouts)
+    "pool_pre_ping": True,      # Test the connection on checkout, dropped connections are replaced
+}
 
 def load_config(filename='database.ini', section='postgresql'):
     parser = ConfigParser()
@@ -14,6 +25,24 @@ def load_config(filename='database.ini', section='postgresql'):
     else:
         raise Exception('Section {0} not found in the {1} file'.format(section, filename))
     return config
+
+
+def load_pool_config(filename='database.ini', section='pool'):
+    parser = ConfigParser()
+    parser.read(Path(__file__).resolve().parent / filename)
+    settings = dict(parser.items(section)) if parser.has_section(section) else {}
+    config = {}
+    for name, default in POOL_DEFAULTS.items():
+        value = os.getenv(f"DB_{name.upper()}", settings.get(name))
+        if value is None:
+            config[name] = default
+        elif isinstance(default, bool):
+            config[name] = str(value).strip().lower() in ("1", "true", "yes", "on")
+        else:
+            config[name] = int(value)
+    return config
+
+
 if __name__ == '__main__':
     config = load_config()
     print(config)
\ No newline at end of file
@@ -1,12 +1,16 @@
 """Here contains classes and methods that directly uses the ORM models for CRUD operations"""
-from sqlalchemy.orm import Session
-from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import Integer, and_, any_, delete, func, insert, literal, or_, select, update
+from sqlalchemy.dialects.postgresql import ARRAY, insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm.exc import NoResultFound
-from datetime import time
+from datetime import datetime, time
+
+from backend.utilities.time_travel import to_time
 
 from backend.database.orm_models import (
     UserSchema, TripSchema, TripLeg, LegFlight, Airport, City, Schedules, SessionLocal,
-    Country)
+    Country, DataVersion, ScheduleFetchLog, IngestionCheckpoint)
 from backend.business_logic.pydantic_models import (
     UserIn, TripIn, TripOut, TripLegIn, LegFlightIn, LegFlightUpdate,
     TripLegUpdate, TripHeader, UserUpdate)
@@ -18,35 +22,233 @@ import math
 
 """
 
-class SingletonMeta(type):
-    """
-    Meta Class, This is a factory class which creates other classes.
-    Technically normal classes are inherited from object by default, Meta classes are
-    inherited from type.
-    """
-    _instances = {}
+def airport_details_options(relationship):
+    """Loads an airport relationship together with its city and country (AllAirportModel)"""
+    return selectinload(relationship).selectinload(Airport.city).selectinload(City.country)
+
+
+# RouteModel serializes both airports with their city and country. Loading the whole graph up
+# front costs a fixed number of SELECT ... IN statements, lazy loading costs several per flight
+ROUTE_LOAD_OPTIONS = (
+    airport_details_options(Schedules.orig_airport_details),
+    airport_details_options(Schedules.dest_airport_details),
+)
+AIRPORT_LOAD_OPTIONS = (
+    selectinload(Airport.city).selectinload(City.country),
+)
+# Leg as serialized by TripLegOut: flight -> route -> airports -> city -> country
+LEG_LOAD_OPTIONS = (
+    selectinload(TripLeg.flight_details)
+    .selectinload(LegFlight.flight_data)
+    .options(*ROUTE_LOAD_OPTIONS),
+)
+# Complete trip graph as serialized by TripOut
+TRIP_LOAD_OPTIONS = (
+    selectinload(TripSchema.trip_details).options(*LEG_LOAD_OPTIONS),
+)
+# User as serialized by UserOut: trips and home city with its airports
+USER_LOAD_OPTIONS = (
+    selectinload(UserSchema.user_trips).options(*TRIP_LOAD_OPTIONS),
+    selectinload(UserSchema.city_details).selectinload(City.airports),
+)
+
+
+def trips_by_user_query(user_id: int, limit: int | None = None,
+                        after: tuple[datetime, int] | None = None):
+    """Trips of a user, newest first. Keyset pagination: after is (created_at, trip_id) of the
+    last trip of the previous page, so a page costs the same however deep it is (no OFFSET)"""
+    stmt = (select(TripSchema)
+            .where(TripSchema.user_id == user_id)
+            .order_by(TripSchema.created_at.desc(), TripSchema.trip_id.desc())
+            .options(*TRIP_LOAD_OPTIONS))
+    if after is not None:
+        created_at, trip_id = after
+        stmt = stmt.where(or_(
+            TripSchema.created_at < created_at,
+            and_(TripSchema.created_at == created_at, TripSchema.trip_id < trip_id)
+        ))
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+
+def dialect_insert(dialect_name: str, model):
+    """INSERT construct with ON CONFLICT support for the dialect of the session"""
+    if dialect_name == "sqlite":
+        return sqlite_insert(model)
+    return postgresql_insert(model)
+
+
+def column_groups(rows) -> list[tuple[frozenset, list[dict]]]:
+    """Rows grouped by the columns they carry. A column missing from a row is not known, not
+    NULL, so every group gets its own statement that only sets the columns of its rows"""
+    groups = {}
+    for row in rows:
+        groups.setdefault(frozenset(row), []).append(row)
+    return list(groups.items())
+
+
+def routes_upsert(dialect_name: str, routes_list: list[dict], returning: bool = True):
+    """(statement, parameter rows) per group of columns to upsert a batch of routes (Schedules).
+    A row can only be touched once by ON CONFLICT, so the batch is made unique per flight id,
+    and only the columns a route carries are updated on a conflict"""
+    routes = {route["flight_id"]: route for route in routes_list}
+    statements = []
+    for columns, group in column_groups(routes.values()):
+        rows = [
+            {**route, **{column: to_time(route[column])
+                         for column in ("dep_time", "arr_time") if column in route}}
+            for route in group
+        ]
+        insert_stmt = dialect_insert(dialect_name, Schedules)
+        update_columns = {column: insert_stmt.excluded[column]
+                          for column in columns if column != "flight_id"}
+        if update_columns:
+            stmt = insert_stmt.on_conflict_do_update(index_elements=[Schedules.flight_id],
+                                                     set_=update_columns)
+        else:
+            stmt = insert_stmt.on_conflict_do_nothing(index_elements=[Schedules.flight_id])
+        if returning:
+            stmt = stmt.returning(Schedules)
+        statements.append((stmt, rows))
+    return statements
+
+
+def master_data_upsert(dialect_name: str, model, rows: list[dict]):
+    """(statement, parameter rows) per group of columns to upsert a batch of master data rows
+    (Country, City, Airport, Airline) on their primary key, like routes_upsert"""
+    key_columns = [column.name for column in model.__table__.primary_key.columns]
+    unique_rows = {tuple(row[column] for column in key_columns): row for row in rows}
+    statements = []
+    for columns, group in column_groups(unique_rows.values()):
+        insert_stmt = dialect_insert(dialect_name, model)
+        update_columns = {column: insert_stmt.excluded[column]
+                          for column in columns if column not in key_columns}
+        if update_columns:
+            stmt = insert_stmt.on_conflict_do_update(index_elements=key_columns, set_=update_columns)
+        else:
+            stmt = insert_stmt.on_conflict_do_nothing(index_elements=key_columns)
+        statements.append((stmt, group))
+    return statements
+
+
+# Dialects that delete the legs and flights of a trip with the trip (ON DELETE CASCADE, see
+# travelbase.sql). SQLite only enforces foreign keys with PRAGMA foreign_keys, there the children
+# are deleted with their own statement
+CASCADE_DIALECTS = {"postgresql"}
+
+
+def ids_match(dialect_name: str, column, ids):
+    """column = ANY(:ids) on PostgreSQL: one array parameter, the same statement whatever the
+    number of ids. IN elsewhere"""
+    ids = list(ids)
+    if dialect_name == "postgresql":
+        return column == any_(literal(ids, ARRAY(Integer)))
+    return column.in_(ids)
+
+
+def trips_delete_statements(dialect_name: str, trip_ids=None, user_id: int | None = None):
+    """Statements deleting trips by id or all the trips of a user, with their legs and flights.
+    The last statement deletes the trips (its rowcount is the number of trips deleted)"""
+    if trip_ids is not None:
+        condition = ids_match(dialect_name, TripSchema.trip_id, trip_ids)
+    else:
+        condition = TripSchema.user_id == user_id
+    statements = []
+    if dialect_name not in CASCADE_DIALECTS:
+        trips = select(TripSchema.trip_id).where(condition)
+        statements.append(delete(LegFlight).where(LegFlight.trip_id.in_(trips)))
+        statements.append(delete(TripLeg).where(TripLeg.trip_id.in_(trips)))
+    statements.append(delete(TripSchema).where(condition))
+    # The rows are not loaded, objects of the session are not looked up either
+    return [statement.execution_options(synchronize_session=False) for statement in statements]
+
+
+def fetch_log_query(airport_keys: list[str], direction: str, windows: list[datetime]):
+    return (
+        select(ScheduleFetchLog.airport_key, ScheduleFetchLog.window_start,
+               ScheduleFetchLog.fetched_at)
+        .where(ScheduleFetchLog.airport_key.in_(airport_keys))
+        .where(ScheduleFetchLog.direction == direction)
+        .where(ScheduleFetchLog.window_start.in_(windows))
+    )
+
+
+def fetch_log_upsert(dialect_name: str, fetches: list[tuple[str, datetime]], direction: str,
+                     fetched_at: datetime):
+    """Statement and parameter rows to record (airport, window) fetches in the fetch log"""
+    rows = [
+        {"airport_key": airport_key, "direction": direction, "window_start": window_start,
+         "fetched_at": fetched_at}
+        for airport_key, window_start in set(fetches)
+    ]
+    insert_stmt = dialect_insert(dialect_name, ScheduleFetchLog)
+    stmt = insert_stmt.on_conflict_do_update(
+        index_elements=[ScheduleFetchLog.airport_key, ScheduleFetchLog.direction,
+                        ScheduleFetchLog.window_start],
+        set_={"fetched_at": insert_stmt.excluded.fetched_at},
+    )
+    return stmt, rows
+
+
+_schedule_listeners = []
+
+
+def on_schedules_changed(listener):
+    """Registers listener(upserted_routes, deleted_flight_ids), called after every committed
+    change of the Schedules table by the repositories. Used by the in-memory structures
+    built from the schedules (timetable, route graph) to stay up to date"""
+    _schedule_listeners.append(listener)
+    return listener
+
+
+def notify_schedules_changed(upserted: list[dict], deleted: list[str] = ()):
+    for listener in _schedule_listeners:
+        try:
+            listener(upserted, list(deleted))
+        except Exception as error:
+            print("Schedules listener failed:", error)
 
-    def __call__(cls, *args, **kwargs):
-        """
-        Normal methods of metaclasses will have cls as first parameter, not self
-        Don't confuse with normal classes' class methods which also have cls as first parameter
-        """
-        if cls not in cls._instances:
-            cls._instances[cls] = super().__call__(*args, **kwargs)
-        return cls._instances[cls]
 
+class UnitOfWork:
+    """One session for one unit of work (a request, a background job or a script).
+    Used as a context manager it opens the session and closes it at the end, rolling back
+    whatever was not committed:
 
-class SessionManager(metaclass=SingletonMeta):
-    # Class Variable
-    # _db = SessionLocal()
-    def __init__(self, session: Session):
+        with UnitOfWork() as unit:
+            TripRepository(unit.session).add_trip(...)
+
+    The repositories wrap the session they are given, so all the repositories of a unit share
+    its identity map and transaction and nothing outlives the unit"""
+    def __init__(self, session: Session | None = None, session_factory=SessionLocal):
+        self._session_factory = session_factory
         self._session = session
 
+    def __enter__(self):
+        if self._session is None:
+            self._session = self._session_factory()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is not None:
+                self._session.rollback()
+        finally:
+            self._session.close()
+            self._session = None
+
     @property
     def session(self):
         """Read-only access for all subclasses."""
+        if self._session is None:
+            raise RuntimeError("The unit of work has no session, use it as a context manager")
         return self._session
 
+    def release(self):
+        """Ends the (read) transaction so the connection goes back to the pool, e.g. before a slow
+        computation. The loaded objects are expired and reloaded on their next use"""
+        self.session.rollback()
+
     def commit(self):
         """To save the Database Updates to underlying database"""
         try:
@@ -59,7 +261,7 @@ class SessionManager(metaclass=SingletonMeta):
 
 class UserRepository:
     def __init__(self, session: Session):
-        self._db = SessionManager(session)
+        self._db = UnitOfWork(session)
 
     @property
     def db(self):
@@ -111,6 +313,13 @@ class UserRepository:
 
         return user  # Return can be made separate pydantic model (UserOut) either here or in handler.py
 
+    def release_connection(self):
+        self._db.release()
+
+    def set_password(self, user: UserSchema, password_hash: str):
+        user.password = password_hash
+        self._db.commit()
+
     def update_user(self, user_db: UserSchema, user_update: UserUpdate):
 
         new_user = user_update.model_dump(exclude_unset=True)
@@ -134,33 +343,36 @@ class UserRepository:
         """
         In Future can implement "Marked for deletion" can be implemented, but for User ID, it
         doesn't make much sense, it is better to delete it
+        The trips (with their legs and flights) are deleted set-based first, nothing is loaded.
+        Returns the number of rows deleted
         """
-        """
-        Need to delete all the trips that belongs to the user
-        But because of cascading settings the trips and all related transaction data should get deleted
-        """
-        # trips = user.user_trips
-        # trips_object = TripRepository(self.db)
-        # trips_object.delete_trips(trips)
-
-        user = self.get_user(user_id)
-        if not user:
+        dialect_name = self.db.bind.dialect.name
+        trips = 0
+        for statement in trips_delete_statements(dialect_name, user_id=user_id):
+            trips = self.db.execute(statement).rowcount
+        users = self.db.execute(
+            delete(UserSchema).where(UserSchema.id == user_id)
+            .execution_options(synchronize_session=False)).rowcount
+        if not users:
+            self.db.rollback()
             raise ValueError("User Not found!")
-
-        self.db.delete(user)
-        # statement = delete(UserSchema).where(UserSchema.id == user.id)
-        # self.db.execute(statement)
-        """ # Another way
-        user_local = self.db.merge(user)
-        self.db.delete(user_local)
-        """
         self._db.commit()
+        return {"users": users, "trips": trips}
 
     def get_user(self, user_id: int):
 
         user = self.db.get(UserSchema, user_id)
         return user
 
+    def get_user_profile(self, user_id: int):
+        """Columns of UserProfile only (one row, no trips), home city coordinates joined"""
+        stmt = (select(UserSchema.id, UserSchema.role, UserSchema.city, UserSchema.country,
+                       City.latitude, City.longitude, UserSchema.dark_mode, UserSchema.map_mode,
+                       UserSchema.date_tolerance)
+                .outerjoin(City, City.city_key == UserSchema.city)
+                .where(UserSchema.id == user_id))
+        return self.db.execute(stmt).first()
+
     def get_user_trips(self):
         """Admin Method"""
         pass
@@ -194,7 +406,7 @@ class UserRepository:
 
 class TripRepository:
     def __init__(self, session: Session):
-        self._db = SessionManager(session)
+        self._db = UnitOfWork(session)
 
     @property
     def db(self):
@@ -222,6 +434,44 @@ class TripRepository:
             self.db.refresh(trip)
         return trip
 
+    def bulk_create_trips(self, trips: list[TripIn], commit: bool = True) -> list[int]:
+        """Many trips with their legs and flights: one INSERT per table (the ids of the trips
+        come back with RETURNING, in the order of trips) and one commit"""
+        if not trips:
+            return []
+        # PostgreSQL returns the ids of a batched insert in parameter order (INSERT .. SELECT ..
+        # ORDER BY). SQLite would insert row by row for that, but it assigns the ids of one
+        # statement in ascending order, so sorting them gives the same
+        ordered = self.db.bind.dialect.name == "postgresql"
+        trip_ids = self.db.scalars(
+            insert(TripSchema).returning(TripSchema.trip_id, sort_by_parameter_order=ordered),
+            [{"user_id": trip.user_id, "name": trip.name} for trip in trips]).all()
+        if not ordered:
+            trip_ids = sorted(trip_ids)
+        legs = [
+            {"trip_id": trip_id, "leg_no": leg.leg_no, "mode": leg.mode or "flight",
+             "origin_city": leg.origin_city, "destination_city": leg.destination_city,
+             "leg_start": leg.leg_start, "leg_stop": leg.leg_stop}
+            for trip_id, trip in zip(trip_ids, trips) for leg in trip.trip_legs
+        ]
+        self.db.execute(insert(TripLeg), legs)
+        self.db.execute(insert(LegFlight), [
+            {"trip_id": trip_id, "leg_no": leg.leg_no, "flight_id": leg.flight.flight_id}
+            for trip_id, trip in zip(trip_ids, trips) for leg in trip.trip_legs
+        ])
+        if commit:
+            self._db.commit()
+        return list(trip_ids)
+
+    def get_existing_references(self, user_ids, flight_ids) -> tuple[set, set]:
+        """The user ids and flight ids that exist, one query each"""
+        users = set(self.db.scalars(
+            select(UserSchema.id).where(UserSchema.id.in_(list(user_ids))))) if user_ids else set()
+        flights = set(self.db.scalars(
+            select(Schedules.flight_id).where(Schedules.flight_id.in_(list(flight_ids))))) \
+            if flight_ids else set()
+        return users, flights
+
     def change_trip(self, trip_db: TripSchema, changed_trip: TripHeader, commit: bool = False):
 
         new_trip = changed_trip.model_dump(exclude_unset=True)
@@ -234,32 +484,30 @@ class TripRepository:
             self.db.refresh(trip_db)
         return trip_db
 
-    # def delete_trip(self, trip: TripOut, commit:bool=False):
     def delete_trip(self, trip_id: int, commit: bool = False):
-        """
-        Need to delete the corresponding entries from Legs tables
-        """
-        # statement = delete(TripSchema).where(TripSchema.trip_id == trip.trip_id)
-        # self.db.execute(statement)
-
-        trip = self.get_trip(trip_id)
-        if not trip:
+        if not self.delete_trips([trip_id], commit)["trips"]:
             raise ValueError("Trip Not found!")
 
-        self.db.delete(trip)
+    def delete_trips(self, trip_ids: list[int], commit: bool = False):
+        """Set-based: a fixed number of statements however many trips, legs and flights.
+        Returns the number of trips deleted"""
+        deleted = 0
+        if trip_ids:
+            for statement in trips_delete_statements(self.db.bind.dialect.name, trip_ids=set(trip_ids)):
+                deleted = self.db.execute(statement).rowcount
         if commit:
             self._db.commit()
+        return {"trips": deleted}
 
     def get_trip(self, trip_id: int):
 
-        trip = self.db.get(TripSchema, trip_id)
+        trip = self.db.get(TripSchema, trip_id, options=TRIP_LOAD_OPTIONS)
         return trip
 
-    def get_trips_by_user(self, user_id):
+    def get_trips_by_user(self, user_id, limit: int | None = None,
+                          after: tuple[datetime, int] | None = None):
 
-        trips = (self.db.query(TripSchema)
-                 .filter(TripSchema.user_id == user_id)
-                 .all())
+        trips = self.db.scalars(trips_by_user_query(user_id, limit, after)).all()
         return trips
 
     def modify_trip_leg(self, trip_leg_db: TripLeg, new_leg: TripLegUpdate, commit: bool = False):
@@ -345,8 +593,63 @@ class TripRepository:
         trip_leg = self.db.get(TripLeg, (trip_id, leg_no))
         return trip_leg
 
-    def get_trip_legs(self):
-        pass
+    def get_trip_index(self, trip_id: int):
+        """(user_id, {leg_no: has a flight}) of a trip in one query, None if there is no trip"""
+        stmt = (select(TripSchema.user_id, TripLeg.leg_no, LegFlight.leg_no)
+                .outerjoin(TripLeg, TripLeg.trip_id == TripSchema.trip_id)
+                .outerjoin(LegFlight, and_(LegFlight.trip_id == TripLeg.trip_id,
+                                           LegFlight.leg_no == TripLeg.leg_no))
+                .where(TripSchema.trip_id == trip_id))
+        rows = self.db.execute(stmt).all()
+        if not rows:
+            return None
+        legs = {leg_no: flight_leg_no is not None
+                for _user_id, leg_no, flight_leg_no in rows if leg_no is not None}
+        return rows[0][0], legs
+
+    def get_trip_legs(self, trip_id: int, leg_numbers):
+        """Legs of a trip with their flight (as serialized by TripLegOut)"""
+        if not leg_numbers:
+            return []
+        stmt = (select(TripLeg)
+                .where(TripLeg.trip_id == trip_id, TripLeg.leg_no.in_(sorted(leg_numbers)))
+                .order_by(TripLeg.leg_no)
+                .options(*LEG_LOAD_OPTIONS))
+        return self.db.scalars(stmt).all()
+
+    def apply_trip_patch(self, patch, commit: bool = True):
+        """Writes a TripPatch with one statement per kind of change, deletes first so a leg can
+        be deleted and inserted again in the same patch"""
+        trip_id = patch.trip_id
+        flight_deletes = patch.leg_deletes | patch.flight_deletes
+        if flight_deletes:
+            self.db.execute(delete(LegFlight).where(LegFlight.trip_id == trip_id,
+                                                    LegFlight.leg_no.in_(flight_deletes)))
+        if patch.leg_deletes:
+            self.db.execute(delete(TripLeg).where(TripLeg.trip_id == trip_id,
+                                                  TripLeg.leg_no.in_(patch.leg_deletes)))
+        if patch.leg_inserts:
+            self.db.execute(insert(TripLeg), [
+                {**columns, "trip_id": trip_id, "leg_no": leg_no}
+                for leg_no, columns in patch.leg_inserts.items()])
+        if patch.leg_updates:
+            # Bulk UPDATE by primary key (executemany)
+            self.db.execute(update(TripLeg), [
+                {**columns, "trip_id": trip_id, "leg_no": leg_no}
+                for leg_no, columns in patch.leg_updates.items()])
+        if patch.flight_inserts:
+            self.db.execute(insert(LegFlight), [
+                {"trip_id": trip_id, "leg_no": leg_no, "flight_id": flight_id}
+                for leg_no, flight_id in patch.flight_inserts.items()])
+        if patch.flight_updates:
+            self.db.execute(update(LegFlight), [
+                {"trip_id": trip_id, "leg_no": leg_no, "flight_id": flight_id}
+                for leg_no, flight_id in patch.flight_updates.items()])
+        if patch.rename:
+            self.db.execute(update(TripSchema).where(TripSchema.trip_id == trip_id)
+                            .values(name=patch.name))
+        if commit:
+            self._db.commit()
 
     def get_flight_for_leg(self, trip_id: int, leg_no: int):
 
@@ -366,7 +669,7 @@ class TripRepository:
 
 class AirportRepo:
     def __init__(self, session: Session):
-        self._db = SessionManager(session)
+        self._db = UnitOfWork(session)
 
     @property
     def db(self):
@@ -398,6 +701,7 @@ class AirportRepo:
             .filter(Airport.latitude.between(centre_lat - lat_delta, centre_lat + lat_delta))
             .filter(Airport.longitude.between(centre_long - long_delta, centre_long + long_delta))
             .filter(distance <= radius)
+            .options(*AIRPORT_LOAD_OPTIONS)
         )
 
         return query.all()
@@ -409,7 +713,10 @@ class AirportRepo:
         return False
 
     def get_airports(self, code_list):
-        airports = self.db.query(Airport).filter(Airport.airport_key.in_(code_list)).all()
+        airports = (self.db.query(Airport)
+                    .filter(Airport.airport_key.in_(code_list))
+                    .options(*AIRPORT_LOAD_OPTIONS)
+                    .all())
         if airports:
             return airports
         return None
@@ -422,7 +729,8 @@ class AirportRepo:
         return airports
 
     def get_city(self, code):
-        city = self.db.get(City, code)
+        # CityModel also serializes the airports of the city
+        city = self.db.get(City, code, options=[selectinload(City.airports)])
         if city:
             return city
         return None
@@ -440,6 +748,7 @@ class AirportRepo:
             query = (
                 self.db.query(Schedules)
                 .filter(Schedules.orig_airport.in_(from_airports))
+                .options(*ROUTE_LOAD_OPTIONS)
             )
             if to_airports:
                 query = query.filter(Schedules.dest_airport.in_(to_airports))
@@ -447,6 +756,7 @@ class AirportRepo:
             query = (
                 self.db.query(Schedules)
                 .filter(Schedules.dest_airport.in_(to_airports))
+                .options(*ROUTE_LOAD_OPTIONS)
             )
         if dep_time:
             query = query.filter(Schedules.dep_time >= dep_time)
@@ -457,47 +767,71 @@ class AirportRepo:
         return routes
 
     def add_routes(self, routes_list):
-        """This is an upsert case, but did not use on_conflict_do_update"""
-        schedules: list[Schedules] = []
-        # List all the flight ids into a set to avoid duplicate keys
-        flights = {route["flight_id"] for route in routes_list}
-        # Fetch existing records from database
-        existing_flights_db = (
-            self.db.query(Schedules)
-            .filter(Schedules.flight_id.in_(flights))
-            .all()
-        )
-        existing_flights = [flight.flight_id for flight in existing_flights_db]
-        # Delete the existing records
-        # The below logic should be modified so that if the entry exist in DB donot insert, instead of
-        # deleting and reinserting(The below logic is because DB data is outdated, but API is
-        # more upto date)
-        if existing_flights_db:
-            self.delete_routes(existing_flights_db)
-        # Add new records
-        for route in routes_list:
-            schedule = Schedules(**route)
-            self.db.add(schedule)
-            schedules.append(schedule)
+        """Upsert of the whole batch with a single INSERT ... ON CONFLICT DO UPDATE ... RETURNING.
+        Flights that already exist are updated in place (the API is more up to date than the DB),
+        instead of being deleted and reinserted, so the trips (leg_flight) referring to them
+        stay intact"""
+        statements = routes_upsert(self.db.get_bind().dialect.name, routes_list)
+        if not statements:
+            return []
+        # The airport details are loaded along with the RETURNING rows, as for get_airport_schedules
+        schedules = [
+            schedule
+            for stmt, rows in statements
+            for schedule in self.db.scalars(
+                stmt.options(*ROUTE_LOAD_OPTIONS), rows,
+                execution_options={"populate_existing": True})
+        ]
+        # The returned rows are complete, expiring them on commit would mean a SELECT per flight
+        expire_on_commit = self.db.expire_on_commit
+        self.db.expire_on_commit = False
         try:
             self._db.commit()
-        except Exception:
-            raise
-        for schedule in schedules:
-            self.db.refresh(schedule)
+        finally:
+            self.db.expire_on_commit = expire_on_commit
+        notify_schedules_changed([row for _stmt, rows in statements for row in rows])
         return schedules
 
+    def get_fetch_log(self, airport_keys: list[str], direction: str, windows: list[datetime]):
+        """When the windows were last fetched from the provider: {(airport, window): fetched_at}"""
+        stmt = fetch_log_query(airport_keys, direction, windows)
+        return {
+            (row.airport_key, row.window_start): row.fetched_at
+            for row in self.db.execute(stmt)
+        }
+
+    def record_fetches(self, fetches: list[tuple[str, datetime]], direction: str,
+                       fetched_at: datetime):
+        if not fetches:
+            return
+        stmt, rows = fetch_log_upsert(self.db.get_bind().dialect.name, fetches, direction, fetched_at)
+        self.db.execute(stmt, rows)
+        self._db.commit()
+
     def delete_routes(self, flight_list: list[Schedules] ):
-        for flight_db in flight_list:
-            self.db.delete(flight_db)
-        # Another option
-        # flight_ids = [flight_db.flight_id for flight_db in flight_list]
-        # (self.db.query(Schedules).filter(Schedules.flight_id.in_(flight_ids))
-        #  .delete(synchronize_session=False))
+        flight_ids = [flight_db.flight_id for flight_db in flight_list]
+        statement = delete(Schedules).where(Schedules.flight_id.in_(flight_ids))
+        self.db.execute(statement)
         try:
             self._db.commit()
         except Exception:
             raise
+        notify_schedules_changed([], flight_ids)
+
+    def get_timetable_rows(self):
+        """The active schedules with both times, as plain rows for the in-memory timetable"""
+        stmt = (select(Schedules.flight_id, Schedules.orig_airport, Schedules.dest_airport,
+                       Schedules.dep_time, Schedules.arr_time, Schedules.airline)
+                .where(Schedules.status == "active",
+                       Schedules.dep_time.is_not(None), Schedules.arr_time.is_not(None)))
+        return self.db.execute(stmt).mappings().all()
+
+    def get_route_rows(self):
+        """Origin, destination and airline of the active schedules, for the route graph"""
+        stmt = (select(Schedules.flight_id, Schedules.orig_airport, Schedules.dest_airport,
+                       Schedules.airline)
+                .where(Schedules.status == "active"))
+        return self.db.execute(stmt).mappings().all()
 
     def get_city_code(self, city_name):
         stmt = select(City.city_key).where(City.name == city_name)
@@ -508,6 +842,90 @@ class AirportRepo:
         stmt = select(Country.country_key).where(Country.name == country_name)
         country_key = self.db.execute(stmt).scalar_one_or_none()
         return country_key
+class ReferenceDataRepo:
+    """Reads the master data (countries, cities and airports) in bulk for the in-memory
+    reference data snapshot, and keeps track of its version"""
+    MASTER_DATA = "master_data"
+
+    def __init__(self, session: Session):
+        self._db = UnitOfWork(session)
+
+    @property
+    def db(self):
+        """Read-only access for all subclasses."""
+        return self._db.session
+
+    def get_countries(self):
+        stmt = select(Country.country_key, Country.name)
+        return self.db.execute(stmt).mappings().all()
+
+    def get_cities(self):
+        stmt = select(City.city_key, City.name, City.country_key, City.timezone,
+                      City.latitude, City.longitude)
+        return self.db.execute(stmt).mappings().all()
+
+    def get_airports(self):
+        stmt = select(Airport.airport_key, Airport.name, Airport.tier, Airport.city_key,
+                      Airport.latitude, Airport.longitude)
+        return self.db.execute(stmt).mappings().all()
+
+    def get_version(self, name: str = MASTER_DATA):
+        stmt = select(DataVersion.version).where(DataVersion.name == name)
+        version = self.db.execute(stmt).scalar_one_or_none()
+        return version or 0
+
+    def bump_version(self, name: str = MASTER_DATA, commit: bool = True):
+        """To be called by everything that changes the data set"""
+        data_version = self.db.get(DataVersion, name)
+        if data_version:
+            data_version.version += 1
+        else:
+            data_version = DataVersion(name=name, version=1)
+            self.db.add(data_version)
+        if commit:
+            self._db.commit()
+        return data_version.version
+
+
+class IngestionRepo:
+    """Batched bulk loads of the master data with a resumable checkpoint per data set"""
+    def __init__(self, session: Session):
+        self._db = UnitOfWork(session)
+
+    @property
+    def db(self):
+        """Read-only access for all subclasses."""
+        return self._db.session
+
+    def get_checkpoint(self, dataset: str):
+        return self.db.get(IngestionCheckpoint, dataset)
+
+    def reset_checkpoint(self, dataset: str):
+        self.db.execute(delete(IngestionCheckpoint).where(IngestionCheckpoint.dataset == dataset))
+        self._db.commit()
+
+    def store_batch(self, dataset: str, upsert, rows: list[dict], next_offset: int,
+                    total: int | None, completed: bool = False):
+        """Stores a batch and moves the checkpoint past it in the same transaction, so after a
+        failure the load resumes exactly after the last stored batch.
+        upsert is routes_upsert or master_data_upsert bound to a model"""
+        stored = 0
+        if rows:
+            for stmt, group in upsert(self.db.get_bind().dialect.name, rows):
+                self.db.execute(stmt, group)
+                stored += len(group)
+        checkpoint = self.get_checkpoint(dataset)
+        if checkpoint is None:
+            checkpoint = IngestionCheckpoint(dataset=dataset, rows_loaded=0)
+            self.db.add(checkpoint)
+        checkpoint.next_offset = next_offset
+        checkpoint.rows_loaded += stored
+        checkpoint.total = total
+        checkpoint.completed = completed
+        self._db.commit()
+        return checkpoint
+
+
 """
 def db_commit(session):
     """"""To save the Database Updates to underlying database""""""
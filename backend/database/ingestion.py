@@ -0,0 +1,122 @@
+"""Bulk ingestion of the master data (countries, cities, airports, airlines and routes).
+The provider generators stream pages of records into batches of BATCH_SIZE rows. Each batch is
+stored with one multi-row INSERT ... ON CONFLICT DO UPDATE, and the checkpoint of the data set
+(provider offset after the batch) is saved in the same transaction. An interrupted load resumes
+after the last stored batch instead of starting over, a completed load starts from the beginning.
+Progress and throughput are printed after every batch.
+"""
+import os
+import time
+from dataclasses import dataclass
+from functools import partial
+from typing import Callable, Iterator
+
+from backend.api_requests import aviation_stack_api, airlabs_api
+from backend.database import orm_models
+from backend.database.datamanager import (
+    IngestionRepo, ReferenceDataRepo, master_data_upsert, routes_upsert)
+
+BATCH_SIZE = int(os.getenv("INGESTION_BATCH_SIZE", "1000"))
+
+
+@dataclass(frozen=True)
+class Dataset:
+    name: str
+    # offset -> pages of (rows, offset of the next page or None, total or None)
+    pages: Callable[[int], Iterator[tuple[list[dict], int | None, int | None]]]
+    # (dialect name, rows) -> [(statement, rows)], one per group of columns
+    upsert: Callable
+    reference_data: bool = True   # Part of the in-memory reference data snapshot
+
+
+def model_upsert(model):
+    def upsert(dialect_name: str, rows: list[dict]):
+        return master_data_upsert(dialect_name, model, rows)
+    return upsert
+
+
+def single_page(fetch):
+    """Pages of a provider call that returns everything at once (no offset)"""
+    def pages(offset: int = 0):
+        yield fetch(), None, None
+    return pages
+
+
+DATASETS = {
+    "countries": Dataset("countries", single_page(airlabs_api.get_countries),
+                         model_upsert(orm_models.Country)),
+    "cities": Dataset("cities", aviation_stack_api.get_city_pages,
+                      model_upsert(orm_models.City)),
+    "airports": Dataset("airports", aviation_stack_api.get_airport_pages,
+                        model_upsert(orm_models.Airport)),
+    "airlines": Dataset("airlines", aviation_stack_api.get_airline_pages,
+                        model_upsert(orm_models.Airline),
+                        reference_data=False),
+}
+
+
+def routes_dataset(from_airport: str):
+    """Routes are loaded (and checkpointed) per departure airport"""
+    return Dataset(f"routes:{from_airport}",
+                   partial(aviation_stack_api.get_route_pages, from_airport),
+                   partial(routes_upsert, returning=False),
+                   reference_data=False)
+
+
+def batches(pages, batch_size: int):
+    """Regroups the provider pages into batches of about batch_size rows: (rows, offset to resume
+    from after the batch, total). A batch always ends at a page boundary, as the provider can
+    only resume at the start of a page"""
+    batch = []
+    for rows, next_offset, total in pages:
+        batch.extend(rows)
+        # The last page (next offset None) is always stored, also when empty, to complete the load
+        if len(batch) >= batch_size or next_offset is None:
+            yield batch, next_offset, total
+            batch = []
+
+
+class Progress:
+    def __init__(self, dataset: str, rows_loaded: int):
+        self.dataset = dataset
+        self.started_at = time.monotonic()
+        self.rows_at_start = rows_loaded
+
+    def report(self, rows_loaded: int, offset: int | None, total: int | None):
+        elapsed = time.monotonic() - self.started_at
+        rate = (rows_loaded - self.rows_at_start) / elapsed if elapsed else 0
+        position = f"offset {offset}/{total}" if offset is not None and total else "done"
+        print(f"{self.dataset}: {rows_loaded} rows stored, {position}, {rate:.0f} rows/s")
+
+
+def ingest(dataset: Dataset, batch_size: int = BATCH_SIZE, restart: bool = False):
+    """Loads a data set from its checkpoint on, returns the number of rows stored by this run"""
+    with orm_models.SessionLocal() as session:
+        ingestion_db = IngestionRepo(session)
+        if restart:
+            ingestion_db.reset_checkpoint(dataset.name)
+        checkpoint = ingestion_db.get_checkpoint(dataset.name)
+        offset = rows_loaded = 0
+        if checkpoint is not None and not checkpoint.completed:
+            offset, rows_loaded = checkpoint.next_offset, checkpoint.rows_loaded
+            print(f"{dataset.name}: resuming at offset {offset} ({rows_loaded} rows stored before)")
+        elif checkpoint is not None:
+            # A new full load, the rows stored by the previous one are updated in place
+            ingestion_db.reset_checkpoint(dataset.name)
+
+        progress = Progress(dataset.name, rows_loaded)
+        rows_at_start = rows_loaded
+        for rows, next_offset, total in batches(dataset.pages(offset), batch_size):
+            checkpoint = ingestion_db.store_batch(
+                dataset.name, dataset.upsert, rows,
+                next_offset if next_offset is not None else offset,
+                total, completed=next_offset is None)
+            rows_loaded = checkpoint.rows_loaded
+            if next_offset is not None:
+                offset = next_offset
+            progress.report(rows_loaded, next_offset, total)
+
+        if dataset.reference_data:
+            # The in-memory reference data snapshot gets rebuilt
+            ReferenceDataRepo(session).bump_version()
+        return rows_loaded - rows_at_start
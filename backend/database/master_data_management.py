@@ -1,75 +1,32 @@
-"""To add data to the database tables"""
+"""To add data to the database tables
 
-from backend.api_requests import aviation_stack_api, airlabs_api
-import orm_models
-#from models import Session, Country
+    python -m backend.database.master_data_management countries cities airports
+    python -m backend.database.master_data_management routes --airports FRA MUC
+    python -m backend.database.master_data_management airports --restart --batch-size 500
 
-def add_countries():
-    countries = airlabs_api.get_countries()
-    with orm_models.SessionLocal() as session:
-        for values in countries:
-            country = orm_models.Country(**values)
-            session.add(country)
-        session.commit()
+Loads are resumable, see ingestion.py. --restart ignores the checkpoint of an interrupted load.
+"""
+import argparse
 
-def add_cities():
-    #cities = airlabs_api.get_cities()
-    cities = aviation_stack_api.get_cities()
-    with orm_models.SessionLocal() as session:
-        for values in cities:
-            city = orm_models.City(**values)
-            session.add(city)
-        session.commit()
+from backend.database import orm_models
+from backend.database.datamanager import ReferenceDataRepo
+from backend.database.ingestion import BATCH_SIZE, DATASETS, ingest, routes_dataset
+#from models import Session, Country
 
-def add_airports():
-    airports = aviation_stack_api.get_airports()
-    with orm_models.SessionLocal() as session:
-        for values in airports:
-            airport = orm_models.Airport(**values)
-            session.add(airport)
-            session.commit()
+def add_countries(restart: bool = False):
+    return ingest(DATASETS["countries"], restart=restart)
 
-def add_airlines():
-    package = 1
-    offset = 0
-    with orm_models.SessionLocal() as session:
-        #last_airline = session.query(models.Airline).order_by(models.Airline.id.desc()).first()
-        # if last_airline:
-        #     offset = last_airline.id
-        # if package > 100:
-        #     number_of_calls = (package // 100)
-        #     package = 100
-        # else:
-        #     number_of_calls = 1
-        offset = 13159
-        package = 1
-        number_of_calls = 1
-        for i in range(number_of_calls):
-            airlines = aviation_stack_api.get_airlines(offset, package)
-            offset = offset + package
-            for values in airlines:
-                airline = orm_models.Airline(**values)
-                session.add(airline)
-                session.commit()
+def add_cities(restart: bool = False):
+    return ingest(DATASETS["cities"], restart=restart)
 
+def add_airports(restart: bool = False):
+    return ingest(DATASETS["airports"], restart=restart)
 
-def add_routes():
-    from_airport = input("Enter the airport code: ")
-    package = 1000
-    offset = 0
-    with orm_models.SessionLocal() as session:
-        while True:
-            routes, new_offset = aviation_stack_api.get_routes(from_airport,package=package, offset=offset)
-            for route in routes:
-                route = orm_models.Schedules(**route)
-                session.add(route)
-                session.commit()
-            if new_offset == 0:
-                break
-            else:
-                offset = new_offset
-            if package < 1000: #For testing
-                break
+def add_airlines(restart: bool = False):
+    return ingest(DATASETS["airlines"], restart=restart)
+
+def add_routes(from_airport: str, restart: bool = False):
+    return ingest(routes_dataset(from_airport), restart=restart)
 
 def testing():
     pass
@@ -79,15 +36,42 @@ def clear_cities_table():
         try:
             session.query(orm_models.City).delete(synchronize_session="fetch")
             session.commit()
+            ReferenceDataRepo(session).bump_version()
             print(f"Successfully deleted all data from table '{orm_models.City.__tablename__}'.")
         except Exception as e:
             session.rollback()
             print("Error during deletion", e)
 
 
-if __name__ == "__main__":
-    #add_cities()
-    #add_airports()
-    #add_airlines()
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Loads the master data from the providers")
+    parser.add_argument("datasets", nargs="+", choices=[*DATASETS, "routes"],
+                        help="Data sets to load, in the given order")
+    parser.add_argument("--airports", nargs="+", default=[],
+                        help="Departure airports (IATA) of the routes to load")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="Rows per INSERT and checkpoint")
+    parser.add_argument("--restart", action="store_true",
+                        help="Start over instead of resuming an interrupted load")
+    args = parser.parse_args(argv)
+    if "routes" in args.datasets and not args.airports:
+        parser.error("routes needs --airports")
 
-    add_routes()
\ No newline at end of file
+    for name in args.datasets:
+        if name == "routes":
+            datasets = [routes_dataset(airport.upper()) for airport in args.airports]
+        else:
+            datasets = [DATASETS[name]]
+        for dataset in datasets:
+            try:
+                rows = ingest(dataset, args.batch_size, args.restart)
+                print(f"{dataset.name}: finished, {rows} rows stored")
+            except Exception as error:
+                # The checkpoint keeps the stored batches, run the same command again to resume
+                print(f"{dataset.name}: failed, {error}")
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
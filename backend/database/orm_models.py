@@ -2,10 +2,11 @@
 import psycopg2
 import os
 from sqlalchemy import (create_engine, Column, Integer, String, Numeric, Boolean, ForeignKey, DateTime,
-                        Time, func, text, ForeignKeyConstraint)
+                        Time, func, text, ForeignKeyConstraint, Index)
 from sqlalchemy.orm import DeclarativeBase, sessionmaker, relationship, Mapped, mapped_column
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 
-from .config import load_config
+from .config import load_config, load_pool_config
 from decimal import Decimal
 
 
@@ -24,6 +25,24 @@ def get_db_url():
     return None
 
 
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def get_async_db_url():
+    """Same database as get_db_url, but with the async driver (asyncpg/aiosqlite) in the
+    dialect part of the url"""
+    db_url = get_db_url()
+    if db_url is None:
+        return None
+    dialect, separator, rest = db_url.partition("://")
+    return ASYNC_DRIVERS.get(dialect, dialect) + separator + rest
+
+
 # Define the database table class's parent class
 class Base(DeclarativeBase):
     pass
@@ -55,10 +74,15 @@ class TripSchema(Base):
     __tablename__ = "trips"
 
     trip_id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     name = Column(String, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
+    # Trips of a user in the order of the keyset pagination
+    __table_args__ = (
+        Index("trips_user_created", "user_id", "created_at", "trip_id"),
+    )
+
     user_details = relationship("UserSchema", back_populates="user_trips")
     trip_details = relationship(
         "TripLeg",
@@ -70,7 +94,7 @@ class TripSchema(Base):
 class TripLeg(Base):
     __tablename__ = "trip_legs"
 
-    trip_id = Column(Integer, ForeignKey("trips.trip_id"), primary_key=True)
+    trip_id = Column(Integer, ForeignKey("trips.trip_id", ondelete="CASCADE"), primary_key=True)
     leg_no = Column(Integer, primary_key=True)
     mode = Column(String, server_default=text("flight"), nullable=False)
     origin_city = Column(String(3), ForeignKey("city.city_key"))
@@ -141,7 +165,8 @@ class LegFlight(Base):
     __table_args__ = (
         ForeignKeyConstraint(
             ["trip_id", "leg_no"],
-            ["trip_legs.trip_id", "trip_legs.leg_no"]
+            ["trip_legs.trip_id", "trip_legs.leg_no"],
+            ondelete="CASCADE"
         ),
     )
 
@@ -231,6 +256,42 @@ class Schedules(Base):
                                         back_populates="arrivals")
     trips = relationship("LegFlight", back_populates="flight_data")
 
+class ScheduleFetchLog(Base):
+    """When the provider schedules of an airport were last pulled, per direction and time window.
+    The Schedules rows themselves have no date, this decides whether they are still fresh"""
+    __tablename__ = "schedule_fetch_log"
+
+    airport_key = Column(String(3), ForeignKey("airport.airport_key"), primary_key=True)
+    direction = Column(String, primary_key=True)
+    window_start = Column(DateTime, primary_key=True)  # Local time of the airport
+    fetched_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+class DataVersion(Base):
+    """Version counter per data set, bumped whenever the data set is (re)loaded so that the
+    in-memory copies of it know when they need to be rebuilt"""
+    __tablename__ = "data_version"
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, server_default=text("0"))
+    changed_at = Column(
+        DateTime(timezone=True), nullable=False,
+        server_default=func.now(), onupdate=func.now()
+    )
+
+class IngestionCheckpoint(Base):
+    """Resume point of a master data load, the provider offset after the last stored batch"""
+    __tablename__ = "ingestion_checkpoint"
+
+    dataset = Column(String, primary_key=True)   # e.g. "airports" or "routes:FRA"
+    next_offset = Column(Integer, nullable=False, server_default=text("0"))
+    rows_loaded = Column(Integer, nullable=False, server_default=text("0"))
+    total = Column(Integer, nullable=True)        # As reported by the provider
+    completed = Column(Boolean, nullable=False, server_default=text("false"))
+    updated_at = Column(
+        DateTime(timezone=True), nullable=False,
+        server_default=func.now(), onupdate=func.now()
+    )
+
 def connect(config):
     """ Connect to the PostgreSQL database server """
     # try:
@@ -244,7 +305,38 @@ def connect(config):
     #     print(error)
     pass
 
-engine = create_engine(get_db_url())
+def engine_options(db_url):
+    """Pool settings of the engine. Every request checks a connection out of the pool for the
+    duration of its session, the pool size bounds the concurrent requests hitting the database.
+    SQLite keeps the default pool of its driver (file or in-memory database)"""
+    if db_url is None or db_url.startswith("sqlite"):
+        return {}
+    return load_pool_config()
+
+
+engine = create_engine(get_db_url(), **engine_options(get_db_url()))
 SessionLocal = sessionmaker(bind=engine)
 #session = Session()
-#connect(config)
\ No newline at end of file
+#connect(config)
+
+# The async engine is created on first use, so that the async driver is only needed
+# when the application actually runs in async mode
+_async_engine = None
+_async_session_local = None
+
+
+def get_async_engine():
+    global _async_engine
+    if _async_engine is None:
+        db_url = get_async_db_url()
+        _async_engine = create_async_engine(db_url, **engine_options(db_url))
+    return _async_engine
+
+
+def AsyncSessionLocal():
+    """Async counterpart of SessionLocal: returns a new AsyncSession.
+    expire_on_commit is off because attributes cannot be lazily reloaded in async mode"""
+    global _async_session_local
+    if _async_session_local is None:
+        _async_session_local = async_sessionmaker(bind=get_async_engine(), expire_on_commit=False)
+    return _async_session_local()
\ No newline at end of file
@@ -0,0 +1,82 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Literal
+from datetime import datetime
+from backend.business_logic.pydantic_models import AirportModel, RouteModel, UserIn, UserOut
+from backend.business_logic.handler import split_airports_and_cities
+from backend.business_logic.async_handler import (
+    find_nearby_airports, get_flights, get_iata_code, get_user_by_cred)
+from backend.database.orm_models import AsyncSessionLocal
+
+import backend.utilities.where_is_waldo as coordinates
+
+# Async execution mode (WANDERLUST_ASYNC_MODE): these routes are registered before the ones in
+# user_endpoints.py and take over the same paths
+
+async_router = APIRouter()
+
+async def get_async_db() -> AsyncSession:
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+@async_router.get("/default", response_model=list[AirportModel])
+async def default_page(
+        client_meta: dict | None = Depends(coordinates.get_location),
+        db: AsyncSession = Depends(get_async_db)
+    ):
+    airports_list = await find_nearby_airports(db, client_meta)
+    # No location could be found for the client: nothing nearby to show
+    return airports_list or []
+
+
+@async_router.post("/user/login", response_model=UserOut)
+async def user_sign_in(
+        user_data: UserIn,
+        db: AsyncSession = Depends(get_async_db)
+    ):
+    try:
+        user = await get_user_by_cred(db, user_data.password, user_data.username, user_data.email)
+        return user
+    except Exception as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+
+@async_router.get("/flights/{iata_code}/{iata_type}", response_model=list[RouteModel])
+async def get_flight_routes(
+        iata_code: str,
+        iata_type: Literal["city","airport"],
+        mode: Literal["Departure","Arrival"] = "Departure",
+        from_or_to: str | None = None,
+        ft_type: Literal["city","airport"] | None = None,
+        local_time: datetime | None = None,
+        db: AsyncSession = Depends(get_async_db)
+    ):
+    """direction is either departure/arrival"""
+    from_object = to_object = None
+    if mode == "Departure":
+        from_object = await get_iata_code(db, iata_code, iata_type)
+        if from_or_to:
+            to_object = await get_iata_code(db, from_or_to, ft_type)
+    else:
+        to_object = await get_iata_code(db, iata_code, iata_type)
+        if from_or_to:
+            from_object = await get_iata_code(db, from_or_to, ft_type)
+    from_airport, from_city, to_airport, to_city = split_airports_and_cities(
+        from_object, to_object)
+
+    try:
+        routes = await get_flights(
+            db,
+            mode,
+            from_airport,
+            from_city,
+            to_airport,
+            to_city,
+            local_time,
+            )
+        if routes:
+            return routes
+        return []
+    except Exception as error:
+        raise HTTPException(status_code=502, detail=str(error))
@@ -1,26 +1,34 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from typing import Literal
 from datetime import datetime
 #from pydantic import BaseModel
 from backend.business_logic.pydantic_models import (
     UserIn, UserOut, AirportModel, CityModel, RouteModel, TripIn, TripOut, TripUpdate,
-    UserUpdate, AllAirportModel)
+    UserUpdate, AllAirportModel, ItineraryModel, DestinationModel, TripPatchOut, TripImportOut)
 from backend.business_logic.handler import (
     User, Trip, find_nearby_airports, get_flights, get_iata_code, delete_trips_by_id,
-    delete_user_by_id, get_all_airports)
+    delete_user_by_id, get_all_airports, split_airports_and_cities, get_reference_data,
+    get_connections, get_destinations, search_airports, get_compact_airports, get_user_profile,
+    get_home_airports, import_trips)
+from backend.business_logic import trip_import
+from backend.business_logic.reference_data import is_etag_match
 from backend.database.orm_models import SessionLocal
+from backend.database.datamanager import UnitOfWork
 
 import backend.utilities.where_is_waldo as coordinates
 
 router = APIRouter()
 
+# Handlers are plain functions as the database and provider calls are blocking, FastAPI runs
+# them in its thread pool. The async variants of the busiest endpoints are in async_endpoints.py
+
 def get_db() -> Session:
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+    """A new session (unit of work) per request, closed and rolled back if not committed when
+    the request ends, no state is carried over to the next request"""
+    with UnitOfWork(session_factory=SessionLocal) as unit:
+        yield unit.session
 
 
 def get_from_sources(latitude: float, longitude: float):
@@ -33,7 +41,7 @@ async def home_page():
 
 
 @router.get("/default", response_model=list[AirportModel])
-async def default_page(
+def default_page(
         client_meta: dict | None = Depends(coordinates.get_location),
         db: Session = Depends(get_db)
     ):
@@ -45,10 +53,11 @@ async def default_page(
     # The most common, reliable, and widely used tool for retrieving country and city from IP is MaxMind GeoLite2.
 
     airports_list = find_nearby_airports(db,client_meta)
-    return airports_list
+    # No location could be found for the client: nothing nearby to show
+    return airports_list or []
 
 @router.post("/user/login", response_model=UserOut)
-async def user_sign_in(
+def user_sign_in(
             user_data: UserIn,
             db: Session = Depends(get_db)
     ):
@@ -71,7 +80,7 @@ async def user_sign_in(
 
 
 @router.post("/user", response_model=UserOut)
-async def create_user(
+def create_user(
         user_data: UserIn,
         db: Session = Depends(get_db)
         ):
@@ -85,38 +94,87 @@ async def create_user(
 
 
 @router.get("/{user_id}/home", response_model=list[AirportModel])
-async def user_home_page(
+def user_home_page(
         user_id: int,
         client_meta: tuple | None = Depends(coordinates.get_location),
         db: Session = Depends(get_db)
     ):
 
-    # user_db = get_user_data(db,user_id)
+    # Only the profile is needed (cached), not the user with all the trips
+    profile = get_user_profile(db, user_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="User not found")
 
-    user_obj = UserUpdate(id=user_id)  # Created a pydantic object
-    user = User(user_obj, db) # Instantiated handler class
-    user_db = user.get_user_by_id(user_id) # fetched the user details
-    # Converted it back to compatible pydantic class
-    user_data = UserOut.model_validate(user_db)
+    # Home city first, the client's location (or IP address) if the user has none
+    airports_list = get_home_airports(db, profile)
+    if airports_list is None:
+        airports_list = find_nearby_airports(db, client_meta)
+    # No location could be found for the client: nothing nearby to show
+    return airports_list or []
 
-    if user_data.city_details:
-        location = (user_data.city_details.latitude, user_data.city_details.longitude)
 
-    airports_list = find_nearby_airports(db,client_meta)
-    return airports_list
+@router.get("/airports", response_model=list[AllAirportModel])
+def get_airports(
+        request: Request,
+        db: Session = Depends(get_db)
+    ):
+    # Served from the in-memory snapshot as pre-serialized JSON, the ETag lets the
+    # browser revalidate its copy instead of downloading all airports again
+    snapshot = get_reference_data(db)
+    headers = {"ETag": snapshot.etag, "Cache-Control": "no-cache"}
+    if is_etag_match(request.headers.get("If-None-Match"), snapshot.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=snapshot.airports_json, media_type="application/json", headers=headers)
+
+
+@router.get("/airports/compact")
+def get_airports_compact(
+        request: Request,
+        tier: list[int] | None = Query(None),
+        country: list[str] | None = Query(None),
+        bbox: str | None = Query(None, description="min_lon,min_lat,max_lon,max_lat"),
+        fields: str | None = Query(None, description="Airport columns, e.g. name,latitude,longitude"),
+        format: str | None = Query(None, description="json or msgpack (default: Accept header)"),
+        db: Session = Depends(get_db)
+    ):
+    """Airports as columns with the cities and countries sent once, filtered on the server"""
+    try:
+        body, etag, media_type = get_compact_airports(
+            db, format, request.headers.get("Accept"), tier, country, bbox, fields)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    except LookupError as error:
+        raise HTTPException(status_code=406, detail=str(error))
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept"}
+    if is_etag_match(request.headers.get("If-None-Match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+@router.get("/airports/search", response_model=list[AllAirportModel])
+def airport_search(
+        q: str = Query(..., min_length=1, max_length=100),
+        limit: int = Query(10, ge=1, le=50),
+        db: Session = Depends(get_db)
+    ):
+    """Autocomplete: exact code matches first, then by tier and how well the text matches"""
+    return search_airports(db, q, limit)
 
 
-@router.get("/airports", response_model=list[AllAirportModel])
-async def get_airports(
+@router.get("/airports/{iata_code}/destinations", response_model=list[DestinationModel])
+def get_airport_destinations(
+        iata_code: str,
         db: Session = Depends(get_db)
     ):
-    airports = get_all_airports(db)
-    #print("Airports",airports)
-    return airports
+    """Where you can fly from an airport, from the in-memory route graph (no schedule rows)"""
+    destinations = get_destinations(db, iata_code)
+    if destinations is None:
+        raise HTTPException(status_code=404, detail="Airport not found!")
+    return destinations
 
 
 @router.get("/flights/{iata_code}/{iata_type}", response_model=list[RouteModel])
-async def get_flight_routes(
+def get_flight_routes(
         iata_code: str,
         iata_type: Literal["city","airport"],
         mode: Literal["Departure","Arrival"] = "Departure",
@@ -127,7 +185,7 @@ async def get_flight_routes(
     ):
     """direction is either departure/arrival"""
     #1 First check whether code is city/airport
-    from_object = to_object = from_airport = to_airport = from_city = to_city = None
+    from_object = to_object = None
     if mode == "Departure":
         from_object = get_iata_code(db,iata_code, iata_type)
         if from_or_to:
@@ -136,14 +194,8 @@ async def get_flight_routes(
         to_object = get_iata_code(db, iata_code, iata_type)
         if from_or_to:
             from_object = get_iata_code(db, from_or_to, ft_type)
-    if isinstance(from_object, AirportModel):
-        from_airport = from_object
-    elif isinstance(from_object, CityModel):
-        from_city = from_object
-    if isinstance(to_object, AirportModel):
-        to_airport = to_object
-    elif isinstance(to_object, CityModel):
-        to_city = to_object
+    from_airport, from_city, to_airport, to_city = split_airports_and_cities(
+        from_object, to_object)
 
     try:
         routes = get_flights(
@@ -161,8 +213,32 @@ async def get_flight_routes(
     except Exception as error:
         raise HTTPException(status_code=502, detail=str(error))
 
+@router.get("/connections/{from_code}/{from_type}/{to_code}/{to_type}",
+            response_model=list[ItineraryModel])
+def get_connection_routes(
+        from_code: str,
+        from_type: Literal["city","airport"],
+        to_code: str,
+        to_type: Literal["city","airport"],
+        local_time: datetime | None = None,
+        max_stops: int = Query(2, ge=0, le=2),
+        limit: int = Query(5, ge=1, le=20),
+        db: Session = Depends(get_db)
+    ):
+    """Itineraries with up to max_stops stops departing from local_time (origin time, default
+    now) on, searched in the stored schedules"""
+    from_object = get_iata_code(db, from_code, from_type)
+    to_object = get_iata_code(db, to_code, to_type)
+    if not from_object or not to_object:
+        raise HTTPException(status_code=404, detail="Airport/City not found!")
+    try:
+        return get_connections(db, from_object, to_object, local_time, max_stops, limit)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+
 @router.post("/trip", response_model=TripOut)
-async def create_trips(
+def create_trips(
         trip_data: TripIn,
         db: Session = Depends(get_db)
     ):
@@ -173,66 +249,99 @@ async def create_trips(
     except Exception as error:
         raise HTTPException(status_code=502, detail=str(error))
 
+@router.post("/trips/import", response_model=TripImportOut)
+async def import_trip_list(
+        request: Request,
+        atomic: bool = False,
+        db: Session = Depends(get_db)
+    ):
+    """Many trips at once: a JSON list of trips, NDJSON or CSV (see trip_import). All the trips
+    are validated first, the valid ones are saved together and the result of every trip is
+    returned. With atomic=true nothing is saved if a trip is invalid"""
+    try:
+        # Read (NDJSON and CSV line by line) while the body arrives, the database work runs
+        # in the thread pool like the other endpoints
+        payloads = await trip_import.read_trips(request.headers.get("content-type"), request.stream())
+        return await run_in_threadpool(import_trips, db, payloads, atomic)
+    except trip_import.TooManyTrips as error:
+        raise HTTPException(status_code=413, detail=str(error))
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    except LookupError as error:
+        raise HTTPException(status_code=415, detail=str(error))
+    except Exception as error:
+        raise HTTPException(status_code=502, detail=str(error))
+
+
 @router.get("/{user_id}/trips", response_model=list[TripOut])
-async def get_trips(
+def get_trips(
         user_id: int,
+        response: Response,
+        limit: int | None = Query(None, ge=1, le=100),
+        cursor: str | None = None,
         db: Session = Depends(get_db)
     ):
-    """To show all the trips of a user"""
+    """To show the trips of a user, newest first. Without limit all the trips are returned,
+    with limit one page and the cursor of the next page in the X-Next-Cursor header"""
     try:
         trip_obj = TripUpdate(user_id=user_id)
         trip = Trip(trip_obj, db)
-        trips_db = trip.get_trips_by_user(user_id)
+        if limit is None:
+            return trip.get_trips_by_user(user_id)
+        trips_db, next_cursor = trip.get_trips_page(user_id, limit, cursor)
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
         return trips_db
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
     except Exception as error:
         raise HTTPException(status_code=502, detail=str(error))
 
 
 @router.delete("/trip")
-async def delete_trips(
+def delete_trips(
         trips: list[int],
         db: Session = Depends(get_db)
     ):
-
-    delete_trips_by_id(db,trips)
+    """Returns the number of trips deleted, ids that do not exist are skipped"""
+    return delete_trips_by_id(db, trips)
 
 @router.delete("/trip/{trip_id}")
-async def delete_trip(
+def delete_trip(
         trip_id: int,
         db: Session = Depends(get_db)
     ):
 
     trip_obj = TripUpdate(trip_id=trip_id)
     trip = Trip(trip_obj, db)
-    trip.delete_trip()
+    try:
+        return trip.delete_trip()
+    except ValueError as error:
+        raise HTTPException(status_code=404, detail=str(error))
 
-@router.put("/trip", response_model=TripOut)
-async def modify_trip(
+@router.put("/trip", response_model=TripPatchOut)
+def modify_trip(
         trip_data: TripUpdate,
         db: Session = Depends(get_db)
     ):
-
-    # trip_db = get_trip_data(db,trip_data.trip_header.trip_id)
-    # old_trip = TripOut.model_validate(trip_db)
-    #
-    # trip = Trip(old_trip, db)
-    # trip_out = trip.change_trip(trip_data, trip_db)
-    # return trip_out
-
-    trip = Trip(trip_data,db)
-    old_trip = trip.get_trip_by_id(trip_data.trip_header.trip_id)
-
-    trip_out = trip.change_trip(trip_data, old_trip)
-    return trip_out
+    """Inserts, updates and deletes legs and flights of a trip in one go, the response has only
+    the changed legs (not the whole trip)"""
+    try:
+        trip = Trip(trip_data, db)
+        return trip.change_trip(trip_data)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    except Exception as error:
+        raise HTTPException(status_code=502, detail=str(error))
 
 @router.get("/user/{user_name}")
-async def get_user(user_name:str):
+def get_user(user_name:str):
     # This shows the account details
     pass
 
 
 @router.put("/user", response_model=UserOut)
-async def modify_user(
+def modify_user(
         user_data: UserUpdate,
         db: Session = Depends(get_db)
     ):
@@ -247,11 +356,15 @@ async def modify_user(
     return modified_user
 
 @router.delete("/user/{user_id}")
-async def delete_user(
+def delete_user(
         user_id: int,
         db: Session = Depends(get_db)
     ):
-    delete_user_by_id(db, user_id)
+    """Deletes the user with all the trips, returns the number of users and trips deleted"""
+    try:
+        return delete_user_by_id(db, user_id)
+    except ValueError as error:
+        raise HTTPException(status_code=404, detail=str(error))
 
 
 
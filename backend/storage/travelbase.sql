@@ -120,4 +120,40 @@ ALTER TABLE trips ALTER COLUMN created_at set default now();
 
 ALTER TABLE trip_legs ALTER COLUMN saved_at set not null;
 
-ALTER TABLE trip_legs ALTER COLUMN saved_at set default now();
\ No newline at end of file
+ALTER TABLE trip_legs ALTER COLUMN saved_at set default now();
+
+CREATE TABLE "data_version" (
+  "name" varchar PRIMARY KEY,
+  "version" integer NOT NULL DEFAULT 0,
+  "changed_at" timestamp with time zone NOT NULL DEFAULT now()
+);
+
+CREATE TABLE "schedule_fetch_log" (
+  "airport_key" varchar REFERENCES "airport" ("airport_key"),
+  "direction" varchar,
+  "window_start" timestamp,
+  "fetched_at" timestamp with time zone NOT NULL DEFAULT now(),
+  PRIMARY KEY ("airport_key", "direction", "window_start")
+);
+
+CREATE INDEX "trips_user_created" ON "trips" ("user_id", "created_at", "trip_id");
+
+CREATE TABLE "ingestion_checkpoint" (
+  "dataset" varchar PRIMARY KEY,
+  "next_offset" integer NOT NULL DEFAULT 0,
+  "rows_loaded" integer NOT NULL DEFAULT 0,
+  "total" integer,
+  "completed" boolean NOT NULL DEFAULT false,
+  "updated_at" timestamp with time zone NOT NULL DEFAULT now()
+);
+
+-- Legs and flights are deleted with their trip, trips with their user (set-based deletes)
+ALTER TABLE "trips" DROP CONSTRAINT IF EXISTS "trips_user_id_fkey",
+  ADD CONSTRAINT "trips_user_id_fkey" FOREIGN KEY ("user_id") REFERENCES "users" ("id") ON DELETE CASCADE;
+
+ALTER TABLE "trip_legs" DROP CONSTRAINT IF EXISTS "trip_details",
+  ADD CONSTRAINT "trip_details" FOREIGN KEY ("trip_id") REFERENCES "trips" ("trip_id") ON DELETE CASCADE;
+
+ALTER TABLE "leg_flight" DROP CONSTRAINT IF EXISTS "leg_flight_trip_id_leg_no_fkey",
+  ADD CONSTRAINT "leg_flight_trip_id_leg_no_fkey" FOREIGN KEY ("trip_id", "leg_no")
+  REFERENCES "trip_legs" ("trip_id", "leg_no") ON DELETE CASCADE;
@@ -0,0 +1,116 @@
+"""Benchmark of AirportRepo.add_routes (bulk upsert) against the previous row-by-row path.
+
+The previous path selected the existing flights, deleted them one ORM object at a time,
+inserted every route separately and refreshed every inserted row.
+Both paths store a departure board where half of the flights already exist in the database.
+The number of statements sent to the database is counted with a cursor execute event.
+
+Uses DATABASE_URL when it is set (PostgreSQL gives the realistic round trip numbers),
+otherwise a temporary SQLite file.
+
+    python -m backend.test.bench_add_routes
+"""
+import os
+import tempfile
+import time
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+
+from sqlalchemy import delete, event
+
+from backend.database.datamanager import AirportRepo
+from backend.database.orm_models import Airport, Base, City, Country, Schedules, SessionLocal, engine
+from backend.utilities.time_travel import to_time
+
+BOARD_SIZES = (50, 300, 1000)
+ROUNDS = 3
+
+
+def legacy_add_routes(session, routes_list):
+    """The row-by-row path that add_routes used before the bulk upsert"""
+    flights = {route["flight_id"] for route in routes_list}
+    existing_flights_db = session.query(Schedules).filter(Schedules.flight_id.in_(flights)).all()
+    if existing_flights_db:
+        for flight_db in existing_flights_db:
+            session.delete(flight_db)
+        session.commit()
+    schedules = []
+    for route in routes_list:
+        schedule = Schedules(**{**route, "dep_time": to_time(route["dep_time"]),
+                                "arr_time": to_time(route["arr_time"])})
+        session.add(schedule)
+        schedules.append(schedule)
+    session.commit()
+    for schedule in schedules:
+        session.refresh(schedule)
+    return schedules
+
+
+def departure_board(size, offset=0):
+    return [
+        {
+            "flight_id": f"XB{number:03d}",
+            "orig_airport": "FRA",
+            "dest_airport": "CDG",
+            "status": "active",
+            "dep_time": f"{number % 24:02d}:{number % 60:02d}",
+            "arr_time": f"{(number + 1) % 24:02d}:{number % 60:02d}",
+            "airline": "XB",
+        }
+        for number in range(offset, offset + size)
+    ]
+
+
+class StatementCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args, **kwargs):
+        self.count += 1
+
+
+def seed_database():
+    Base.metadata.create_all(engine)
+    with SessionLocal() as session:
+        if session.get(Airport, "FRA"):
+            return
+        session.add(Country(country_key="XX", name="Benchmark"))
+        session.add(City(city_key="XXX", name="Benchmark", country_key="XX", timezone="UTC",
+                         latitude=0, longitude=0))
+        session.add(Airport(airport_key="FRA", name="Origin", city_key="XXX", latitude=0, longitude=0))
+        session.add(Airport(airport_key="CDG", name="Destination", city_key="XXX", latitude=1, longitude=1))
+        session.commit()
+
+
+def run(store, size):
+    """Average time and statement count of storing a board whose first half already exists"""
+    elapsed = 0.0
+    counter = StatementCounter()
+    for _ in range(ROUNDS):
+        with SessionLocal() as session:
+            session.execute(delete(Schedules))
+            session.commit()
+            store(session, departure_board(size // 2))
+        with SessionLocal() as session:
+            event.listen(engine, "before_cursor_execute", counter)
+            start = time.perf_counter()
+            store(session, departure_board(size))
+            elapsed += time.perf_counter() - start
+            event.remove(engine, "before_cursor_execute", counter)
+    return elapsed / ROUNDS, counter.count // ROUNDS
+
+
+def main():
+    seed_database()
+    print(f"database: {engine.dialect.name}")
+    print(f"{'flights':>8}{'path':>10}{'ms':>10}{'statements':>12}")
+    for size in BOARD_SIZES:
+        for name, store in (("legacy", legacy_add_routes),
+                            ("upsert", lambda session, routes: AirportRepo(session).add_routes(routes))):
+            elapsed, statements = run(store, size)
+            print(f"{size:>8}{name:>10}{elapsed * 1000:>10.1f}{statements:>12}")
+
+
+if __name__ == "__main__":
+    main()
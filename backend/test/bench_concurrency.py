@@ -0,0 +1,186 @@
+"""Concurrency benchmark for /flights and /default while the upstream provider is slow.
+
+Runs the same burst of concurrent requests against three set-ups of the application:
+  blocking   - async def handlers calling the synchronous code directly (the old behaviour)
+  threadpool - plain def handlers, FastAPI runs them in its thread pool (default mode)
+  async      - async engine, repositories and provider clients (WANDERLUST_ASYNC_MODE)
+While the burst runs, the event loop lag is measured to show how long other clients would wait.
+
+The database is a temporary SQLite file (aiosqlite is needed for the async mode) and the
+AeroDataBox calls are replaced with a fake that sleeps UPSTREAM_DELAY seconds. /default is called
+as an anonymous visitor, so the airports are searched by IP address at the upstream.
+The "version bumps" run repeats the /default burst while the master data version is bumped every
+BUMP_INTERVAL seconds, so requests find the reference data snapshot outdated and rebuild it
+(EXTRA_AIRPORTS airports are seeded to give the rebuild a realistic cost).
+
+    python -m backend.test.bench_concurrency
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_FILE}?check_same_thread=false"
+
+import httpx
+from fastapi import APIRouter, Depends, FastAPI
+from starlette.concurrency import run_in_threadpool
+
+import backend.api_requests.aerodata_api as aerodata
+import backend.utilities.where_is_waldo as coordinates
+from backend.business_logic import reference_data
+from backend.business_logic.handler import find_nearby_airports, get_flights, get_iata_code
+from backend.business_logic.pydantic_models import AirportModel, RouteModel
+from backend.database.async_datamanager import AsyncAirportRepo
+from backend.database.datamanager import AirportRepo, ReferenceDataRepo
+from backend.database.orm_models import Airport, Base, City, Country, SessionLocal, engine
+from backend.routes.async_endpoints import async_router
+from backend.routes.user_endpoints import router
+
+UPSTREAM_DELAY = 0.1
+CONCURRENT_REQUESTS = 40
+IP_HEADERS = {"X-Forwarded-For": "127.0.0.1"}
+EXTRA_AIRPORTS = 5000
+BUMP_INTERVAL = 0.05
+
+
+def fake_upstream_response(url):
+    if "search/" in url:
+        return {"items": [{"iata": "FRA"}, {"iata": "HHN"}]}
+    # Empty schedules, so every /flights request has to go to the upstream again
+    return {"departures": []}
+
+
+def slow_call_api(url, params=None):
+    time.sleep(UPSTREAM_DELAY)
+    return fake_upstream_response(url)
+
+
+async def slow_async_call_api(url, params=None):
+    await asyncio.sleep(UPSTREAM_DELAY)
+    return fake_upstream_response(url)
+
+
+async def skip_async_record_fetches(*args):
+    pass
+
+
+aerodata.call_api = slow_call_api
+aerodata.async_call_api = slow_async_call_api
+# The fetch log is not written, so every /flights request finds its schedules outdated and
+# goes to the upstream again
+AirportRepo.record_fetches = lambda *args: None
+AsyncAirportRepo.record_fetches = skip_async_record_fetches
+
+# The old behaviour: async def handlers calling the blocking code on the event loop
+blocking_router = APIRouter()
+
+
+# The sessions are closed in the handlers: the teardown of get_db needs the event loop, which these
+# handlers block, so the connection pool would run dry
+@blocking_router.get("/default", response_model=list[AirportModel])
+async def blocking_default_page(client_meta: dict | None = Depends(coordinates.get_location)):
+    with SessionLocal() as db:
+        return find_nearby_airports(db, client_meta)
+
+
+@blocking_router.get("/flights/{iata_code}/{iata_type}", response_model=list[RouteModel])
+async def blocking_flight_routes(iata_code: str, iata_type: str):
+    with SessionLocal() as db:
+        from_airport = get_iata_code(db, iata_code, iata_type)
+        return get_flights(db, "Departure", from_airport) or []
+
+
+def build_app(mode):
+    app = FastAPI()
+    if mode == "blocking":
+        app.include_router(blocking_router)
+    if mode == "async":
+        app.include_router(async_router)
+    app.include_router(router)
+    return app
+
+
+def seed_database():
+    Base.metadata.create_all(engine)
+    with SessionLocal() as session:
+        session.add(Country(country_key="DE", name="Germany"))
+        session.add(City(city_key="FRA", name="Frankfurt", country_key="DE",
+                         timezone="Europe/Berlin", latitude=50.11, longitude=8.68))
+        session.add(Airport(airport_key="FRA", name="Frankfurt Airport", city_key="FRA",
+                            latitude=50.0379, longitude=8.5622, tier=1))
+        session.add(Airport(airport_key="HHN", name="Frankfurt-Hahn", city_key="FRA",
+                            latitude=49.9487, longitude=7.2639, tier=3))
+        session.add_all([
+            Airport(airport_key=f"Z{number:04d}", name=f"Airport {number}", city_key="FRA",
+                    latitude=-60 + number % 100 * 0.5, longitude=-150 + number // 100 * 0.5, tier=3)
+            for number in range(EXTRA_AIRPORTS)
+        ])
+        session.commit()
+
+
+async def probe_event_loop(stop: asyncio.Event):
+    """Worst event loop lag while the burst is running: how late a 10 ms sleep wakes up"""
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.01)
+        worst = max(worst, time.perf_counter() - start - 0.01)
+    return worst
+
+
+def bump_version():
+    with SessionLocal() as session:
+        ReferenceDataRepo(session).bump_version()
+    reference_data.invalidate_snapshot()
+
+
+async def bump_versions(stop: asyncio.Event):
+    """New master data version every BUMP_INTERVAL while the burst is running"""
+    while not stop.is_set():
+        await run_in_threadpool(bump_version)
+        await asyncio.sleep(BUMP_INTERVAL)
+
+
+async def run_burst(app, path, headers=None, bump=False):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        # Warm up the connection pools and the async engine
+        await client.get(path, headers=headers)
+        if bump:
+            # The burst is short, the first requests have to find the snapshot outdated
+            await run_in_threadpool(bump_version)
+        stop = asyncio.Event()
+        probe = asyncio.create_task(probe_event_loop(stop))
+        bumps = asyncio.create_task(bump_versions(stop)) if bump else None
+        start = time.perf_counter()
+        responses = await asyncio.gather(*[
+            client.get(path, headers=headers) for _ in range(CONCURRENT_REQUESTS)
+        ])
+        elapsed = time.perf_counter() - start
+        stop.set()
+        worst_probe = await probe
+        if bumps:
+            await bumps
+    failed = sum(1 for response in responses if response.status_code != 200)
+    return elapsed, worst_probe, failed
+
+
+async def main():
+    seed_database()
+    print(f"{CONCURRENT_REQUESTS} concurrent requests, upstream delay {UPSTREAM_DELAY * 1000:.0f} ms")
+    print(f"{'mode':<12}{'endpoint':<30}{'req/s':>10}{'total s':>10}{'lag ms':>10}{'failed':>8}")
+    for mode in ("blocking", "threadpool", "async"):
+        app = build_app(mode)
+        for path, headers, bump in (("/default", IP_HEADERS, False),
+                                    ("/flights/FRA/airport", None, False),
+                                    ("/default", IP_HEADERS, True)):
+            elapsed, worst_probe, failed = await run_burst(app, path, headers, bump)
+            label = f"{path} (version bumps)" if bump else path
+            print(f"{mode:<12}{label:<30}{CONCURRENT_REQUESTS / elapsed:>10.1f}"
+                  f"{elapsed:>10.2f}{worst_probe * 1000:>10.0f}{failed:>8}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
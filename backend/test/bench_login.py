@@ -0,0 +1,119 @@
+"""Login throughput against the scrypt cost, to size PASSWORD_HASH_COST and PASSWORD_HASH_WORKERS.
+
+For every cost (log2 of the scrypt n parameter) a burst of concurrent logins is sent to
+POST /user/login in the default (thread pool) mode and in the async mode, and the event loop lag
+is measured while the burst runs. The first table is the raw cost of one hash, single threaded.
+A login costs one hash, so logins/s per worker is about 1 / (time of one hash); the async mode
+must keep the lag near zero whatever the cost.
+
+The database is a temporary SQLite file (aiosqlite is needed for the async mode).
+
+    python -m backend.test.bench_login
+    PASSWORD_HASH_WORKERS=8 python -m backend.test.bench_login
+"""
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_FILE}?check_same_thread=false"
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import delete
+
+from backend.database.orm_models import Base, SessionLocal, UserSchema, engine
+from backend.routes.async_endpoints import async_router
+from backend.routes.user_endpoints import router
+from backend.utilities import passwords
+
+COSTS = (12, 13, 14, 15, 16)
+USERS = 16
+CONCURRENT_LOGINS = 64
+PASSWORD = "correct horse battery staple"
+
+
+def build_app(mode):
+    app = FastAPI()
+    if mode == "async":
+        app.include_router(async_router)
+    app.include_router(router)
+    return app
+
+
+def seed_users(cost):
+    """Hashed with the benchmarked cost, so the logins do not re-hash"""
+    password_hash = passwords.hash_password(PASSWORD, cost=cost)
+    with SessionLocal() as session:
+        session.execute(delete(UserSchema))
+        session.add_all([UserSchema(id=number, username=f"user{number}", email=f"user{number}@example.com",
+                                    password=password_hash)
+                         for number in range(1, USERS + 1)])
+        session.commit()
+
+
+def time_one_hash(cost, rounds=5):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        passwords.hash_password(PASSWORD, cost=cost)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+async def probe_event_loop(stop: asyncio.Event):
+    """Worst event loop lag while the burst is running: how late a 10 ms sleep wakes up"""
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.01)
+        worst = max(worst, time.perf_counter() - start - 0.01)
+    return worst
+
+
+async def run_burst(app):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def login(number):
+            user = 1 + number % USERS
+            start = time.perf_counter()
+            response = await client.post("/user/login", json={
+                "username": f"user{user}", "email": f"user{user}@example.com", "password": PASSWORD})
+            return response.status_code, time.perf_counter() - start
+
+        await login(0)  # Warm up: engine, hashing pool
+        stop = asyncio.Event()
+        probe = asyncio.create_task(probe_event_loop(stop))
+        start = time.perf_counter()
+        results = await asyncio.gather(*[login(number) for number in range(CONCURRENT_LOGINS)])
+        elapsed = time.perf_counter() - start
+        stop.set()
+        worst_probe = await probe
+    latencies = sorted(latency for _status, latency in results)
+    failed = sum(1 for status, _latency in results if status != 200)
+    return elapsed, latencies[int(len(latencies) * 0.95) - 1], worst_probe, failed
+
+
+async def main():
+    Base.metadata.create_all(engine)
+    print(f"{passwords.HASH_WORKERS} hashing workers ({passwords.EXECUTOR_KIND}), "
+          f"{CONCURRENT_LOGINS} concurrent logins, r={passwords.BLOCK_SIZE} p={passwords.PARALLELISM}")
+    print(f"{'cost':<6}{'n':>8}{'memory MB':>11}{'hash ms':>9}")
+    for cost in COSTS:
+        memory = 128 * passwords.BLOCK_SIZE * (1 << cost) / 1024 / 1024
+        print(f"{cost:<6}{1 << cost:>8}{memory:>11.0f}{time_one_hash(cost) * 1000:>9.1f}")
+    print()
+    print(f"{'cost':<6}{'mode':<12}{'logins/s':>10}{'p95 ms':>9}{'lag ms':>9}{'failed':>8}")
+    for cost in COSTS:
+        passwords.HASH_COST = cost
+        seed_users(cost)
+        for mode in ("threadpool", "async"):
+            elapsed, p95, worst_probe, failed = await run_burst(build_app(mode))
+            print(f"{cost:<6}{mode:<12}{CONCURRENT_LOGINS / elapsed:>10.1f}{p95 * 1000:>9.0f}"
+                  f"{worst_probe * 1000:>9.0f}{failed:>8}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
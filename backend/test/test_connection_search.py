@@ -0,0 +1,153 @@
+"""Connection search over the in-memory timetable.
+The timetable is built from plain schedule rows (daily times in the local time of the airports),
+so these tests need no database. May 2026: Frankfurt and Paris are UTC+2, London UTC+1,
+New York UTC-4.
+"""
+import os
+from datetime import datetime, time
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import pytest
+
+from backend.business_logic import connection_search, route_graph
+from backend.business_logic.connection_search import Timetable
+from backend.database.datamanager import notify_schedules_changed
+
+ZONES = {
+    "FRA": "Europe/Berlin", "CDG": "Europe/Paris", "LHR": "Europe/London",
+    "JFK": "America/New_York", "AAA": None, "BBB": None, "CCC": None, "DDD": None,
+}
+DEPARTURE = datetime(2026, 5, 4, 6, 0)
+
+
+def flight(flight_id, orig, dest, dep, arr, airline="XB", **columns):
+    return {"flight_id": flight_id, "orig_airport": orig, "dest_airport": dest,
+            "dep_time": time.fromisoformat(dep), "arr_time": time.fromisoformat(arr),
+            "airline": airline, **columns}
+
+
+def search(timetable, orig, dest, departure=DEPARTURE, **options):
+    options.setdefault("min_connection", 45)
+    return timetable.search({orig}, {dest}, departure, **options)
+
+
+def flight_ids(itinerary):
+    return [leg["flight_id"] for leg in itinerary["legs"]]
+
+
+def test_direct_flight():
+    timetable = Timetable([flight("LH1", "FRA", "CDG", "08:00", "09:10"),
+                           flight("LH0", "FRA", "CDG", "05:00", "06:10")], ZONES)
+    itineraries = search(timetable, "FRA", "CDG")
+    # LH0 left before the requested time, its next departure is within the search horizon
+    assert [flight_ids(itinerary) for itinerary in itineraries] == [["LH1"], ["LH0"]]
+    assert itineraries[1]["departure"] == datetime(2026, 5, 5, 5, 0)
+    itinerary = itineraries[0]
+    assert itinerary["stops"] == 0
+    assert itinerary["departure"] == datetime(2026, 5, 4, 8, 0)
+    assert itinerary["arrival"] == datetime(2026, 5, 4, 9, 10)
+    assert itinerary["duration_minutes"] == 70
+
+
+def test_one_stop_respects_the_minimum_connection_time():
+    # FRA 08:00 (06:00Z) -> LHR 08:45 (07:45Z), then LHR -> JFK
+    timetable = Timetable([
+        flight("LH1", "FRA", "LHR", "08:00", "08:45"),
+        flight("BA1", "LHR", "JFK", "09:00", "11:50"),    # 08:00Z, 15 minutes after landing
+        flight("BA2", "LHR", "JFK", "10:00", "12:50"),    # 09:00Z, 75 minutes after landing
+    ], ZONES)
+    itineraries = search(timetable, "FRA", "JFK")
+    assert [flight_ids(itinerary) for itinerary in itineraries] == [["LH1", "BA2"]]
+    itinerary = itineraries[0]
+    assert itinerary["stops"] == 1
+    assert itinerary["arrival"] == datetime(2026, 5, 4, 12, 50)
+    # 06:00Z to 16:50Z
+    assert itinerary["duration_minutes"] == 650
+
+
+def test_connection_missing_the_minimum_connection_time_is_rejected():
+    timetable = Timetable([flight("LH1", "FRA", "LHR", "08:00", "08:45"),
+                           flight("BA1", "LHR", "JFK", "09:00", "11:50")], ZONES)
+    assert search(timetable, "FRA", "JFK") == []
+    # With a shorter minimum connection time the same flights connect
+    assert [flight_ids(itinerary) for itinerary in search(timetable, "FRA", "JFK", min_connection=10)] \
+        == [["LH1", "BA1"]]
+
+
+def test_flight_over_midnight_lands_on_the_next_day():
+    timetable = Timetable([flight("XB1", "AAA", "BBB", "23:30", "01:15"),
+                           flight("XB2", "BBB", "CCC", "02:30", "03:30")], ZONES)
+    itineraries = search(timetable, "AAA", "CCC", datetime(2026, 5, 4, 22, 0))
+    assert [flight_ids(itinerary) for itinerary in itineraries] == [["XB1", "XB2"]]
+    legs = itineraries[0]["legs"]
+    assert legs[0]["arrival"] == datetime(2026, 5, 5, 1, 15)
+    assert legs[1]["departure"] == datetime(2026, 5, 5, 2, 30)
+    assert itineraries[0]["duration_minutes"] == 240
+
+
+def test_day_boundary_across_time_zones():
+    # JFK 22:00 (02:00Z on the 5th) -> FRA 11:30 (09:30Z), searched from the evening in New York
+    timetable = Timetable([flight("LH401", "JFK", "FRA", "22:00", "11:30")], ZONES)
+    itineraries = search(timetable, "JFK", "FRA", datetime(2026, 5, 4, 20, 0))
+    assert itineraries[0]["departure"] == datetime(2026, 5, 4, 22, 0)
+    assert itineraries[0]["arrival"] == datetime(2026, 5, 5, 11, 30)
+    assert itineraries[0]["duration_minutes"] == 450
+
+
+def test_max_stops():
+    timetable = Timetable([flight("XB1", "AAA", "BBB", "08:00", "09:00"),
+                           flight("XB2", "BBB", "CCC", "10:00", "11:00"),
+                           flight("XB3", "CCC", "DDD", "12:00", "13:00")], ZONES)
+    assert search(timetable, "AAA", "DDD", max_stops=1) == []
+    itineraries = search(timetable, "AAA", "DDD", max_stops=2)
+    assert [flight_ids(itinerary) for itinerary in itineraries] == [["XB1", "XB2", "XB3"]]
+    assert itineraries[0]["stops"] == 2
+
+
+def test_no_loops_through_the_origin():
+    timetable = Timetable([flight("XB1", "AAA", "BBB", "08:00", "09:00"),
+                           flight("XB2", "BBB", "AAA", "10:00", "11:00"),
+                           flight("XB3", "AAA", "CCC", "12:00", "13:00")], ZONES)
+    assert [flight_ids(itinerary) for itinerary in search(timetable, "AAA", "CCC")] == [["XB3"]]
+
+
+@pytest.fixture
+def listened_timetable(monkeypatch):
+    """Timetable that receives the schedule changes of the repositories"""
+    timetable = Timetable([flight("XB1", "AAA", "BBB", "08:00", "09:00")], ZONES)
+    monkeypatch.setattr(connection_search, "_timetable", timetable)
+    monkeypatch.setattr(route_graph, "_route_graph", None)  # Not the one of other tests
+    return timetable
+
+
+def test_timetable_follows_schedule_changes(listened_timetable):
+    timetable = listened_timetable
+    assert search(timetable, "AAA", "CCC") == []   # Unrolls the travel date
+
+    notify_schedules_changed([flight("XB2", "BBB", "CCC", "10:00", "11:00")])
+    assert [flight_ids(itinerary) for itinerary in search(timetable, "AAA", "CCC")] == [["XB1", "XB2"]]
+    assert timetable.routes["BBB"] == {"CCC": 1}
+
+    # Upserted rows only carry the provider columns, the rest is kept
+    notify_schedules_changed([{"flight_id": "XB2", "dep_time": time(9, 50)}])
+    itinerary = search(timetable, "AAA", "CCC")[0]
+    assert itinerary["legs"][1]["departure"] == datetime(2026, 5, 4, 9, 50)
+    assert itinerary["legs"][1]["dest_airport"] == "CCC"
+
+    notify_schedules_changed([{"flight_id": "XB2", "status": "cancelled"}])
+    assert search(timetable, "AAA", "CCC") == []
+    assert "XB2" not in timetable.flights
+
+    notify_schedules_changed([], ["XB1"])
+    assert timetable.routes["AAA"] == {}
+    assert search(timetable, "AAA", "BBB") == []
+
+
+def test_update_does_not_change_the_destinations_being_read(listened_timetable):
+    timetable = listened_timetable
+    destinations = timetable.routes["AAA"]
+    notify_schedules_changed([flight("XB9", "AAA", "CCC", "08:30", "09:30")], ["XB1"])
+    # A search scanning the old destinations keeps a consistent view
+    assert destinations == {"BBB": 1}
+    assert timetable.routes["AAA"] == {"CCC": 1}
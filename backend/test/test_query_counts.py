@@ -0,0 +1,363 @@
+"""Number of SQL statements each endpoint runs.
+The serialized responses contain nested objects (route -> airports -> city -> country), loading them
+lazily costs queries per row. These tests pin the statement count of every endpoint and check it
+does not grow with the number of rows returned.
+
+Runs against an in-memory SQLite database, the provider APIs are never called: the schedule fetch
+log is seeded as fresh, so the flights are answered from the database.
+"""
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, delete, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from backend.app import app
+from backend.business_logic import handler, reference_data
+from backend.database.orm_models import (
+    Airport, Base, City, Country, LegFlight, ScheduleFetchLog, Schedules, TripLeg, TripSchema,
+    UserSchema)
+from backend.routes.user_endpoints import get_db
+from backend.utilities.time_travel import get_schedule_window, to_time
+
+LOCAL_TIME = datetime(2026, 5, 4, 8, 0)
+ARRIVAL_TIME = datetime(2026, 5, 4, 23, 30)
+OUTSTATIONS = 40   # Lazy loading costs queries per distinct airport, city and country
+
+test_engine = create_engine("sqlite://", poolclass=StaticPool,
+                            connect_args={"check_same_thread": False})
+TestSession = sessionmaker(bind=test_engine)
+
+
+def override_get_db():
+    db = TestSession()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+class StatementCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args, **kwargs):
+        self.count += 1
+
+
+def seed_master_data(session):
+    session.add_all([
+        Country(country_key="DE", name="Germany"),
+        Country(country_key="FR", name="France"),
+        City(city_key="FRA", name="Frankfurt", country_key="DE", timezone="Europe/Berlin",
+             latitude=50.11, longitude=8.68),
+        City(city_key="PAR", name="Paris", country_key="FR", timezone="Europe/Paris",
+             latitude=48.86, longitude=2.35),
+        Airport(airport_key="FRA", name="Frankfurt", city_key="FRA", latitude=50.03, longitude=8.57, tier=1),
+        Airport(airport_key="CDG", name="Charles de Gaulle", city_key="PAR", latitude=49.01, longitude=2.55, tier=1),
+        Airport(airport_key="ORY", name="Orly", city_key="PAR", latitude=48.72, longitude=2.38, tier=2),
+    ])
+    session.add_all([Country(country_key=f"Q{number}", name=f"Country {number}") for number in range(8)])
+    for number in range(OUTSTATIONS):
+        session.add(City(city_key=f"C{number:02d}", name=f"City {number}", country_key=f"Q{number % 8}",
+                         timezone="UTC", latitude=-30 + number, longitude=100 + number))
+        session.add(Airport(airport_key=f"D{number:02d}", name=f"Airport {number}",
+                            city_key=f"C{number:02d}", latitude=-30 + number, longitude=100 + number))
+    fetched_at = datetime.now(timezone.utc)
+    windows = {get_schedule_window(LOCAL_TIME), get_schedule_window(ARRIVAL_TIME)}
+    session.add_all([
+        ScheduleFetchLog(airport_key=airport_key, direction=direction, window_start=window_start,
+                         fetched_at=fetched_at)
+        for airport_key in ("FRA", "CDG", "ORY")
+        for direction in ("Departure", "Arrival")
+        for window_start in windows
+    ])
+    session.commit()
+
+
+def seed_flights(session, number_of_flights):
+    """Departures from FRA to the outstations, arrivals from the outstations in Paris and
+    flights between FRA and Paris"""
+    session.execute(delete(Schedules))
+    for number in range(number_of_flights):
+        paris_airport = "CDG" if number % 2 else "ORY"
+        outstation = f"D{number % OUTSTATIONS:02d}"
+        orig_airport, dest_airport = (("FRA", outstation), (outstation, paris_airport),
+                                      ("FRA", paris_airport))[number % 3]
+        session.add(Schedules(flight_id=f"X{number:04d}", orig_airport=orig_airport,
+                              dest_airport=dest_airport, status="active",
+                              dep_time=to_time(f"{9 + number % 12:02d}:{number % 60:02d}"),
+                              arr_time=to_time(f"{10 + number % 12:02d}:{number % 60:02d}"),
+                              airline="XB"))
+    session.commit()
+
+
+def seed_trips(session, number_of_trips):
+    """Trips of user 1 with two flight legs each, every other pair of trips shares created_at"""
+    session.execute(delete(LegFlight))
+    session.execute(delete(TripLeg))
+    session.execute(delete(TripSchema))
+    if session.get(UserSchema, 1) is None:
+        session.add(UserSchema(id=1, username="traveller", password="secret"))
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    for number in range(number_of_trips):
+        trip = TripSchema(user_id=1, name=f"Trip {number}",
+                          created_at=start + timedelta(days=number // 2))
+        for leg_no in (1, 2):
+            leg = TripLeg(leg_no=leg_no, origin_city="FRA", destination_city=f"C{number % OUTSTATIONS:02d}")
+            leg.flight_details = LegFlight(flight_id=f"X{(3 * number + leg_no) % 240:04d}")
+            trip.trip_details.append(leg)
+        session.add(trip)
+    session.commit()
+
+
+@pytest.fixture(scope="module")
+def client():
+    Base.metadata.create_all(test_engine)
+    with TestSession() as session:
+        seed_master_data(session)
+    app.dependency_overrides[get_db] = override_get_db
+    reference_data.invalidate_snapshot()
+    # No lifespan: the snapshot is loaded from the test database on first use
+    yield TestClient(app)
+    app.dependency_overrides.pop(get_db, None)
+    reference_data.invalidate_snapshot()
+
+
+def count_statements(client, url, **kwargs):
+    counter = StatementCounter()
+    event.listen(test_engine, "before_cursor_execute", counter)
+    try:
+        response = client.get(url, **kwargs)
+    finally:
+        event.remove(test_engine, "before_cursor_execute", counter)
+    assert response.status_code == 200, response.text
+    return counter.count, response.json()
+
+
+FLIGHT_URLS = {
+    "from airport": f"/flights/FRA/airport?local_time={LOCAL_TIME.isoformat()}",
+    "from airport to city": f"/flights/FRA/airport?from_or_to=PAR&ft_type=city"
+                            f"&local_time={LOCAL_TIME.isoformat()}",
+    "to city": f"/flights/PAR/city?mode=Arrival&local_time={ARRIVAL_TIME.isoformat()}",
+}
+
+
+@pytest.mark.parametrize("name", FLIGHT_URLS)
+def test_flight_routes_statements_do_not_grow_with_flights(client, name):
+    client.get("/airports")  # Loads the reference snapshot (time zones of the fetch windows)
+    counts = []
+    for number_of_flights in (9, 240):
+        with TestSession() as session:
+            seed_flights(session, number_of_flights)
+        count, routes = count_statements(client, FLIGHT_URLS[name])
+        assert routes
+        assert all(route["orig_airport_details"]["city"]["country"]["name"] and
+                   route["dest_airport_details"]["city"]["country"]["name"] for route in routes)
+        counts.append(count)
+    assert counts[0] == counts[1]
+    # airport/city lookups, schedules + 6 eager loads (airport, city, country per side), fetch log
+    assert counts[1] <= 12
+
+
+def test_default_page_uses_no_queries_per_airport(client):
+    headers = {"X-Latitude": "49.0", "X-Longitude": "2.5"}
+    client.get("/default", headers=headers)  # Loads the reference snapshot
+    count, airports = count_statements(client, "/default", headers=headers)
+    assert {airport["airport_key"] for airport in airports} == {"CDG", "ORY"}
+    assert count <= 1  # At most the data version check
+
+
+def test_trips_statements_do_not_grow_with_trips(client):
+    counts = []
+    for number_of_trips in (3, 30):
+        with TestSession() as session:
+            seed_flights(session, 240)
+            seed_trips(session, number_of_trips)
+        count, trips = count_statements(client, "/1/trips")
+        assert len(trips) == number_of_trips
+        assert all(leg["flight_details"]["flight_data"]["dest_airport_details"]["city"]["country"]
+                   for trip in trips for leg in trip["trip_details"])
+        counts.append(count)
+    assert counts[0] == counts[1]
+
+
+def test_trips_keyset_pagination(client):
+    with TestSession() as session:
+        seed_flights(session, 240)
+        seed_trips(session, 11)
+    _count, all_trips = count_statements(client, "/1/trips")
+    pages, cursor = [], None
+    while True:
+        url = "/1/trips?limit=4" + (f"&cursor={cursor}" if cursor else "")
+        response = client.get(url)
+        assert response.status_code == 200
+        pages.append([trip["trip_id"] for trip in response.json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert [len(page) for page in pages] == [4, 4, 3]
+    # Newest first, trips created at the same time are ordered by trip_id
+    assert sum(pages, []) == [trip["trip_id"] for trip in all_trips]
+    assert all_trips == sorted(all_trips, key=lambda trip: (trip["created_at"], trip["trip_id"]),
+                               reverse=True)
+    assert client.get("/1/trips?limit=4&cursor=not-a-cursor").status_code == 400
+
+
+def test_home_page_uses_the_cached_profile(client):
+    with TestSession() as session:
+        seed_flights(session, 240)
+        seed_trips(session, 30)
+        session.get(UserSchema, 1).city = "PAR"
+        session.commit()
+    handler.invalidate_user_profile(1)
+    client.get("/1/home")   # Loads the profile and the nearby airports of the home city
+    count, airports = count_statements(client, "/1/home")
+    assert {airport["airport_key"] for airport in airports} == {"CDG", "ORY"}
+    assert count <= 1  # At most the data version check, the trips are never loaded
+    assert client.get("/999/home").status_code == 404
+
+
+def test_trip_patch_statements_do_not_grow_with_changes(client):
+    with TestSession() as session:
+        seed_flights(session, 240)
+        seed_trips(session, 1)
+    trip_id = client.get("/1/trips").json()[0]["trip_id"]
+    counts = []
+    for number_of_legs in (3, 30):
+        patch = {
+            "trip_id": trip_id, "name": f"{number_of_legs} more legs",
+            "trip_leg": [{"leg_no": 100 + number, "origin_city": "FRA", "destination_city": "C05",
+                          "update_mode": "I"} for number in range(number_of_legs)]
+                        + [{"leg_no": 1, "origin_city": "FRA", "destination_city": "C07",
+                            "update_mode": "U"}],
+            "trip_flight": [{"leg_no": 100 + number, "flight_id": f"X{number:04d}",
+                             "update_mode": "I"} for number in range(number_of_legs)]
+                           + [{"leg_no": 2, "flight_id": "X0100", "update_mode": "D"}],
+        }
+        counter = StatementCounter()
+        event.listen(test_engine, "before_cursor_execute", counter)
+        try:
+            response = client.put("/trip", json=patch)
+        finally:
+            event.remove(test_engine, "before_cursor_execute", counter)
+        assert response.status_code == 200, response.text
+        changes = response.json()
+        # Only the changed legs are sent back
+        assert [leg["leg_no"] for leg in changes["changed_legs"]] == \
+               [1] + [100 + number for number in range(number_of_legs)]
+        assert changes["removed_flights"] == [2]
+        counts.append(counter.count)
+
+        delete_legs = {"trip_id": trip_id, "trip_leg": [
+            {"leg_no": 100 + number, "origin_city": "FRA", "destination_city": "C05",
+             "update_mode": "D"} for number in range(number_of_legs)]}
+        response = client.put("/trip", json=delete_legs)
+        assert response.json()["deleted_legs"] == [100 + number for number in range(number_of_legs)]
+        # The flight of leg 2 again, for the next round
+        client.put("/trip", json={"trip_id": trip_id, "trip_flight": [
+            {"leg_no": 2, "flight_id": "X0005", "update_mode": "I"}]})
+    assert counts[0] == counts[1]
+
+    trip = client.get("/1/trips").json()[0]
+    assert trip["name"] == "30 more legs"
+    assert [(leg["leg_no"], leg["destination_city"]) for leg in trip["trip_details"]] == \
+           [(1, "C07"), (2, "C00")]
+    assert client.put("/trip", json={"trip_id": trip_id, "trip_flight": [
+        {"leg_no": 7, "flight_id": "X0005", "update_mode": "U"}]}).status_code == 400
+
+
+def count_delete_statements(client, url, **kwargs):
+    counter = StatementCounter()
+    event.listen(test_engine, "before_cursor_execute", counter)
+    try:
+        response = client.request("DELETE", url, **kwargs)
+    finally:
+        event.remove(test_engine, "before_cursor_execute", counter)
+    assert response.status_code == 200, response.text
+    return counter.count, response.json()
+
+
+def test_deletes_are_set_based(client):
+    counts = []
+    for number_of_trips in (3, 30):
+        with TestSession() as session:
+            seed_flights(session, 240)
+            seed_trips(session, number_of_trips)
+        trip_ids = [trip["trip_id"] for trip in client.get("/1/trips").json()]
+        count, deleted = count_delete_statements(client, "/trip", json=trip_ids[1:] + [999999])
+        assert deleted == {"trips": number_of_trips - 1}
+        counts.append(count)
+        assert [trip["trip_id"] for trip in client.get("/1/trips").json()] == trip_ids[:1]
+    assert counts[0] == counts[1]
+    assert client.delete(f"/trip/{trip_ids[0]}").json() == {"trips": 1}
+    assert client.delete(f"/trip/{trip_ids[0]}").status_code == 404
+
+    with TestSession() as session:
+        seed_trips(session, 30)
+        session.add(UserSchema(id=2, username="other", password="secret"))
+        session.add(TripSchema(user_id=2, name="Kept"))
+        session.commit()
+    count, deleted = count_delete_statements(client, "/user/1")
+    assert deleted == {"users": 1, "trips": 30}
+    assert count <= 4   # Legs, flights, trips, user: nothing is loaded
+    with TestSession() as session:
+        assert session.query(TripLeg).count() == 0
+        assert session.query(LegFlight).count() == 0
+        assert [trip.name for trip in session.query(TripSchema)] == ["Kept"]
+        session.execute(delete(TripSchema))
+        session.execute(delete(UserSchema).where(UserSchema.id == 2))
+        session.commit()
+    assert client.delete("/user/1").status_code == 404
+
+
+def test_trip_import_is_bulk(client):
+    with TestSession() as session:
+        seed_flights(session, 240)
+        seed_trips(session, 0)
+    client.get("/1/trips")  # Loads the reference snapshot
+
+    def trip(name, flight_id="X0001"):
+        return {"user_id": 1, "name": name, "trip_legs": [
+            {"leg_no": 1, "origin_city": "FRA", "destination_city": "PAR", "flight": {"flight_id": flight_id}},
+            {"leg_no": 2, "origin_city": "PAR", "destination_city": "C05", "flight": {"flight_id": "X0002"}},
+        ]}
+
+    counts = []
+    for number_of_trips in (3, 60):
+        counter = StatementCounter()
+        event.listen(test_engine, "before_cursor_execute", counter)
+        try:
+            response = client.post("/trips/import", json=[
+                trip(f"{number_of_trips}-{number}", f"X{number:04d}") for number in range(number_of_trips)])
+        finally:
+            event.remove(test_engine, "before_cursor_execute", counter)
+        assert response.status_code == 200, response.text
+        assert response.json()["created"] == number_of_trips
+        counts.append(counter.count)
+    assert counts[0] == counts[1]
+    # The returned ids belong to the trips at the same position
+    ids = {result["trip_id"]: result["index"] for result in response.json()["results"]}
+    for saved in client.get("/1/trips").json():
+        if saved["trip_id"] in ids:
+            number = ids[saved["trip_id"]]
+            assert saved["name"] == f"60-{number}"
+            assert saved["trip_details"][0]["flight_details"]["flight_id"] == f"X{number:04d}"
+
+    response = client.post("/trips/import", params={"atomic": "true"},
+                           json=[trip("kept"), trip("broken", "NOPE")])
+    assert [result["status"] for result in response.json()["results"]] == ["skipped", "invalid"]
+    rows = "trip,user_id,name,leg_no,origin_city,destination_city,flight_id\n" \
+           "a,1,Alpha,1,FRA,PAR,X0001\na,1,Alpha,2,PAR,C05,X0002\nb,1,Beta,1,FRA,C07,X0003\n"
+    response = client.post("/trips/import", content=rows, headers={"content-type": "text/csv"})
+    assert response.json()["created"] == 2
+    lines = "\n".join(json.dumps(trip(name)) for name in ("one", "two")) + "\nnot json\n"
+    response = client.post("/trips/import", content=lines,
+                           headers={"content-type": "application/x-ndjson"})
+    assert [result["status"] for result in response.json()["results"]] == ["created", "created", "invalid"]
@@ -0,0 +1,147 @@
+"""One session per request.
+The repositories used to share one session for the whole process (a singleton), so concurrent
+requests saw each other's objects and transactions. These tests send concurrent requests of
+different users through the real get_db and check every request gets its own session, sees only
+its own data, and that the sessions are closed and released afterwards (memory stays flat).
+
+Runs against a SQLite file (several connections, unlike the in-memory database of the other tests).
+"""
+import gc
+import os
+import tracemalloc
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend.app import app
+from backend.business_logic import reference_data
+from backend.database.datamanager import UnitOfWork
+from backend.database.orm_models import Base, UserSchema
+from backend.routes import user_endpoints
+from backend.test.test_query_counts import seed_flights, seed_master_data
+
+USERS = 8
+REQUESTS_PER_ROUND = 64
+
+
+class SessionTracker:
+    """Session factory for get_db that remembers the sessions it handed out"""
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+        self.opened = 0
+        self.sessions = weakref.WeakSet()
+
+    def __call__(self):
+        session = self.session_factory()
+        self.opened += 1
+        self.sessions.add(session)
+        return session
+
+
+@pytest.fixture(scope="module")
+def database(tmp_path_factory):
+    path = tmp_path_factory.mktemp("sessions") / "wanderlust.db"
+    engine = create_engine(f"sqlite:///{path}",
+                           connect_args={"check_same_thread": False, "timeout": 30})
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine)
+    with session_factory() as session:
+        seed_master_data(session)
+        seed_flights(session, 30)
+        session.add_all([UserSchema(id=user_id, username=f"user{user_id}", password="secret")
+                         for user_id in range(1, USERS + 1)])
+        session.commit()
+    yield session_factory
+    engine.dispose()
+
+
+@pytest.fixture
+def client(database, monkeypatch):
+    tracker = SessionTracker(database)
+    monkeypatch.setattr(user_endpoints, "SessionLocal", tracker)
+    reference_data.invalidate_snapshot()
+    # No lifespan: the snapshot is loaded from the test database on first use
+    test_client = TestClient(app)
+    test_client.tracker = tracker
+    yield test_client
+    reference_data.invalidate_snapshot()
+
+
+def trip_payload(user_id: int, number: int) -> dict:
+    return {"user_id": user_id, "name": f"User {user_id} trip {number}", "trip_legs": [
+        {"leg_no": 1, "origin_city": "FRA", "destination_city": "PAR",
+         "flight": {"flight_id": f"X{number % 30:04d}"}},
+    ]}
+
+
+def run_round(client, round_number: int):
+    """Every user creates a trip and reads their trips, all at the same time"""
+    def create(user_id):
+        response = client.post("/trip", json=trip_payload(user_id, round_number))
+        assert response.status_code == 200, response.text
+        return response.json()
+
+    def read(user_id):
+        response = client.get(f"/{user_id}/trips")
+        assert response.status_code == 200, response.text
+        return user_id, response.json()
+
+    users = [1 + number % USERS for number in range(REQUESTS_PER_ROUND)]
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        created = list(executor.map(create, range(1, USERS + 1)))
+        reads = list(executor.map(read, users))
+    return created, reads
+
+
+def test_unit_of_work_closes_and_rolls_back(database):
+    with pytest.raises(ZeroDivisionError):
+        with UnitOfWork(session_factory=database) as unit:
+            unit.session.add(UserSchema(id=999, username="ghost", password="secret"))
+            unit.session.flush()
+            1 / 0
+    with UnitOfWork(session_factory=database) as unit:
+        assert unit.session.get(UserSchema, 999) is None
+    with pytest.raises(RuntimeError):
+        unit.session
+
+
+def test_concurrent_requests_do_not_share_sessions(client):
+    tracker = client.tracker
+    for round_number in range(1, 4):
+        created, reads = run_round(client, round_number)
+        assert sorted(trip["user_id"] for trip in created) == list(range(1, USERS + 1))
+        for user_id, trips in reads:
+            # Only the user's own trips, all of them (committed before the reads started)
+            assert {trip["user_id"] for trip in trips} == {user_id}
+            assert len(trips) == round_number
+    assert tracker.opened == 3 * (USERS + REQUESTS_PER_ROUND)
+    gc.collect()
+    # Closed at the end of their request and not referenced by anything afterwards
+    assert len(tracker.sessions) == 0
+
+
+def test_memory_stays_flat_under_load(client):
+    run_round(client, 0)    # Warm up: snapshot, compiled statements, thread pool
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run_round(client, 0)
+        gc.collect()
+        baseline, _peak = tracemalloc.get_traced_memory()
+        for _ in range(5):
+            run_round(client, 0)
+        gc.collect()
+        current, _peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # A leaked session keeps its identity map (users, trips, flights) alive, 5 rounds of
+    # leaked sessions would be several MB
+    assert current - baseline < 1024 * 1024, f"{(current - baseline) / 1024:.0f} KB retained"
+    gc.collect()
+    assert len(client.tracker.sessions) == 0
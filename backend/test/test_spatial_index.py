@@ -0,0 +1,132 @@
+"""Spatial index of the airports against a brute-force haversine over every airport.
+The fixture puts airports on both sides of the antimeridian and near the poles, where the grid
+cells of a search circle wrap around or cover every column.
+"""
+import math
+import random
+
+import pytest
+
+from backend.business_logic.spatial_index import EARTH_RADIUS, AirportSpatialIndex
+
+
+def brute_force_km(latitude, longitude, airport):
+    """Haversine in plain math, independent of the vectorized one of the index"""
+    lat1, lon1 = math.radians(latitude), math.radians(longitude)
+    lat2, lon2 = math.radians(airport["latitude"]), math.radians(airport["longitude"])
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def airport(key, latitude, longitude, tier=None):
+    return {"airport_key": key, "latitude": latitude, "longitude": longitude, "tier": tier}
+
+
+FIXED_AIRPORTS = [
+    # Fiji and Samoa, either side of the antimeridian
+    airport("NAN", -17.76, 177.44, 1),
+    airport("TVU", -16.69, 179.88, 3),
+    airport("APW", -13.83, -171.99, 2),
+    airport("E01", 0.5, 179.7, 2),
+    airport("W01", 0.5, -179.7, 1),
+    # Far north and far south
+    airport("LYR", 78.25, 15.47, 2),
+    airport("NP1", 89.6, 45.0),
+    airport("NP2", 89.4, -135.0),
+    airport("THU", 76.53, -68.70, 3),
+    airport("SP1", -89.9, 139.0),
+    # Frankfurt area, for the ordering
+    airport("FRA", 50.03, 8.57, 1),
+    airport("HHN", 49.95, 7.26, 3),
+    airport("SCN", 49.21, 7.11, 2),
+    airport("FKB", 48.78, 8.08, 2),
+]
+
+
+@pytest.fixture(scope="module")
+def airports():
+    generator = random.Random(7)
+    scattered = [
+        airport(f"R{number:03d}", generator.uniform(-90, 90), generator.uniform(-180, 180),
+                generator.choice((1, 2, 3, None)))
+        for number in range(400)
+    ]
+    return FIXED_AIRPORTS + scattered
+
+
+@pytest.fixture(scope="module", params=[1.0, 5.0], ids=["1 degree cells", "5 degree cells"])
+def index(request, airports):
+    return AirportSpatialIndex(airports, cell_size=request.param)
+
+
+def brute_force_within(airports, latitude, longitude, radius):
+    return {candidate["airport_key"] for candidate in airports
+            if brute_force_km(latitude, longitude, candidate) <= radius}
+
+
+def keys(results):
+    return {candidate["airport_key"] for candidate, _distance in results}
+
+
+QUERIES = [
+    (0.0, 179.9, 200), (0.0, -179.9, 200), (-17.0, 180.0, 400), (-15.0, -175.0, 1000),
+    (89.5, 0.0, 100), (89.5, 100.0, 500), (85.0, -170.0, 1500), (78.0, 15.0, 300),
+    (-89.0, -40.0, 300), (50.0, 8.5, 150), (0.0, 0.0, 20000), (45.0, 179.0, 3000),
+]
+
+
+@pytest.mark.parametrize("latitude, longitude, radius", QUERIES)
+def test_within_radius_matches_brute_force(airports, index, latitude, longitude, radius):
+    results = index.within_radius(latitude, longitude, radius)
+    assert keys(results) == brute_force_within(airports, latitude, longitude, radius)
+    for candidate, distance in results:
+        assert distance == pytest.approx(brute_force_km(latitude, longitude, candidate), abs=1e-6)
+
+
+def test_antimeridian_neighbours_are_found_from_both_sides(index):
+    for longitude in (179.95, -179.95):
+        assert {"E01", "W01"} <= keys(index.within_radius(0.5, longitude, 100))
+    # Fiji from Samoa's side of the date line
+    assert "TVU" in keys(index.within_radius(-16.7, -179.9, 100))
+
+
+def test_high_latitude_circle_covers_every_longitude(index):
+    # NP1 and NP2 are on opposite meridians, about 110 km apart over the pole
+    assert {"NP1", "NP2"} <= keys(index.within_radius(89.9, -90.0, 100))
+    assert "SP1" in keys(index.within_radius(-89.5, -41.0, 100))
+
+
+def test_within_radius_orders_by_tier_then_distance(index):
+    results = index.within_radius(50.0, 8.5, 150)
+    order = [(candidate["tier"] or 3, distance) for candidate, distance in results]
+    assert order == sorted(order)
+    assert [candidate["airport_key"] for candidate, _distance in results][:1] == ["FRA"]
+    limited = index.within_radius(50.0, 8.5, 150, limit=2)
+    assert limited == results[:2]
+
+
+@pytest.mark.parametrize("latitude, longitude, k", [
+    (50.0, 8.5, 10),      # More than the 100 km first circle holds, the radius is doubled
+    (0.0, 180.0, 5),
+    (89.0, 0.0, 8),
+    (-30.0, -120.0, 3),   # Empty first circles
+])
+def test_nearest_matches_brute_force(airports, index, latitude, longitude, k):
+    results = index.nearest(latitude, longitude, k)
+    expected = sorted(brute_force_km(latitude, longitude, candidate) for candidate in airports)[:k]
+    assert len(results) == k
+    assert [distance for _candidate, distance in results] == pytest.approx(expected, abs=1e-6)
+
+
+def test_nearest_with_k_larger_than_the_airports(airports, index):
+    results = index.nearest(10.0, 10.0, len(airports) + 5)
+    assert len(results) == len(airports)
+    distances = [distance for _candidate, distance in results]
+    assert distances == sorted(distances)
+
+
+def test_empty_index():
+    index = AirportSpatialIndex([])
+    assert index.within_radius(0.0, 0.0, 100) == []
+    assert index.nearest(0.0, 0.0, 3) == []
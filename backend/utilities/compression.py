@@ -0,0 +1,168 @@
+"""Response compression (Brotli or gzip, as accepted by the client) for the API.
+Responses with an ETag (the reference data: /airports, /airports/compact) only change with the
+master data version, so their compressed bytes are computed once, at a higher level, and kept in
+an LRU cache by path, query, ETag and encoding. Everything else (flights, trips...) is compressed
+per response. Bodies smaller than COMPRESSION_MIN_SIZE, streamed bodies, responses that are
+already encoded and non-text content are sent as they are.
+
+A compressed response gets a weak ETag (W/"..."), as it is no longer byte-identical to the
+uncompressed one, is_etag_match accepts it in If-None-Match.
+Brotli needs the optional brotli package, without it gzip is used.
+"""
+import gzip
+import os
+import threading
+from collections import OrderedDict
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional, gzip is always available
+    brotli = None
+
+MINIMUM_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+CACHE_BYTES = int(os.getenv("COMPRESSION_CACHE_BYTES", str(32 * 1024 * 1024)))
+THREAD_SIZE = 256 * 1024   # Larger bodies are compressed outside the event loop
+GZIP_LEVELS = (6, 9)        # (per response, cached once)
+BROTLI_QUALITIES = (5, 9)
+COMPRESSIBLE_TYPES = ("application/json", "application/msgpack", "application/javascript",
+                      "application/xml", "text/", "image/svg+xml")
+
+
+def supported_encodings() -> list[str]:
+    """In order of preference"""
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def choose_encoding(accept_encoding: str | None) -> str | None:
+    """Best supported encoding of an Accept-Encoding header, None for identity"""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, parameters = item.strip().partition(";")
+        quality = 1.0
+        parameter = parameters.strip()
+        if parameter.startswith("q="):
+            try:
+                quality = float(parameter[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    candidates = [
+        encoding for encoding in supported_encodings()
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0
+    ]
+    if not candidates:
+        return None
+    # The highest q-value wins, the server's preference breaks ties
+    return max(candidates, key=lambda encoding: accepted.get(encoding, accepted.get("*", 0.0)))
+
+
+def compress(body: bytes, encoding: str, cached: bool = False) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITIES[cached])
+    return gzip.compress(body, compresslevel=GZIP_LEVELS[cached], mtime=0)
+
+
+class CompressedCache:
+    """LRU of compressed bodies, limited by the total size of the bodies"""
+    def __init__(self, max_bytes: int = CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def put(self, key, body: bytes):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._entries[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _key, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = MINIMUM_SIZE, cache: CompressedCache | None = None):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.cache = cache if cache is not None else CompressedCache()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                start = message     # Held back until the body is known
+                return
+            body = message.get("body", b"")
+            if message.get("more_body", False) or not self._compressible(start, body):
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+            headers = MutableHeaders(scope=start)
+            compressed = await self._compress(scope, headers.get("etag"), body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            vary = headers.get("vary")
+            headers["Vary"] = f"{vary}, Accept-Encoding" if vary else "Accept-Encoding"
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                headers["ETag"] = f"W/{etag}"
+            await send(start)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_compressed)
+
+    def _compressible(self, start, body: bytes) -> bool:
+        if start is None or len(body) < self.minimum_size:
+            return False
+        if start["status"] < 200 or start["status"] in (204, 206, 304):
+            return False
+        headers = Headers(raw=start["headers"])
+        if "content-encoding" in headers or "no-transform" in headers.get("cache-control", ""):
+            return False
+        return headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+
+    async def _compress(self, scope, etag: str | None, body: bytes, encoding: str) -> bytes:
+        key = None
+        if etag:
+            key = (scope["path"], scope.get("query_string", b""), etag, encoding)
+            compressed = self.cache.get(key)
+            if compressed is not None:
+                return compressed
+        if len(body) >= THREAD_SIZE:
+            compressed = await run_in_threadpool(compress, body, encoding, key is not None)
+        else:
+            compressed = compress(body, encoding, key is not None)
+        if key is not None:
+            self.cache.put(key, compressed)
+        return compressed
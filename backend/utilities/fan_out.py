@@ -0,0 +1,79 @@
+"""Runs the same provider call for several arguments at once (e.g. the schedules of every airport
+of a metro area) with a bound on the number of parallel calls and a timeout per call.
+Results are yielded in the order they arrive. A call that fails or times out is reported and
+skipped, so the caller still gets the results of the other calls.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+FAN_OUT_WORKERS = int(os.getenv("FAN_OUT_WORKERS", "6"))
+CALL_TIMEOUT = float(os.getenv("PROVIDER_CALL_TIMEOUT", "15"))
+
+
+def fan_out(function, calls: list[tuple], max_workers: int = FAN_OUT_WORKERS,
+            timeout: float = CALL_TIMEOUT):
+    """Generator of (arguments, result) for function(*arguments) of every entry in calls.
+    The timeout of a call starts when a worker picks it up, not when it is queued."""
+    if not calls:
+        return
+    started = {}
+
+    def run(number, arguments):
+        started[number] = time.monotonic()
+        return function(*arguments)
+
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(calls)))
+    futures = {
+        executor.submit(run, number, arguments): (number, arguments)
+        for number, arguments in enumerate(calls)
+    }
+    pending = set(futures)
+    try:
+        while pending:
+            # Wake up when a call completes or when the oldest running call runs out of time
+            deadlines = [started[futures[future][0]] + timeout
+                         for future in pending if futures[future][0] in started]
+            wait_time = max(min(deadlines) - time.monotonic(), 0) if deadlines else timeout
+            done, pending = wait(pending, timeout=wait_time, return_when=FIRST_COMPLETED)
+            for future in done:
+                arguments = futures[future][1]
+                try:
+                    yield arguments, future.result()
+                except Exception as error:
+                    print(f"Call {function.__name__}{arguments} failed:", error)
+
+            now = time.monotonic()
+            for future in list(pending):
+                number, arguments = futures[future]
+                if number in started and now - started[number] > timeout:
+                    # The thread cannot be stopped, its result is just not waited for
+                    pending.discard(future)
+                    print(f"Call {function.__name__}{arguments} timed out after {timeout}s")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+FAILED = object()    # Result of a call that failed or timed out, None is a valid result
+
+
+async def fan_out_async(function, calls: list[tuple], max_workers: int = FAN_OUT_WORKERS,
+                        timeout: float = CALL_TIMEOUT):
+    """Async variant of fan_out for coroutine functions"""
+    semaphore = asyncio.Semaphore(max_workers)
+
+    async def run(arguments):
+        async with semaphore:
+            try:
+                return arguments, await asyncio.wait_for(function(*arguments), timeout)
+            except asyncio.TimeoutError:
+                print(f"Call {function.__name__}{arguments} timed out after {timeout}s")
+            except Exception as error:
+                print(f"Call {function.__name__}{arguments} failed:", error)
+            return arguments, FAILED
+
+    for next_result in asyncio.as_completed([run(arguments) for arguments in calls]):
+        arguments, result = await next_result
+        if result is not FAILED:
+            yield arguments, result
@@ -0,0 +1,172 @@
+"""Local IP address -> location (latitude, longitude, city, country) database.
+Anonymous visitors are located by their IP address. Instead of asking AeroDataBox and abstractapi
+on every page view, the IP ranges of a downloadable geo-IP file are compiled once into sorted
+numpy arrays (start, end and location of every range) which are memory-mapped at runtime, a
+lookup is one binary search (searchsorted). The providers remain as the fallback when there is
+no database or the address is not in it.
+
+The source is the free DB-IP "IP to City Lite" CSV (CC BY 4.0, https://db-ip.com/db/lite.php),
+rows: ip_start, ip_end, continent, country, state/province, city, latitude, longitude
+
+    python -m backend.utilities.geo_ip build dbip-city-lite-2026-10.csv.gz
+    python -m backend.utilities.geo_ip lookup 8.8.8.8
+
+IPv6 ranges are kept by their first 64 bits (the network part), which is all a city level
+location needs.
+"""
+import argparse
+import csv
+import gzip
+import ipaddress
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+
+GEOIP_DIRECTORY = Path(os.getenv(
+    "GEOIP_DATABASE", Path(__file__).resolve().parent.parent / "storage" / "geoip"))
+ARRAYS = ("v4_start", "v4_end", "v4_location", "v6_start", "v6_end", "v6_location",
+          "latitude", "longitude")
+
+
+class GeoLocation(NamedTuple):
+    latitude: float
+    longitude: float
+    city: str | None
+    country: str | None
+
+
+class GeoIPDatabase:
+    def __init__(self, directory: Path = GEOIP_DIRECTORY):
+        # Memory-mapped: opening is instant and the pages are shared between worker processes
+        arrays = {name: np.load(directory / f"{name}.npy", mmap_mode="r") for name in ARRAYS}
+        self.ranges = {
+            4: (arrays["v4_start"], arrays["v4_end"], arrays["v4_location"]),
+            6: (arrays["v6_start"], arrays["v6_end"], arrays["v6_location"]),
+        }
+        self.latitudes = arrays["latitude"]
+        self.longitudes = arrays["longitude"]
+        with open(directory / "places.json", encoding="utf-8") as file:
+            self.places = json.load(file)   # location -> [city, country]
+
+    def __len__(self):
+        return sum(len(starts) for starts, _ends, _locations in self.ranges.values())
+
+    def lookup(self, ip_address: str) -> GeoLocation | None:
+        try:
+            address = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return None
+        if not address.is_global:
+            return None
+        value = int(address) if address.version == 4 else int(address) >> 64
+        starts, ends, locations = self.ranges[address.version]
+        # A scalar of the array type, a Python int would convert the whole array on every lookup
+        index = int(np.searchsorted(starts, starts.dtype.type(value), side="right")) - 1
+        if index < 0 or value > ends[index]:
+            return None
+        location = int(locations[index])
+        city, country = self.places[location]
+        return GeoLocation(float(self.latitudes[location]), float(self.longitudes[location]),
+                           city, country)
+
+
+_database: GeoIPDatabase | None = None
+_loaded = False
+_lock = threading.Lock()
+
+
+def get_database() -> GeoIPDatabase | None:
+    """The database is opened on first use, None if it has not been built"""
+    global _database, _loaded
+    if not _loaded:
+        with _lock:
+            if not _loaded:
+                try:
+                    _database = GeoIPDatabase()
+                except (OSError, ValueError) as error:
+                    print("Geo-IP database not available, the providers are used:", error)
+                _loaded = True
+    return _database
+
+
+def lookup(ip_address: str) -> GeoLocation | None:
+    database = get_database()
+    if database is None:
+        return None
+    return database.lookup(ip_address)
+
+
+def read_rows(source: Path):
+    opener = gzip.open if source.suffix == ".gz" else open
+    with opener(source, "rt", encoding="utf-8", newline="") as file:
+        for row in csv.reader(file):
+            if len(row) < 8 or not row[6] or not row[7]:
+                continue
+            try:
+                start, end = ipaddress.ip_address(row[0]), ipaddress.ip_address(row[1])
+                yield start, end, float(row[6]), float(row[7]), row[5] or None, row[3] or None
+            except ValueError:
+                continue    # Header or broken row
+
+
+def build(source: Path, directory: Path = GEOIP_DIRECTORY):
+    """Compiles the CSV into the arrays of GeoIPDatabase. Neighbouring ranges with the same
+    location are merged, the locations are stored once"""
+    started_at = time.monotonic()
+    places = {}                         # (latitude, longitude, city, country) -> location
+    ranges = {4: [], 6: []}             # version -> [[start, end, location]]
+    for count, (start, end, latitude, longitude, city, country) in enumerate(read_rows(source), 1):
+        location = places.setdefault((latitude, longitude, city, country), len(places))
+        first, last = int(start), int(end)
+        if start.version == 6:
+            first, last = first >> 64, last >> 64
+        version_ranges = ranges[start.version]
+        if version_ranges and version_ranges[-1][2] == location and version_ranges[-1][1] + 1 >= first:
+            version_ranges[-1][1] = max(version_ranges[-1][1], last)
+        elif version_ranges and version_ranges[-1][0] == first:
+            continue    # IPv6 ranges within the same /64, the first one is kept
+        else:
+            version_ranges.append([first, last, location])
+        if count % 500000 == 0:
+            print(f"{count} rows read, {len(places)} locations")
+
+    directory.mkdir(parents=True, exist_ok=True)
+    for version, dtype in ((4, np.uint32), (6, np.uint64)):
+        rows = sorted(ranges[version])
+        np.save(directory / f"v{version}_start.npy", np.array([row[0] for row in rows], dtype=dtype))
+        np.save(directory / f"v{version}_end.npy", np.array([row[1] for row in rows], dtype=dtype))
+        np.save(directory / f"v{version}_location.npy",
+                np.array([row[2] for row in rows], dtype=np.uint32))
+    ordered = sorted(places, key=places.get)
+    np.save(directory / "latitude.npy", np.array([place[0] for place in ordered], dtype=np.float32))
+    np.save(directory / "longitude.npy", np.array([place[1] for place in ordered], dtype=np.float32))
+    with open(directory / "places.json", "w", encoding="utf-8") as file:
+        json.dump([[place[2], place[3]] for place in ordered], file, ensure_ascii=False)
+    print(f"Geo-IP database built in {directory}: {len(ranges[4])} IPv4 and {len(ranges[6])} "
+          f"IPv6 ranges, {len(places)} locations, {time.monotonic() - started_at:.0f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local geo-IP database")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_command = commands.add_parser("build", help="Compile a DB-IP city lite CSV (.csv/.csv.gz)")
+    build_command.add_argument("source", type=Path)
+    build_command.add_argument("--directory", type=Path, default=GEOIP_DIRECTORY)
+    lookup_command = commands.add_parser("lookup", help="Locate IP addresses")
+    lookup_command.add_argument("ip_addresses", nargs="+")
+    args = parser.parse_args(argv)
+    if args.command == "build":
+        build(args.source, args.directory)
+    else:
+        for ip_address in args.ip_addresses:
+            print(ip_address, lookup(ip_address))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,119 @@
+"""Password hashing with scrypt (memory-hard, hashlib/OpenSSL, no extra dependency).
+A stored hash carries its own parameters: scrypt$<log2 n>$<r>$<p>$<salt>$<hash> (base64), so the
+cost can be raised later (PASSWORD_HASH_COST) and older hashes still verify. A login with a hash
+of a different cost, or with a plaintext password of the rows saved before hashing, is
+re-hashed with the current cost (see needs_rehash).
+
+One hash takes tens of milliseconds of CPU and 128 * r * n bytes of memory (16 MB by default).
+Hashing and verification run in a dedicated pool of PASSWORD_HASH_WORKERS workers, which bounds
+the CPU and memory a burst of logins can take, whatever the number of request threads.
+hashlib.scrypt releases the GIL, so threads hash in parallel, a process pool
+(PASSWORD_HASH_EXECUTOR=process) keeps the work off the API processes entirely.
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+SCHEME = "scrypt"
+HASH_COST = int(os.getenv("PASSWORD_HASH_COST", "14"))      # log2 of the scrypt n parameter
+BLOCK_SIZE = int(os.getenv("PASSWORD_HASH_BLOCK_SIZE", "8"))
+PARALLELISM = int(os.getenv("PASSWORD_HASH_PARALLELISM", "1"))
+HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+EXECUTOR_KIND = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")  # thread or process
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+
+def _encode(data: bytes) -> str:
+    return base64.b64encode(data).decode().rstrip("=")
+
+
+def _decode(text: str) -> bytes:
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+def _scrypt(password: str, salt: bytes, cost: int, block_size: int, parallelism: int) -> bytes:
+    n = 1 << cost
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=block_size, p=parallelism,
+                          maxmem=128 * block_size * (n + parallelism + 2) + 1024 * 1024,
+                          dklen=KEY_BYTES)
+
+
+def is_hashed(stored: str | None) -> bool:
+    return bool(stored) and stored.startswith(f"{SCHEME}$")
+
+
+def hash_password(password: str, cost: int | None = None, block_size: int | None = None,
+                  parallelism: int | None = None) -> str:
+    cost = HASH_COST if cost is None else cost
+    block_size = BLOCK_SIZE if block_size is None else block_size
+    parallelism = PARALLELISM if parallelism is None else parallelism
+    salt = os.urandom(SALT_BYTES)
+    key = _scrypt(password, salt, cost, block_size, parallelism)
+    return f"{SCHEME}${cost}${block_size}${parallelism}${_encode(salt)}${_encode(key)}"
+
+
+def verify_password(password: str, stored: str | None) -> bool:
+    if not stored:
+        return False
+    if not is_hashed(stored):
+        # Plaintext of the rows saved before hashing, replaced on the next login
+        return hmac.compare_digest(password.encode(), stored.encode())
+    try:
+        _scheme, cost, block_size, parallelism, salt, key = stored.split("$")
+        expected = _decode(key)
+        computed = _scrypt(password, _decode(salt), int(cost), int(block_size), int(parallelism))
+    except ValueError:
+        return False     # Broken hash, the password cannot match it
+    return hmac.compare_digest(computed, expected)
+
+
+def needs_rehash(stored: str | None) -> bool:
+    """Plaintext or hashed with other parameters than the current ones"""
+    if not is_hashed(stored):
+        return True
+    return stored.split("$")[1:4] != [str(HASH_COST), str(BLOCK_SIZE), str(PARALLELISM)]
+
+
+_executor = None
+_lock = threading.Lock()
+
+
+def get_executor():
+    """The pool is created on first use (process pools cannot be forked at import time)"""
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                if EXECUTOR_KIND == "process":
+                    _executor = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+                else:
+                    _executor = ThreadPoolExecutor(max_workers=HASH_WORKERS,
+                                                   thread_name_prefix="password-hash")
+    return _executor
+
+
+def hash_in_pool(password: str) -> str:
+    """For the sync handlers (already in a request thread), waits for a hashing worker"""
+    return get_executor().submit(hash_password, password).result()
+
+
+def verify_in_pool(password: str, stored: str | None) -> bool:
+    if not is_hashed(stored):
+        return verify_password(password, stored)    # Nothing to compute
+    return get_executor().submit(verify_password, password, stored).result()
+
+
+async def hash_async(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(get_executor(), hash_password, password)
+
+
+async def verify_async(password: str, stored: str | None) -> bool:
+    if not is_hashed(stored):
+        return verify_password(password, stored)
+    return await asyncio.get_running_loop().run_in_executor(
+        get_executor(), verify_password, password, stored)
@@ -1,4 +1,6 @@
+import base64
 import re
+from datetime import datetime
 
 def automate_tripname():
     pass
@@ -27,5 +29,20 @@ def is_email_valid(email_id):
         return False
 
 
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """Opaque keyset pagination cursor, the position of the last row of a page"""
+    raw = f"{created_at.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, row_id = raw.split("|")
+        return datetime.fromisoformat(created_at), int(row_id)
+    except ValueError as error:  # Also covers binascii.Error and UnicodeDecodeError
+        raise ValueError("Invalid Cursor!") from error
+
+
 if __name__ == "__main__":
     print(is_email_valid("Test@test.com"))
\ No newline at end of file
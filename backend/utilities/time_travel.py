@@ -1,4 +1,4 @@
-from datetime import date, datetime, timedelta
+from datetime import date, datetime, time, timedelta
 from pydantic import BaseModel
 
 class DateModel(BaseModel):
@@ -61,6 +61,20 @@ def parse_time(ts_str):
     ts_model = DateModel(ts=ts_str)
     return ts_model.ts.strftime("%H:%M")
 
+def get_schedule_window(start: datetime, window_minutes=720):
+    """Start of the fixed time window (aligned to midnight) containing start. The provider
+    schedules are fetched per window, one call covers a whole window (12 hours at most)"""
+    midnight = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    minutes = (start - midnight) // timedelta(minutes=1)
+    return midnight + timedelta(minutes=minutes - minutes % window_minutes)
+
+def to_time(value):
+    """HH:MM / HH:MM:SS string (as returned by parse_time) to a time object.
+    Drivers like asyncpg do not cast strings to time columns"""
+    if value is None or isinstance(value, time):
+        return value
+    return time.fromisoformat(value)
+
 def get_weekday(ts_str):
     datetime_obj = datetime.fromisoformat(ts_str)
     weekday_number = datetime_obj.isoweekday()
@@ -2,24 +2,49 @@ from fastapi import Request, Header
 from typing import Optional
 
 import requests
+import httpx
 import os
 from dotenv import load_dotenv
 
+from backend.api_requests.http_client import get_provider_client
+from backend.api_requests.single_flight import coalesce, coalesce_async
+
 load_dotenv()
 API_KEY = os.getenv("IP_INTEL_KEY")
 BASE_URL = "https://ip-intelligence.abstractapi.com/v1/?"
 
+@coalesce
 def get_location_from_ip(ip_address):
 
     url = f"{BASE_URL}api_key={API_KEY}&ip_address={ip_address}"
-    response = requests.get(url)
+    try:
+        response = get_provider_client("abstractapi").get(url)
+    except requests.exceptions.RequestException:
+        return None
+    if response.status_code != requests.codes.ok:
+        return None
+    return parse_location(response.json())
+
+
+@coalesce_async
+async def get_location_from_ip_async(ip_address):
+    """Async variant of get_location_from_ip"""
+    url = f"{BASE_URL}api_key={API_KEY}&ip_address={ip_address}"
+    try:
+        response = await get_provider_client("abstractapi").get_async(url)
+    except httpx.HTTPError:
+        return None
     if response.status_code != requests.codes.ok:
         return None
+    return parse_location(response.json())
+
+
+def parse_location(response_json):
     try:
-        location = float(response.json()["location"]["latitude"]) , \
-                   float(response.json()["location"]["longitude"])
+        location = float(response_json["location"]["latitude"]) , \
+                   float(response_json["location"]["longitude"])
         return location
-    except KeyError:
+    except (KeyError, TypeError):
         return None
 
 def get_public_ip():
@@ -66,7 +91,6 @@ async def get_location(
     if client_ip in ("127.0.0.1", "::1"):
         #If the IP is localhost, swap it for your REAL public IP or a sample one
         client_ip = get_public_ip()
-        #return should be a dictionary with location or ip address as key
-        return {"ip": client_ip}
-    return None
+    #return should be a dictionary with location or ip address as key
+    return {"ip": client_ip}
 
@@ -1,26 +1,25 @@
-import { useContext, useEffect, useState } from "react";
-import { TripDetails } from "../context/TripContext";
-import { filterAirports } from "../services/search";
+import { useEffect, useState } from "react";
+import { airportAPI } from "../services/api";
 
 
 export function useAirportSearch() {
     const [searchQuery, setSearchQuery] = useState('')
     const [loading, setLoading] = useState(false)
     const [results, setResults] = useState([])
-    const { allAirports } = useContext(TripDetails)
 
     useEffect(() => {
         if (searchQuery.trim().length < 2) {
             setResults([])
             return
         }
-        function searchAirport() {
+        // Responses can arrive out of order, only the one of the current text is used
+        let current = true
+        async function searchAirport() {
             setLoading(true)
             try {
-                // const data = allAirports
+                const searchResults = await airportAPI.search(searchQuery.trim())
+                if (!current) return
                 // Normalise to flat shape
-                const searchResults = filterAirports(allAirports, searchQuery)
-                // setResults(searchResults)
                 setResults(searchResults.map(a => ({
                     id: a.airport_key,
                     name: a.name,
@@ -32,12 +31,13 @@ export function useAirportSearch() {
                 })))
             } catch (err) {
                 console.error(err)
-                setResults([])
+                if (current) setResults([])
             } finally {
-                setLoading(false)
+                if (current) setLoading(false)
             }
         }
         searchAirport()
+        return () => { current = false }
 
     }, [searchQuery])
 
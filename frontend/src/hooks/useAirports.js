@@ -3,17 +3,21 @@ import { useState, useEffect, useContext } from 'react'
 import { airportAPI } from '../services/api'
 import { TripDetails } from '../context/TripContext'
 
-// Normalise raw API response to a flat shape MapView needs
-function normalise(raw) {
-    return {
-        id: raw.airport_key,
-        name: raw.name,
-        city: raw.city?.name ?? raw.city_key,
-        country: raw.city?.country?.name ?? raw.city?.country_key ?? '',
-        latitude: raw.latitude,
-        longitude: raw.longitude,
-        tier: raw.tier,
-    }
+// Compact API response (columns + lookup tables) to the flat shape MapView needs
+function decodeCompact({ airports, cities, countries }) {
+    return airports.airport_key.map((id, i) => {
+        const city = airports.city[i]
+        const country = city === null ? null : cities.country[city]
+        return {
+            id,
+            name: airports.name[i],
+            city: city === null ? '' : cities.name[city],
+            country: country === null ? '' : countries.name[country] ?? countries.country_key[country],
+            latitude: airports.latitude[i],
+            longitude: airports.longitude[i],
+            tier: airports.tier[i],
+        }
+    })
 }
 
 export function useAirports() {
@@ -26,28 +30,24 @@ export function useAirports() {
 
         let airportFound = airports.find(airport => airport.id === airportId)
         if (airportFound) return
-        airportFound = allAirports.find(airport => airport.airport_key === airportId)
+        airportFound = allAirports.find(airport => airport.id === airportId)
         if (airportFound) {
-            const newAirport = normalise(airportFound)
-            setAirports(prev => [...prev, newAirport])
+            setAirports(prev => [...prev, airportFound])
         }
     }
 
     useEffect(() => {
         async function getAirports() {
             try {
-                let data
                 if (allAirports.length > 0) {
-                    data = allAirports
-                } else {
-                    data = await airportAPI.getAll()
-                    setAllAirports(data)
+                    setAirports(allAirports.filter(airport => airport.tier === 1))
+                    return
                 }
-                // To limit the display of airports on MapView
-                const tier1 = data
-                    .filter(airport => airport.tier === 1)
-                    .map(normalise)
-                setAirports(tier1)
+                // To limit the display of airports on MapView only tier-1 airports are
+                // loaded first, the complete list (for addAirport) follows
+                setAirports(decodeCompact(await airportAPI.getCompact({ tier: 1 })))
+                setLoading(false)
+                setAllAirports(decodeCompact(await airportAPI.getCompact()))
             } catch (err) {
                 setError('Failed to load airports')
                 console.error(err)
@@ -56,12 +56,13 @@ export function useAirports() {
             }
         }
         getAirports()
-    }, [allAirports])
+        // Only on mount, the complete list arriving later must not reset added airports
+    }, [])
 
     return { airports, airportsLoading: loading, error, addAirport }
 }
 
-/* Sample API Data 
+/* Sample API Data (GET /airports, the compact format is described in compact_airports.py)
     "airport_key": "CGN",
     "name": "Cologne/bonn",
     "city_key": "CGN",
@@ -37,10 +37,16 @@ async function request(method, path, body){
 export const airportAPI = {
     // For all airports
     getAll: () => request('GET', '/airports'), 
+    // Compact airports: cities and countries as lookup tables, airports as columns
+    // params: tier, country, bbox (min_lon,min_lat,max_lon,max_lat), fields
+    getCompact: (params = {}) => request('GET', `/airports/compact?${new URLSearchParams(params)}`),
     // For routes from a specific airport  // API can handle city instead of airports
     // accepts query parameter mode for Departure(Default)/Arrival), you can set both arrival
     // and destinations(either city or airport), and also date and time
-    getRoutes: (iata)=>request('GET', `/flights/${iata}/airport`) 
+    getRoutes: (iata)=>request('GET', `/flights/${iata}/airport`),
+    // Autocomplete, ranked by the backend (exact code, tier, then how well the text matches)
+    search: (query, limit = 10) =>
+        request('GET', `/airports/search?q=${encodeURIComponent(query)}&limit=${limit}`)
 }
 
 export const userAPI = {